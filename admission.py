@@ -0,0 +1,188 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from .config import env_float, env_int
+
+
+class Overloaded(RuntimeError):
+    def __init__(self, message: str, retry_after_s: int = 1, endpoint_class: str = ''):
+        super().__init__(message)
+        self.retry_after_s = max(1, int(retry_after_s))
+        self.endpoint_class = endpoint_class
+
+
+class _Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class _ClassState:
+    def __init__(self, name: str, limit: int, max_queue: int, max_queue_per_client: int, wait_timeout_s: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_client = max(1, max_queue_per_client)
+        self.wait_timeout_s = wait_timeout_s
+        self.active = 0
+        self.queued = 0
+        self.waiters: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self.stats = {
+            'admitted': 0,
+            'queued_total': 0,
+            'rejected_queue_full': 0,
+            'rejected_timeout': 0,
+            'wait_time_s': 0.0,
+            'max_wait_s': 0.0,
+            'service_time_s': 0.0,
+            'completed': 0,
+            'max_queue_depth': 0,
+        }
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data['wait_time_s'] = round(data['wait_time_s'], 6)
+        data['max_wait_s'] = round(data['max_wait_s'], 6)
+        data['service_time_s'] = round(data['service_time_s'], 6)
+        data['avg_wait_s'] = round(self.stats['wait_time_s'] / self.stats['admitted'], 6) if self.stats['admitted'] else 0.0
+        data['avg_service_s'] = round(self.avg_service_s(), 6)
+        data['active'] = self.active
+        data['queue_depth'] = self.queued
+        data['queued_clients'] = len(self.waiters)
+        data['limit'] = self.limit
+        data['max_queue'] = self.max_queue
+        return data
+
+    def avg_service_s(self) -> float:
+        if not self.stats['completed']:
+            return 1.0
+        return self.stats['service_time_s'] / self.stats['completed']
+
+    def retry_after(self) -> int:
+        return int(math.ceil(self.avg_service_s() * (self.queued + 1) / self.limit))
+
+    def grant_next(self) -> None:
+        while self.active < self.limit and self.waiters:
+            client, queue = next(iter(self.waiters.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.waiters.move_to_end(client)
+            else:
+                del self.waiters[client]
+            waiter.granted = True
+            self.active += 1
+            waiter.event.set()
+
+
+class AdmissionController:
+    def __init__(self, classes: dict[str, dict] | None = None):
+        self._lock = threading.Lock()
+        self._classes: dict[str, _ClassState] = {}
+        for name, cfg in (classes or {}).items():
+            self.configure(name, **cfg)
+
+    def configure(
+        self,
+        name: str,
+        *,
+        limit: int = 1,
+        max_queue: int = 16,
+        max_queue_per_client: int = 4,
+        wait_timeout_s: float = 30.0,
+    ) -> None:
+        with self._lock:
+            state = _ClassState(name, limit, max_queue, max_queue_per_client, wait_timeout_s)
+            previous = self._classes.get(name)
+            if previous is not None:
+                state.active = previous.active
+                state.queued = previous.queued
+                state.waiters = previous.waiters
+                state.stats = previous.stats
+            self._classes[name] = state
+            state.grant_next()
+
+    def _state(self, name: str) -> _ClassState:
+        state = self._classes.get(name)
+        if state is None:
+            raise KeyError(f'Unknown endpoint class: {name}')
+        return state
+
+    def acquire(self, name: str, client: str = '', timeout_s: float | None = None) -> float:
+        started = time.monotonic()
+        with self._lock:
+            state = self._state(name)
+            if state.active < state.limit and not state.waiters:
+                state.active += 1
+                state.stats['admitted'] += 1
+                return 0.0
+            client_queue = state.waiters.get(client)
+            if state.queued >= state.max_queue or (client_queue and len(client_queue) >= state.max_queue_per_client):
+                state.stats['rejected_queue_full'] += 1
+                raise Overloaded(
+                    f'Too many concurrent {name} requests; queue is full.', state.retry_after(), name
+                )
+            waiter = _Waiter()
+            state.waiters.setdefault(client, deque()).append(waiter)
+            state.queued += 1
+            state.stats['queued_total'] += 1
+            state.stats['max_queue_depth'] = max(state.stats['max_queue_depth'], state.queued)
+            wait_timeout = state.wait_timeout_s if timeout_s is None else timeout_s
+        waiter.event.wait(wait_timeout)
+        waited = time.monotonic() - started
+        with self._lock:
+            state = self._state(name)
+            if not waiter.granted:
+                queue = state.waiters.get(client)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    state.queued -= 1
+                    if not queue:
+                        del state.waiters[client]
+                state.stats['rejected_timeout'] += 1
+                raise Overloaded(
+                    f'Timed out after {waited:.1f}s waiting for a {name} slot.', state.retry_after(), name
+                )
+            state.stats['admitted'] += 1
+            state.stats['wait_time_s'] += waited
+            state.stats['max_wait_s'] = max(state.stats['max_wait_s'], waited)
+        return waited
+
+    def release(self, name: str, service_time_s: float = 0.0) -> None:
+        with self._lock:
+            state = self._state(name)
+            state.active = max(0, state.active - 1)
+            state.stats['completed'] += 1
+            state.stats['service_time_s'] += service_time_s
+            state.grant_next()
+
+    @contextmanager
+    def slot(self, name: str, client: str = '', timeout_s: float | None = None):
+        waited = self.acquire(name, client, timeout_s)
+        started = time.monotonic()
+        try:
+            yield waited
+        finally:
+            self.release(name, time.monotonic() - started)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: state.snapshot() for name, state in self._classes.items()}
+
+
+def build_admission_controller() -> AdmissionController:
+    classes = {}
+    for name, default_limit in (('query', 2), ('intent', 4), ('kpi', 4)):
+        prefix = f'ADMISSION_{name.upper()}'
+        classes[name] = {
+            'limit': env_int(f'{prefix}_CONCURRENCY', default_limit),
+            'max_queue': env_int(f'{prefix}_MAX_QUEUE', 16),
+            'max_queue_per_client': env_int(f'{prefix}_MAX_QUEUE_PER_CLIENT', 4),
+            'wait_timeout_s': env_float(f'{prefix}_WAIT_TIMEOUT_S', 30.0),
+        }
+    return AdmissionController(classes)
@@ -0,0 +1,438 @@
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from . import example_store, prompt_builder
+from .embedding_index import to_blob
+from .intent_compiler import compile_intent
+from .schema_catalog import get_catalog
+from .serializers import (
+    FormatUnavailable,
+    arrow_ipc,
+    column_converters,
+    column_types,
+    columnar,
+    convert_rows,
+    format_rows,
+    json_rows,
+)
+from .sql_engine import enforce_sql_requirements, extract_sql_snippet, validate_sql
+
+SCHEMA_VERSION = 1
+DEFAULT_SCALES = (1000, 10000, 100000)
+EMBEDDING_DIM = 256
+SEED = 1729
+
+_METRICS = ['revenue', 'margin', 'tcv', 'deal count', 'average deal size', 'pipeline']
+_DIMENSIONS = ['customer', 'sales person', 'revenue type', 'deal stage', 'month', 'quarter', 'region']
+_PERIODS = ['this year', 'last year', 'this quarter', 'last quarter', 'ytd', 'last 90 days', 'Q2 2025', '2024']
+_SHAPES = [
+    'top {n} {dim}s by {metric} {period}',
+    'total {metric} by {dim} {period}',
+    'show {metric} for {dim} {period}',
+    'which {dim} had the lowest {metric} {period}',
+    'compare {metric} {period} versus budget by {dim}',
+    'how many deals closed {period} per {dim}',
+]
+_COLUMNS = ['customer_name', 'salesperson_name', 'deal_stage_name', 'close_date', 'updated_at',
+            'revenue_thousands', 'margin_thousands', 'deal_count', 'win_rate', 'notes']
+_COLUMN_TYPES = [str, str, str, date, datetime, Decimal, float, int, float, str]
+
+
+def synthetic_questions(count: int, seed: int = SEED) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        rng.choice(_SHAPES).format(
+            n=rng.choice((3, 5, 10, 20)),
+            dim=rng.choice(_DIMENSIONS),
+            metric=rng.choice(_METRICS),
+            period=rng.choice(_PERIODS),
+        ) + ('' if i % 7 else f' for account {i}')
+        for i in range(count)
+    ]
+
+
+def synthetic_embedding(text: str, dim: int = EMBEDDING_DIM) -> list[float]:
+    vec = np.zeros(dim, dtype=np.float32)
+    for token in (text or '').lower().split():
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], 'little') % dim
+        vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+    return vec.tolist()
+
+
+def synthetic_rows(cells: int, seed: int = SEED) -> tuple[list[str], list[tuple]]:
+    rng = random.Random(seed)
+    width = len(_COLUMNS)
+    base_date = date(2024, 1, 1)
+    base_ts = datetime(2024, 1, 1, 9, 30)
+    rows = []
+    for i in range(max(1, cells // width)):
+        rows.append(
+            (
+                f'Customer {rng.randint(1, 5000)}',
+                f'Rep {rng.randint(1, 200)}',
+                rng.choice(('Qualify', 'Proposal', 'Negotiation', 'Closed Won', 'Closed Lost')),
+                base_date + timedelta(days=i % 730),
+                base_ts + timedelta(minutes=i),
+                Decimal(rng.randint(0, 10_000_000)) / 100,
+                rng.uniform(-500.0, 5000.0),
+                rng.randint(0, 40),
+                None if i % 11 == 0 else rng.random(),
+                None if i % 3 else 'renewal',
+            )
+        )
+    return list(_COLUMNS), rows
+
+
+def sample_sql(limit: int = 10) -> str:
+    intent = {
+        'metric': 'revenue',
+        'group_by': ['customer'],
+        'order_by': {'field': 'revenue', 'direction': 'desc'},
+        'limit': limit,
+        'time_period': 'this year',
+    }
+    return compile_intent(intent, 'GBR', 'GBP', 'pipeline')
+
+
+def large_sql(copies: int) -> str:
+    base = sample_sql().rstrip().rstrip(';')
+    ctes = ',\n'.join(f'part_{i} AS (\n{base}\n)' for i in range(copies))
+    union = '\nUNION ALL\n'.join(f'SELECT * FROM part_{i}' for i in range(copies))
+    return f'WITH {ctes}\n{union}'
+
+
+def measure(fn, *, repeat: int = 5, min_time_s: float = 0.05, max_number: int = 100000) -> dict:
+    number = 1
+    while number < max_number:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= min_time_s:
+            break
+        number *= 10
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - started) / number)
+    timings.sort()
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min_s': timings[0],
+        'median_s': timings[len(timings) // 2],
+        'mean_s': sum(timings) / len(timings),
+        'max_s': timings[-1],
+    }
+
+
+class Suite:
+    def __init__(self, repeat: int, pattern: str | None = None):
+        self.repeat = repeat
+        self.pattern = pattern
+        self.results: list[dict] = []
+
+    def run(self, name: str, fn, *, params: dict | None = None, cells: int | None = None, repeat: int | None = None) -> None:
+        if self.pattern and self.pattern not in name:
+            return
+        result = {'name': name, 'params': params or {}}
+        result.update(measure(fn, repeat=repeat or self.repeat))
+        if cells:
+            result['cells'] = cells
+            result['per_million_cells_s'] = result['median_s'] * 1_000_000 / cells
+        self.results.append(result)
+        print(f"{name:<48} {json.dumps(params or {}):<32} median {result['median_s'] * 1000:10.3f} ms", file=sys.stderr)
+
+
+def bench_sql(suite: Suite) -> None:
+    small = sample_sql()
+    big = large_sql(25)
+    for label, sql in (('typical', small), ('large', big)):
+        params = {'size': label, 'chars': len(sql)}
+        suite.run('sql_engine.validate_sql', lambda sql=sql: validate_sql(sql), params=params)
+        wrapped = f'Here is the query you asked for:\n```sql\n{sql}\n```\nIt filters by region.'
+        suite.run('sql_engine.extract_sql_snippet', lambda text=wrapped: extract_sql_snippet(text), params=params)
+        suite.run(
+            'sql_engine.enforce_sql_requirements',
+            lambda sql=sql: enforce_sql_requirements(sql, 'GBR', 'GBP', 'pipeline'),
+            params=params,
+        )
+
+
+def _seed_examples(path: str, questions: list[str], sql: str) -> None:
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('DELETE FROM sql_examples')
+        conn.executemany(
+            'INSERT INTO sql_examples (question, sql_text, tags, notes, embedding_blob) VALUES (?, ?, ?, ?, ?)',
+            ((q, sql, '[]', '', to_blob(synthetic_embedding(q))) for q in questions),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def bench_similarity(suite: Suite, scales: tuple[int, ...]) -> None:
+    original_path = example_store.EXAMPLES_DB_PATH
+    original_embed = example_store.embed_text
+    sql = sample_sql()
+    probe = 'top 10 customers by revenue this year'
+    with tempfile.TemporaryDirectory(prefix='bench_examples_') as tmp:
+        example_store.EXAMPLES_DB_PATH = os.path.join(tmp, 'examples.db')
+        try:
+            example_store.init_examples_db()
+            for scale in scales:
+                questions = synthetic_questions(scale)
+                suite.run(
+                    'example_store._score_similarity',
+                    lambda questions=questions: [example_store._score_similarity(probe, q) for q in questions],
+                    params={'examples': scale},
+                    repeat=3,
+                )
+                rows = list(enumerate(questions, start=1))
+                suite.run(
+                    'example_store._lexical_scores',
+                    lambda rows=rows: example_store._lexical_scores(probe, rows, 0.35),
+                    params={'examples': scale},
+                    repeat=3,
+                )
+                _seed_examples(example_store.EXAMPLES_DB_PATH, questions, sql)
+
+                example_store.embed_text = synthetic_embedding
+                example_store.find_similar_examples(probe)
+                suite.run(
+                    'example_store.find_similar_examples',
+                    lambda: example_store.find_similar_examples(probe),
+                    params={'examples': scale, 'mode': 'vector'},
+                    repeat=3,
+                )
+
+                def unavailable(text):
+                    raise RuntimeError('embeddings disabled for benchmark')
+
+                example_store.embed_text = unavailable
+                suite.run(
+                    'example_store.find_similar_examples',
+                    lambda: example_store.find_similar_examples(probe),
+                    params={'examples': scale, 'mode': 'lexical'},
+                    repeat=3,
+                )
+        finally:
+            example_store.EXAMPLES_DB_PATH = original_path
+            example_store.embed_text = original_embed
+            example_store._INIT['path'] = None
+            example_store._INDEX.clear()
+            example_store._INDEX.version = None
+
+
+def bench_serializers(suite: Suite, cells: int) -> None:
+    columns, rows = synthetic_rows(cells)
+    total = len(rows) * len(columns)
+    params = {'rows': len(rows), 'columns': len(columns)}
+    suite.run('serializers.json_rows', lambda: json_rows(rows), params=params, cells=total, repeat=3)
+    suite.run('serializers.format_rows', lambda: format_rows(rows, columns), params=params, cells=total)
+    converted = json_rows(rows)
+    suite.run(
+        'serializers.json_rows+json.dumps',
+        lambda: json.dumps({'columns': columns, 'rows': json_rows(rows)}),
+        params=params,
+        cells=total,
+        repeat=3,
+    )
+    suite.run('json.dumps', lambda: json.dumps(converted), params=dict(params, input='json_rows'), cells=total, repeat=3)
+
+    types = column_types(list(zip(columns, _COLUMN_TYPES)))
+    converters = column_converters(types)
+    suite.run('serializers.convert_rows', lambda: convert_rows(rows, converters), params=params, cells=total, repeat=3)
+    fetched = convert_rows(rows, converters)
+    suite.run('serializers.columnar', lambda: columnar(fetched, len(columns)), params=params, cells=total, repeat=3)
+    suite.run(
+        'serializers.rows+json.dumps',
+        lambda: json.dumps({'columns': columns, 'rows': fetched}),
+        params=dict(params, input='convert_rows'),
+        cells=total,
+        repeat=3,
+    )
+    suite.run(
+        'serializers.columnar+json.dumps',
+        lambda: json.dumps({'columns': columns, 'types': types, 'data': columnar(fetched, len(columns))}),
+        params=dict(params, input='convert_rows'),
+        cells=total,
+        repeat=3,
+    )
+    data = columnar(fetched, len(columns))
+    try:
+        arrow_ipc(columns, data, types)
+    except FormatUnavailable:
+        print('warning: pyarrow not installed; skipping serializers.arrow_ipc', file=sys.stderr)
+        return
+    suite.run(
+        'serializers.columnar+arrow_ipc',
+        lambda: arrow_ipc(columns, columnar(fetched, len(columns)), types),
+        params=dict(params, input='convert_rows'),
+        cells=total,
+        repeat=3,
+    )
+
+
+def bench_prompts(suite: Suite) -> None:
+    catalog = get_catalog()
+    schema_text = catalog.full_text if catalog is not None else ''
+    if not schema_text:
+        print('warning: Schema_table_details.txt not found; SQL prompts are built without schema text', file=sys.stderr)
+    question = 'top 10 customers by revenue this year'
+    intent = {
+        'metric': 'revenue',
+        'group_by': ['customer'],
+        'order_by': {'field': 'revenue', 'direction': 'desc'},
+        'limit': 10,
+        'time_period': 'this year',
+        'filters': [{'field': 'deal_stage_name', 'op': '=', 'value': 'Closed Won'}],
+        '_raw': '{"metric": "revenue"}',
+    }
+    examples = [{'question': q, 'sql_text': sample_sql()} for q in synthetic_questions(3)]
+    columns, rows = synthetic_rows(5000)
+    preview = json_rows(rows[:500])
+    kpis = {f'kpi_{i}': i * 1234.5 for i in range(20)}
+    tables = {'by_month': {'columns': columns, 'rows': json_rows(rows[:24])}}
+    common = {'country_code': 'GBR', 'reporting_currency': 'GBP', 'stage_bucket': 'pipeline'}
+    cases = [
+        ('date_rules_for', lambda: prompt_builder.date_rules_for(schema_text)),
+        ('intent_json', lambda: prompt_builder.intent_json(intent)),
+        ('build_intent_prompt', lambda: prompt_builder.build_intent_prompt(question, stage_bucket='pipeline')),
+        ('build_intent_prompt_analytics', lambda: prompt_builder.build_intent_prompt_analytics(question, stage_bucket='pipeline')),
+        ('build_router_prompt', lambda: prompt_builder.build_router_prompt(question)),
+        (
+            'build_sql_from_intent_prompt',
+            lambda: prompt_builder.build_sql_from_intent_prompt(
+                intent=intent, schema_text=schema_text, few_shot_examples=examples, **common
+            ),
+        ),
+        (
+            'build_sql_from_analytics_prompt',
+            lambda: prompt_builder.build_sql_from_analytics_prompt(
+                question=question, intent=intent, schema_text=schema_text, few_shot_examples=examples, **common
+            ),
+        ),
+        ('build_narrative_prompt', lambda: prompt_builder.build_narrative_prompt(question, columns, preview)),
+        (
+            'build_sql_validator_prompt',
+            lambda: prompt_builder.build_sql_validator_prompt(
+                question=question, intent=intent, proposed_sql=sample_sql(), few_shot_examples=examples, **common
+            ),
+        ),
+        (
+            'build_analytics_summary_prompt',
+            lambda: prompt_builder.build_analytics_summary_prompt(question, 'budget_gap', kpis, tables),
+        ),
+    ]
+    for name, fn in cases:
+        suite.run(f'prompt_builder.{name}', fn, params={'schema_chars': len(schema_text)} if 'sql' in name else None)
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[dict]:
+    previous = {(r['name'], json.dumps(r['params'], sort_keys=True)): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in current['results']:
+        before = previous.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+        if not before or not before.get('median_s'):
+            continue
+        ratio = result['median_s'] / before['median_s']
+        result['baseline_median_s'] = before['median_s']
+        result['ratio'] = round(ratio, 4)
+        if ratio > threshold:
+            regressions.append(result)
+    return regressions
+
+
+def run(scales: tuple[int, ...] = DEFAULT_SCALES, cells: int = 1_000_000, repeat: int = 5, pattern: str | None = None) -> dict:
+    suite = Suite(repeat, pattern)
+    bench_sql(suite)
+    bench_prompts(suite)
+    bench_serializers(suite, cells)
+    bench_similarity(suite, scales)
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'scales': list(scales),
+            'cells': cells,
+            'repeat': repeat,
+        },
+        'results': suite.results,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline micro-benchmarks for the SQL assistant hot paths.')
+    parser.add_argument('--output', '-o', help='Write JSON results to this file (default: stdout).')
+    parser.add_argument('--scales', default=','.join(str(s) for s in DEFAULT_SCALES), help='Example-store sizes, comma separated.')
+    parser.add_argument('--cells', type=int, default=1_000_000, help='Cells in the synthetic result set.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', dest='pattern', help='Only run benchmarks whose name contains this text.')
+    parser.add_argument('--quick', action='store_true', help='Smoke run: 1k examples, 100k cells, 3 repeats.')
+    parser.add_argument('--compare', help='Baseline JSON from an earlier run; adds ratios and flags regressions.')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Median ratio treated as a regression.')
+    args = parser.parse_args(argv)
+
+    scales = tuple(int(s) for s in args.scales.split(',') if s.strip())
+    cells, repeat = args.cells, args.repeat
+    if args.quick:
+        scales, cells, repeat = (1000,), 100_000, 3
+    report = run(scales, cells, repeat, args.pattern)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        regressions = compare(report, baseline, args.threshold)
+        report['comparison'] = {
+            'baseline_commit': baseline.get('meta', {}).get('commit'),
+            'threshold': args.threshold,
+            'regressions': [{'name': r['name'], 'params': r['params'], 'ratio': r['ratio']} for r in regressions],
+        }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            handle.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,13 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import traceback
+from collections.abc import Mapping
+from types import MappingProxyType
 
-from .config import BUSINESS_RULES_PATH, log_error
+from .config import BUSINESS_RULES_PATH, env_float, log_error
 
 DEFAULT_BUSINESS_RULES = {
     'defaults': {
@@ -32,88 +36,269 @@ DEFAULT_BUSINESS_RULES = {
     },
 }
 
-_CACHE = {'data': None, 'at': 0.0}
+STAGE_MODES = ('none', 'in', 'not_in')
+_NO_STAGE_BUCKET_TEXT = 'No stage bucket filter selected. Do not force a stage filter unless explicitly required by intent.'
 
 
-def get_business_rules() -> dict:
-    now = time.time()
-    if _CACHE['data'] and now - _CACHE['at'] < 10:
-        return _CACHE['data']
-    rules = DEFAULT_BUSINESS_RULES
-    if os.path.exists(BUSINESS_RULES_PATH):
-        try:
-            with open(BUSINESS_RULES_PATH, 'r', encoding='utf-8') as handle:
-                loaded = json.load(handle)
-            if isinstance(loaded, dict):
-                rules = loaded
-        except Exception:
-            log_error(traceback.format_exc())
-    _CACHE['data'] = rules
-    _CACHE['at'] = now
-    return rules
+class InvalidBusinessRules(RuntimeError):
+    pass
 
 
-def normalize_region(region: str | None) -> str:
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _quoted(values: list[str]) -> str:
+    return ', '.join("'" + value.replace("'", "''") + "'" for value in values)
+
+
+def _stage_text(rule: dict) -> str:
+    mode = str(rule.get('mode', 'in')).lower()
+    values = [str(v) for v in rule.get('values', [])]
+    if mode == 'none':
+        return _NO_STAGE_BUCKET_TEXT
+    if not values:
+        return 'No stage filter.'
+    if mode == 'not_in':
+        return f'ds.deal_stage_name NOT IN ({_quoted(values)})'
+    return f'ds.deal_stage_name IN ({_quoted(values)})'
+
+
+def _stage_filter(rule: dict) -> str | None:
+    mode = str(rule.get('mode', 'none')).lower()
+    values = [str(v) for v in rule.get('values', [])]
+    if mode == 'none' or not values:
+        return None
+    operator = 'NOT IN' if mode == 'not_in' else 'IN'
+    return f'{operator} ({_quoted(values)})'
+
+
+class CompiledRules(Mapping):
+    def __init__(self, data: dict, source: str = 'defaults', digest: str | None = None):
+        self._data = _freeze(data)
+        self.source = source
+        self.digest = digest
+        self._material = json.dumps(data, sort_keys=True, ensure_ascii=True)
+        self.fingerprint = hashlib.sha256(self._material.encode('utf-8')).hexdigest()[:16]
+        self.compiled_at = time.time()
+        defaults = data.get('defaults', {})
+        allowed = data.get('allowed', {})
+        mappings = data.get('mappings', {})
+        self.regions = frozenset(allowed.get('regions', []))
+        self.reporting_currencies = frozenset(allowed.get('reporting_currencies', []))
+        self.stage_buckets = frozenset(allowed.get('stage_buckets', []))
+        self.default_region = str(defaults.get('region', 'GBR')).upper()
+        self.default_reporting_currency = str(defaults.get('reporting_currency', 'GBP')).upper()
+        self.default_stage_bucket = str(defaults.get('stage_bucket', 'not_applied')).lower()
+        self.country_codes = MappingProxyType(
+            {key: str(value).upper() for key, value in mappings.get('region_to_country_code', {}).items()}
+        )
+        self.legal_entity_name = str(data.get('constraints', {}).get('legal_entity_name', 'HubSpot'))
+        rules = data.get('stage_buckets', {})
+        self.stage_rule_texts = MappingProxyType({name: _stage_text(rule) for name, rule in rules.items()})
+        self.stage_filters = MappingProxyType({name: _stage_filter(rule) for name, rule in rules.items()})
+        self.stage_predicates = MappingProxyType(
+            {name: f'ds.deal_stage_name {clause}' if clause else '1=1' for name, clause in self.stage_filters.items()}
+        )
+        self.kpi_combinations = tuple(
+            (str(region).upper(), str(currency).upper(), str(bucket).lower())
+            for region in allowed.get('regions', [])
+            for currency in allowed.get('reporting_currencies', [])
+            for bucket in allowed.get('stage_buckets', [])
+        )
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def to_dict(self) -> dict:
+        return json.loads(self._material)
+
+
+def validate_rules(data) -> list[str]:
+    if not isinstance(data, dict):
+        return ['Business rules must be a JSON object.']
+    errors = []
+    sections = {}
+    for section in ('defaults', 'allowed', 'mappings', 'constraints', 'stage_buckets'):
+        value = data.get(section, {})
+        if not isinstance(value, dict):
+            errors.append(f'{section} must be an object.')
+            value = {}
+        sections[section] = value
+    allowed = sections['allowed']
+    for key in ('regions', 'reporting_currencies', 'stage_buckets'):
+        values = allowed.get(key, [])
+        if not isinstance(values, list) or not values or not all(isinstance(v, str) and v for v in values):
+            errors.append(f'allowed.{key} must be a non-empty list of strings.')
+            allowed = {**allowed, key: []}
+    defaults = sections['defaults']
+    for key, allowed_key, fold in (
+        ('region', 'regions', str.upper),
+        ('reporting_currency', 'reporting_currencies', str.upper),
+        ('stage_bucket', 'stage_buckets', str.lower),
+    ):
+        value = defaults.get(key)
+        values = allowed.get(allowed_key, [])
+        if value is not None and values and fold(str(value)) not in values:
+            errors.append(f'defaults.{key} {value!r} is not in allowed.{allowed_key}.')
+    country_codes = sections['mappings'].get('region_to_country_code', {})
+    if not isinstance(country_codes, dict):
+        errors.append('mappings.region_to_country_code must be an object.')
+    name = sections['constraints'].get('legal_entity_name', 'HubSpot')
+    if not isinstance(name, str) or not name.strip():
+        errors.append('constraints.legal_entity_name must be a non-empty string.')
+    buckets = sections['stage_buckets']
+    for bucket in allowed.get('stage_buckets', []):
+        if bucket not in buckets:
+            errors.append(f'stage_buckets has no rule for allowed bucket {bucket!r}.')
+    for bucket, rule in buckets.items():
+        if not isinstance(rule, dict):
+            errors.append(f'stage_buckets.{bucket} must be an object.')
+            continue
+        if str(rule.get('mode', 'in')).lower() not in STAGE_MODES:
+            errors.append(f"stage_buckets.{bucket}.mode must be one of {', '.join(STAGE_MODES)}.")
+        values = rule.get('values', [])
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            errors.append(f'stage_buckets.{bucket}.values must be a list of strings.')
+    return errors
+
+
+def compile_rules(data: dict, source: str = 'defaults', digest: str | None = None) -> CompiledRules:
+    errors = validate_rules(data)
+    if errors:
+        raise InvalidBusinessRules(' '.join(errors))
+    return CompiledRules(data, source, digest)
+
+
+_RULES = {'rules': None, 'mtime': None, 'digest': None, 'checked_at': 0.0, 'check_interval_s': None}
+_RULES_LOCK = threading.Lock()
+_stats = {'loads': 0, 'reloads': 0, 'unchanged': 0, 'rejected': 0, 'last_error': None, 'last_rejected_at': None}
+
+
+def _read_rules_file() -> tuple[float | None, bytes | None]:
+    try:
+        mtime = os.path.getmtime(BUSINESS_RULES_PATH)
+    except OSError:
+        return None, None
+    with open(BUSINESS_RULES_PATH, 'rb') as handle:
+        return mtime, handle.read()
+
+
+def _reload(mtime: float | None, raw: bytes | None) -> None:
+    current = _RULES['rules']
+    _RULES['mtime'] = mtime
+    if raw is None:
+        if current is None or current.source != 'defaults':
+            _RULES['rules'] = compile_rules(DEFAULT_BUSINESS_RULES)
+            _RULES['digest'] = None
+            _stats['loads'] += 1
+        return
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest == _RULES['digest']:
+        _stats['unchanged'] += 1
+        return
+    _RULES['digest'] = digest
+    try:
+        compiled = compile_rules(json.loads(raw.decode('utf-8')), source=BUSINESS_RULES_PATH, digest=digest)
+    except Exception as exc:
+        log_error(traceback.format_exc())
+        _stats['rejected'] += 1
+        _stats['last_error'] = str(exc)
+        _stats['last_rejected_at'] = time.time()
+        if current is None:
+            _RULES['rules'] = compile_rules(DEFAULT_BUSINESS_RULES)
+        return
+    _RULES['rules'] = compiled
+    _stats['loads' if current is None else 'reloads'] += 1
+    _stats['last_error'] = None
+
+
+def get_business_rules() -> CompiledRules:
+    rules = _RULES['rules']
+    now = time.monotonic()
+    if rules is not None and now - _RULES['checked_at'] < _RULES['check_interval_s']:
+        return rules
+    with _RULES_LOCK:
+        if _RULES['check_interval_s'] is None:
+            _RULES['check_interval_s'] = env_float('BUSINESS_RULES_CHECK_INTERVAL_S', 2.0)
+        if _RULES['rules'] is None or now - _RULES['checked_at'] >= _RULES['check_interval_s']:
+            _RULES['checked_at'] = now
+            try:
+                mtime, raw = (None, None)
+                if _RULES['rules'] is None or os.path.getmtime(BUSINESS_RULES_PATH) != _RULES['mtime']:
+                    mtime, raw = _read_rules_file()
+                    _reload(mtime, raw)
+            except FileNotFoundError:
+                _reload(None, None)
+            except OSError:
+                log_error(traceback.format_exc())
+                if _RULES['rules'] is None:
+                    _RULES['rules'] = compile_rules(DEFAULT_BUSINESS_RULES)
+        return _RULES['rules']
+
+
+def stats() -> dict:
     rules = get_business_rules()
-    defaults = rules.get('defaults', {})
-    allowed = set(rules.get('allowed', {}).get('regions', []))
+    with _RULES_LOCK:
+        data = dict(_stats)
+    data['source'] = rules.source
+    data['fingerprint'] = rules.fingerprint
+    data['compiled_at'] = rules.compiled_at
+    data['check_interval_s'] = _RULES['check_interval_s']
+    return data
+
+
+def compiled_rules(rules: Mapping | None) -> CompiledRules:
+    if isinstance(rules, CompiledRules):
+        return rules
+    if rules:
+        return CompiledRules(dict(rules))
+    return get_business_rules()
+
+
+def normalize_region(region: str | None, rules: Mapping | None = None) -> str:
+    rules = compiled_rules(rules)
     code = (region or '').strip().upper()
-    if code in allowed:
-        return code
-    return str(defaults.get('region', 'GBR')).upper()
+    return code if code in rules.regions else rules.default_region
 
 
-def normalize_reporting_currency(code: str | None) -> str:
-    rules = get_business_rules()
-    defaults = rules.get('defaults', {})
-    allowed = set(rules.get('allowed', {}).get('reporting_currencies', []))
+def normalize_reporting_currency(code: str | None, rules: Mapping | None = None) -> str:
+    rules = compiled_rules(rules)
     value = (code or '').strip().upper()
-    if value in allowed:
-        return value
-    return str(defaults.get('reporting_currency', 'GBP')).upper()
+    return value if value in rules.reporting_currencies else rules.default_reporting_currency
 
 
-def normalize_stage_bucket(stage_bucket: str | None) -> str:
-    rules = get_business_rules()
-    defaults = rules.get('defaults', {})
-    allowed = set(rules.get('allowed', {}).get('stage_buckets', []))
+def normalize_stage_bucket(stage_bucket: str | None, rules: Mapping | None = None) -> str:
+    rules = compiled_rules(rules)
     value = (stage_bucket or '').strip().lower().replace(' ', '_')
-    if value in allowed:
-        return value
-    return str(defaults.get('stage_bucket', 'not_applied')).lower()
+    return value if value in rules.stage_buckets else rules.default_stage_bucket
 
 
-def country_code_for_region(region: str) -> str:
-    mappings = get_business_rules().get('mappings', {}).get('region_to_country_code', {})
-    return str(mappings.get(region, region)).upper()
+def country_code_for_region(region: str, rules: Mapping | None = None) -> str:
+    return compiled_rules(rules).country_codes.get(region) or str(region).upper()
 
 
-def legal_entity_name() -> str:
-    return str(get_business_rules().get('constraints', {}).get('legal_entity_name', 'HubSpot'))
+def legal_entity_name(rules: Mapping | None = None) -> str:
+    return compiled_rules(rules).legal_entity_name
 
 
-def stage_bucket_rule_text(stage_bucket: str) -> str:
-    rule = get_business_rules().get('stage_buckets', {}).get(stage_bucket, {})
-    mode = str(rule.get('mode', 'in')).lower()
-    values = [str(v) for v in rule.get('values', [])]
-    if mode == 'none':
-        return 'No stage bucket filter selected. Do not force a stage filter unless explicitly required by intent.'
-    if not values:
-        return 'No stage filter.'
-    quoted = ', '.join(f"'{v}'" for v in values)
-    if mode == 'not_in':
-        return f'ds.deal_stage_name NOT IN ({quoted})'
-    return f'ds.deal_stage_name IN ({quoted})'
+def stage_bucket_rule_text(stage_bucket: str, rules: Mapping | None = None) -> str:
+    return compiled_rules(rules).stage_rule_texts.get(stage_bucket, 'No stage filter.')
 
 
-def stage_bucket_predicate(stage_bucket: str, alias: str = 'ds') -> str:
-    rule = get_business_rules().get('stage_buckets', {}).get(stage_bucket, {})
-    mode = str(rule.get('mode', 'none')).lower()
-    values = [str(v) for v in rule.get('values', [])]
-    if mode == 'none' or not values:
-        return '1=1'
-    quoted = ', '.join(f"'{v}'" for v in values)
-    col = f'{alias}.deal_stage_name'
-    if mode == 'not_in':
-        return f'{col} NOT IN ({quoted})'
-    return f'{col} IN ({quoted})'
+def stage_bucket_predicate(stage_bucket: str, alias: str = 'ds', rules: Mapping | None = None) -> str:
+    rules = compiled_rules(rules)
+    if alias == 'ds':
+        return rules.stage_predicates.get(stage_bucket, '1=1')
+    clause = rules.stage_filters.get(stage_bucket)
+    return f'{alias}.deal_stage_name {clause}' if clause else '1=1'
@@ -6,6 +6,10 @@ LOG_PATH = os.path.join(BASE_DIR, 'server_error.log')
 SCHEMA_DETAILS_PATH = os.path.join(BASE_DIR, 'Schema_table_details.txt')
 BUSINESS_RULES_PATH = os.path.join(BASE_DIR, 'business_rules.json')
 EXAMPLES_DB_PATH = os.path.join(BASE_DIR, 'sql_examples.db')
+LLM_CACHE_DB_PATH = os.path.join(BASE_DIR, 'llm_cache.db')
+RESULT_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'result_snapshots')
+REPLICA_PATH = os.path.join(BASE_DIR, 'replica.duckdb')
+SCHEMA_CACHE_PATH = os.path.join(BASE_DIR, 'schema_cache.json')
 
 
 def load_env(path: str = ENV_PATH) -> None:
@@ -28,3 +32,17 @@ def log_error(message: str) -> None:
                 handle.write('\n')
     except Exception:
         pass
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
@@ -1,13 +1,20 @@
+import math
 import os
+import threading
 import time
-import traceback
 
 import pyodbc
 
-from .config import SCHEMA_DETAILS_PATH, log_error
+from .config import SCHEMA_DETAILS_PATH, env_float, env_int
+from .metrics import ROWS_RETURNED, span
+from .pool import ConnectionPool
+from .query_budget import QueryBudget, QueryBudgetExceeded, Watchdog, count_query, record
+from .result_cache import estimate_rows_bytes
+from .serializers import column_converters, column_types, convert_rows
 
 TABLE_ALLOWLIST = {'grp.FactSale'}
-_SCHEMA_CACHE = {'text': None, 'at': 0.0}
+_POOL = {'pool': None}
+_POOL_LOCK = threading.Lock()
 
 
 def get_connection():
@@ -34,39 +41,229 @@ def get_connection():
     return pyodbc.connect(conn_str)
 
 
-def get_schema_text() -> str:
-    now = time.time()
-    if _SCHEMA_CACHE['text'] and now - _SCHEMA_CACHE['at'] < 300:
-        return _SCHEMA_CACHE['text']
-    conn = get_connection()
-    cursor = conn.cursor()
+def build_pool(factory=None) -> ConnectionPool:
+    return ConnectionPool(
+        factory or get_connection,
+        min_size=env_int('FABRIC_POOL_MIN', 0),
+        max_size=env_int('FABRIC_POOL_MAX', 4),
+        acquire_timeout_s=env_float('FABRIC_POOL_ACQUIRE_TIMEOUT_S', 30.0),
+        max_idle_s=env_float('FABRIC_POOL_MAX_IDLE_S', 300.0),
+        max_lifetime_s=env_float('FABRIC_POOL_MAX_LIFETIME_S', 1800.0),
+        ping_after_s=env_float('FABRIC_POOL_PING_AFTER_S', 30.0),
+        maintenance_interval_s=env_float('FABRIC_POOL_MAINTENANCE_S', 60.0),
+    )
+
+
+def get_pool() -> ConnectionPool:
+    pool = _POOL['pool']
+    if pool is not None:
+        return pool
+    with _POOL_LOCK:
+        if _POOL['pool'] is None:
+            _POOL['pool'] = build_pool()
+        return _POOL['pool']
+
+
+def set_pool(pool: ConnectionPool | None) -> ConnectionPool | None:
+    with _POOL_LOCK:
+        previous = _POOL['pool']
+        _POOL['pool'] = pool
+    return previous
+
+
+def pooled_connection(timeout_s: float | None = None):
+    return get_pool().connection(timeout_s=timeout_s)
+
+
+def pool_stats() -> dict:
+    pool = _POOL['pool']
+    return pool.stats() if pool is not None else {}
+
+
+def _set_query_timeout(conn, timeout_s: float | None) -> None:
     try:
-        cursor.execute(
-            '''
-            SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE
-            FROM INFORMATION_SCHEMA.COLUMNS
-            ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
-            '''
-        )
-    except Exception:
-        log_error(traceback.format_exc())
-        conn.close()
-        raise
-    rows = cursor.fetchall()
-    conn.close()
-    tables: dict[str, list[str]] = {}
-    for schema, table, column, dtype in rows:
-        key = f'{schema}.{table}'
-        if TABLE_ALLOWLIST and key not in TABLE_ALLOWLIST:
-            continue
-        tables.setdefault(key, []).append(f'{column} ({dtype})')
-    lines = ['Database schema:']
-    for table, cols in tables.items():
-        lines.append(f'Table {table}: ' + ', '.join(cols))
-    text = '\n'.join(lines)
-    _SCHEMA_CACHE['text'] = text
-    _SCHEMA_CACHE['at'] = now
-    return text
+        conn.timeout = int(math.ceil(timeout_s)) if timeout_s else 0
+    except (AttributeError, TypeError, pyodbc.Error):
+        pass
+
+
+def budget_error(watchdog: Watchdog, budget: QueryBudget, sql_text: str, started: float) -> QueryBudgetExceeded:
+    elapsed = round(time.monotonic() - started, 3)
+    if watchdog.reason == 'cancelled':
+        record('cancelled', budget, sql_text, elapsed_s=elapsed)
+        return QueryBudgetExceeded('Query cancelled.', 'cancelled', budget)
+    record('timeouts', budget, sql_text, elapsed_s=elapsed)
+    return QueryBudgetExceeded(
+        f'Query exceeded the {budget.timeout_s:g}s time budget for {budget.route} and was cancelled.', 'timeout', budget
+    )
+
+
+def fetch_within_budget(
+    cursor, columns: list[str], budget: QueryBudget, sql_text: str, types: list[str] | None = None
+) -> list[tuple]:
+    rows: list[tuple] = []
+    batch_size = min(1000, budget.max_rows + 1)
+    budget.column_types = types or column_types(cursor.description)
+    converters = column_converters(budget.column_types)
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        batch = convert_rows(batch, converters)
+        room = budget.max_rows - len(rows)
+        if len(batch) > room:
+            rows.extend(batch[:room])
+            budget.row_count = len(rows)
+            budget.bytes += estimate_rows_bytes(columns, batch[:room])
+            budget.mark_truncated('max_rows', sql_text)
+            break
+        rows.extend(batch)
+        budget.row_count = len(rows)
+        budget.bytes += estimate_rows_bytes(columns, batch)
+        if budget.bytes > budget.max_bytes:
+            budget.mark_truncated('max_bytes', sql_text)
+            break
+    if budget.truncated:
+        try:
+            cursor.cancel()
+        except Exception:
+            pass
+    return rows
+
+
+def run_query_budgeted(
+    sql_text: str,
+    budget: QueryBudget,
+    params=None,
+    cancel_event: threading.Event | None = None,
+) -> tuple[list[str], list[tuple]]:
+    count_query()
+    started = time.monotonic()
+    with pooled_connection() as conn:
+        _set_query_timeout(conn, budget.timeout_s)
+        cursor = conn.cursor()
+        watchdog = Watchdog(cursor, budget, cancel_event)
+        try:
+            with watchdog:
+                try:
+                    with span('cursor_execute'):
+                        if params is None:
+                            cursor.execute(sql_text)
+                        else:
+                            cursor.execute(sql_text, params)
+                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                    with span('fetch'):
+                        rows = fetch_within_budget(cursor, columns, budget, sql_text) if columns else []
+                except Exception as exc:
+                    if watchdog.reason:
+                        raise budget_error(watchdog, budget, sql_text, started) from exc
+                    raise
+                if watchdog.reason:
+                    raise budget_error(watchdog, budget, sql_text, started)
+        finally:
+            cursor.close()
+            _set_query_timeout(conn, None)
+    budget.elapsed_s = round(time.monotonic() - started, 3)
+    ROWS_RETURNED.inc(len(rows))
+    return columns, rows
+
+
+def run_query(sql_text: str, params=None, timeout_s: float | None = None) -> tuple[list[str], list[tuple]]:
+    with pooled_connection(timeout_s=timeout_s) as conn:
+        cursor = conn.cursor()
+        try:
+            with span('cursor_execute'):
+                if params is None:
+                    cursor.execute(sql_text)
+                else:
+                    cursor.execute(sql_text, params)
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            with span('fetch'):
+                rows = convert_rows(cursor.fetchall(), column_converters(column_types(cursor.description)))
+        finally:
+            cursor.close()
+    ROWS_RETURNED.inc(len(rows))
+    return columns, rows
+
+
+def stream_query(
+    sql_text: str,
+    *,
+    batch_size: int = 500,
+    max_rows: int | None = None,
+    params=None,
+    budget: QueryBudget | None = None,
+    cancel_event: threading.Event | None = None,
+):
+    if budget is not None:
+        count_query()
+    started = time.monotonic()
+    with pooled_connection() as conn:
+        if budget is not None:
+            _set_query_timeout(conn, budget.timeout_s)
+        cursor = conn.cursor()
+        watchdog = Watchdog(cursor, budget, cancel_event) if budget is not None else None
+        if watchdog is not None:
+            watchdog.__enter__()
+        try:
+            if params is None:
+                cursor.execute(sql_text)
+            else:
+                cursor.execute(sql_text, params)
+            columns = [desc[0] for desc in cursor.description] if cursor.description else []
+            converters = column_converters(column_types(cursor.description))
+            yield 'columns', columns
+            row_count = 0
+            truncated_reason = None
+            while columns:
+                want = batch_size
+                if max_rows is not None:
+                    remaining = max_rows - row_count
+                    if remaining <= 0:
+                        if cursor.fetchone() is not None:
+                            truncated_reason = 'max_rows'
+                        break
+                    want = min(batch_size, remaining)
+                batch = cursor.fetchmany(want)
+                if not batch:
+                    break
+                batch = convert_rows(batch, converters)
+                row_count += len(batch)
+                ROWS_RETURNED.inc(len(batch))
+                yield 'rows', batch
+                if budget is not None:
+                    budget.row_count = row_count
+                    budget.bytes += estimate_rows_bytes(columns, batch)
+                    if budget.bytes > budget.max_bytes:
+                        truncated_reason = 'max_bytes'
+                        break
+            if truncated_reason:
+                try:
+                    cursor.cancel()
+                except Exception:
+                    pass
+                if budget is not None:
+                    budget.row_count = row_count
+                    budget.mark_truncated(truncated_reason, sql_text)
+            yield 'end', {'row_count': row_count, 'truncated': truncated_reason is not None, 'truncated_reason': truncated_reason}
+        except GeneratorExit:
+            try:
+                cursor.cancel()
+            except Exception:
+                pass
+            if budget is not None:
+                record('cancelled', budget, sql_text, reason='client_disconnected', elapsed_s=round(time.monotonic() - started, 3))
+            raise
+        except Exception as exc:
+            if watchdog is not None and watchdog.reason:
+                raise budget_error(watchdog, budget, sql_text, started) from exc
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.__exit__(None, None, None)
+            cursor.close()
+            if budget is not None:
+                _set_query_timeout(conn, None)
 
 
 def get_schema_details_text() -> str | None:
@@ -75,22 +272,3 @@ def get_schema_details_text() -> str | None:
     with open(SCHEMA_DETAILS_PATH, 'r', encoding='utf-8') as handle:
         content = handle.read().strip()
     return content or None
-
-
-def list_tables() -> list[str]:
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''
-        SELECT TABLE_SCHEMA, TABLE_NAME
-        FROM INFORMATION_SCHEMA.TABLES
-        WHERE TABLE_TYPE = 'BASE TABLE'
-        ORDER BY TABLE_SCHEMA, TABLE_NAME
-        '''
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    tables = [f'{row[0]}.{row[1]}' for row in rows]
-    if TABLE_ALLOWLIST:
-        tables = [name for name in tables if name in TABLE_ALLOWLIST]
-    return tables
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+import traceback
+
+from . import example_store
+from .config import env_float, env_int, log_error
+
+
+class EmbeddingBackfill:
+    def __init__(self, interval_s: float = 300.0, max_rows: int = 500, batch_size: int | None = None):
+        self.interval_s = interval_s
+        self.max_rows = max(1, max_rows)
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._forced = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats = {'runs': 0, 'embedded': 0, 'failed': 0, 'errors': 0, 'triggers': 0, 'suppressed_wakes': 0}
+        self._backoff_until = 0.0
+        self._last = {'run_at': None, 'duration_s': None, 'error': None, 'pending': None}
+
+    def run_once(self) -> dict:
+        with self._run_lock:
+            started = time.monotonic()
+            try:
+                result = example_store.backfill_embeddings(self.max_rows, self.batch_size)
+            except Exception as exc:
+                log_error(traceback.format_exc())
+                result = {'selected': 0, 'embedded': 0, 'failed': 0, 'error': str(exc), 'pending': None}
+            with self._lock:
+                self._stats['runs'] += 1
+                self._stats['embedded'] += result['embedded']
+                self._stats['failed'] += result['failed']
+                if result['error']:
+                    self._stats['errors'] += 1
+                self._last = {
+                    'run_at': time.time(),
+                    'duration_s': round(time.monotonic() - started, 3),
+                    'error': result['error'],
+                    'pending': result['pending'],
+                }
+            return result
+
+    def trigger(self) -> None:
+        with self._lock:
+            self._stats['triggers'] += 1
+        self._forced.set()
+        example_store.BACKFILL_NEEDED.set()
+
+    def _wait(self, backoff: bool) -> None:
+        # After a failed run, wakes from request traffic are ignored until the interval passes; trigger() still works.
+        deadline = time.monotonic() + self.interval_s
+        with self._lock:
+            self._backoff_until = time.time() + self.interval_s if backoff else 0.0
+        while not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not example_store.BACKFILL_NEEDED.wait(remaining):
+                break
+            if not backoff or self._forced.is_set() or self._stop.is_set():
+                break
+            example_store.BACKFILL_NEEDED.clear()
+            with self._lock:
+                self._stats['suppressed_wakes'] += 1
+        with self._lock:
+            self._backoff_until = 0.0
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            example_store.BACKFILL_NEEDED.clear()
+            self._forced.clear()
+            result = self.run_once()
+            if result['embedded'] and result['pending'] and not result['error']:
+                continue
+            self._wait(backoff=bool(result['error']) or (result['failed'] > 0 and not result['embedded']))
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='embedding-backfill', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        example_store.BACKFILL_NEEDED.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data.update({f'last_{key}': value for key, value in self._last.items()})
+            data['backoff_until'] = self._backoff_until or None
+        data['interval_s'] = self.interval_s
+        data['max_rows'] = self.max_rows
+        data['worker_running'] = bool(self._thread and self._thread.is_alive())
+        try:
+            data['pending'] = example_store.pending_embeddings()
+        except Exception:
+            log_error(traceback.format_exc())
+        return data
+
+
+def build_embedding_backfill() -> EmbeddingBackfill:
+    return EmbeddingBackfill(
+        interval_s=env_float('EMBEDDING_BACKFILL_INTERVAL_S', 300.0),
+        max_rows=env_int('EMBEDDING_BACKFILL_MAX_ROWS', 500),
+    )
+
+
+if __name__ == '__main__':
+    worker = build_embedding_backfill()
+    while True:
+        report = worker.run_once()
+        print(json.dumps(report))
+        if report['error'] or not report['embedded'] or not report['pending']:
+            break
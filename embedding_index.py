@@ -0,0 +1,130 @@
+import threading
+
+import numpy as np
+
+
+def to_blob(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_blob(blob) -> np.ndarray | None:
+    if not blob or len(blob) % 4:
+        return None
+    vec = np.frombuffer(blob, dtype=np.float32)
+    return vec if vec.size else None
+
+
+def _normalized(vec) -> np.ndarray | None:
+    arr = np.asarray(vec, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(arr))
+    if not arr.size or norm == 0.0:
+        return None
+    return arr / norm
+
+
+class EmbeddingIndex:
+    def __init__(self, capacity: int = 1024):
+        self._lock = threading.RLock()
+        self._capacity = max(1, capacity)
+        self._dim = None
+        self._matrix = None
+        self._ids = np.zeros(self._capacity, dtype=np.int64)
+        self._count = 0
+        self._pos: dict[int, int] = {}
+        self.version = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def dim(self) -> int | None:
+        return self._dim
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dim = None
+            self._matrix = None
+            self._count = 0
+            self._pos.clear()
+
+    def _grow(self, needed: int) -> None:
+        if needed <= self._capacity and self._matrix is not None:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        matrix = np.zeros((capacity, self._dim), dtype=np.float32)
+        ids = np.zeros(capacity, dtype=np.int64)
+        if self._matrix is not None:
+            matrix[: self._count] = self._matrix[: self._count]
+            ids[: self._count] = self._ids[: self._count]
+        self._matrix = matrix
+        self._ids = ids
+        self._capacity = capacity
+
+    def bulk_load(self, ids: list[int], vectors: list) -> None:
+        with self._lock:
+            self.clear()
+            normalized = [(int(i), _normalized(v)) for i, v in zip(ids, vectors)]
+            normalized = [(i, v) for i, v in normalized if v is not None]
+            if not normalized:
+                return
+            dims = {}
+            for _, v in normalized:
+                dims[v.size] = dims.get(v.size, 0) + 1
+            self._dim = max(dims, key=dims.get)
+            normalized = [(i, v) for i, v in normalized if v.size == self._dim]
+            self._grow(len(normalized))
+            self._matrix[: len(normalized)] = np.stack([v for _, v in normalized])
+            self._ids[: len(normalized)] = [i for i, _ in normalized]
+            self._count = len(normalized)
+            self._pos = {i: n for n, (i, _) in enumerate(normalized)}
+
+    def upsert(self, example_id: int, vector) -> bool:
+        vec = _normalized(vector)
+        if vec is None:
+            return False
+        with self._lock:
+            if self._dim is None:
+                self._dim = vec.size
+            if vec.size != self._dim:
+                return False
+            example_id = int(example_id)
+            pos = self._pos.get(example_id)
+            if pos is None:
+                self._grow(self._count + 1)
+                pos = self._count
+                self._count += 1
+                self._pos[example_id] = pos
+                self._ids[pos] = example_id
+            self._matrix[pos] = vec
+            return True
+
+    def remove(self, example_id: int) -> bool:
+        with self._lock:
+            pos = self._pos.pop(int(example_id), None)
+            if pos is None:
+                return False
+            last = self._count - 1
+            if pos != last:
+                self._matrix[pos] = self._matrix[last]
+                moved = int(self._ids[last])
+                self._ids[pos] = moved
+                self._pos[moved] = pos
+            self._count = last
+            return True
+
+    def search(self, query_vector, top_k: int = 3, min_score: float = -1.0) -> list[tuple[int, float]]:
+        query = _normalized(query_vector)
+        with self._lock:
+            if query is None or not self._count or query.size != self._dim or top_k <= 0:
+                return []
+            scores = self._matrix[: self._count] @ query
+            ids = self._ids[: self._count].copy()
+        k = min(top_k, scores.size)
+        if k < scores.size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(scores.size)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] >= min_score]
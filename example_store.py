@@ -1,10 +1,20 @@
+import base64
 import json
 import sqlite3
+import threading
 from difflib import SequenceMatcher
-from math import sqrt
 
 from .config import EXAMPLES_DB_PATH
-from .gemini_client import embed_text
+from .embedding_index import EmbeddingIndex, from_blob, to_blob
+from .gemini_client import EMBEDDING_MODEL, embed_batch_size, embed_text, embed_texts
+from .metrics import traced
+from .question_cache import normalize_question
+from .request_context import RequestContext, memoize
+
+_INDEX = EmbeddingIndex()
+_INIT = {'path': None}
+_INIT_LOCK = threading.Lock()
+BACKFILL_NEEDED = threading.Event()
 
 
 def _connect():
@@ -12,44 +22,124 @@ def _connect():
 
 
 def init_examples_db() -> None:
-    conn = _connect()
-    cur = conn.cursor()
-    cur.execute(
-        '''
-        CREATE TABLE IF NOT EXISTS sql_examples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question TEXT NOT NULL,
-            sql_text TEXT NOT NULL,
-            tags TEXT,
-            notes TEXT,
-            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    if _INIT['path'] == EXAMPLES_DB_PATH:
+        return
+    with _INIT_LOCK:
+        if _INIT['path'] == EXAMPLES_DB_PATH:
+            return
+        conn = _connect()
+        cur = conn.cursor()
+        cur.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS sql_examples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                sql_text TEXT NOT NULL,
+                tags TEXT,
+                notes TEXT,
+                created_at TEXT NOT NULL DEFAULT (datetime('now'))
+            )
+            '''
         )
-        '''
-    )
-    cur.execute("PRAGMA table_info(sql_examples)")
-    cols = {row[1] for row in cur.fetchall()}
-    if 'embedding' not in cols:
-        cur.execute('ALTER TABLE sql_examples ADD COLUMN embedding TEXT')
-    conn.commit()
-    conn.close()
+        cur.execute("PRAGMA table_info(sql_examples)")
+        cols = {row[1] for row in cur.fetchall()}
+        if 'embedding' not in cols:
+            cur.execute('ALTER TABLE sql_examples ADD COLUMN embedding TEXT')
+        if 'embedding_blob' not in cols:
+            cur.execute('ALTER TABLE sql_examples ADD COLUMN embedding_blob BLOB')
+        if 'embedding_model' not in cols:
+            cur.execute('ALTER TABLE sql_examples ADD COLUMN embedding_model TEXT')
+        cur.execute('CREATE TABLE IF NOT EXISTS sql_examples_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        cur.execute("INSERT OR IGNORE INTO sql_examples_meta (key, value) VALUES ('version', 0)")
+        for name, event in (
+            ('sql_examples_ver_ins', 'AFTER INSERT'),
+            ('sql_examples_ver_del', 'AFTER DELETE'),
+            ('sql_examples_ver_upd', 'AFTER UPDATE OF embedding_blob, question, sql_text'),
+        ):
+            cur.execute(
+                f'''
+                CREATE TRIGGER IF NOT EXISTS {name} {event} ON sql_examples
+                BEGIN
+                    UPDATE sql_examples_meta SET value = value + 1 WHERE key = 'version';
+                END
+                '''
+            )
+        legacy = cur.execute(
+            'SELECT id, embedding FROM sql_examples WHERE embedding_blob IS NULL AND embedding IS NOT NULL'
+        ).fetchall()
+        for row_id, emb_raw in legacy:
+            try:
+                blob = to_blob(json.loads(emb_raw))
+            except Exception:
+                continue
+            cur.execute('UPDATE sql_examples SET embedding_blob = ?, embedding = NULL WHERE id = ?', (blob, row_id))
+        conn.commit()
+        conn.close()
+        _INIT['path'] = EXAMPLES_DB_PATH
+
+
+def _store_version(cur) -> int:
+    row = cur.execute("SELECT value FROM sql_examples_meta WHERE key = 'version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _ensure_index(cur) -> EmbeddingIndex:
+    version = _store_version(cur)
+    if _INDEX.version == version:
+        return _INDEX
+    with _INIT_LOCK:
+        if _INDEX.version != version:
+            rows = cur.execute('SELECT id, embedding_blob FROM sql_examples WHERE embedding_blob IS NOT NULL').fetchall()
+            ids = [row[0] for row in rows]
+            vectors = [from_blob(row[1]) for row in rows]
+            pairs = [(i, v) for i, v in zip(ids, vectors) if v is not None]
+            _INDEX.bulk_load([i for i, _ in pairs], [v for _, v in pairs])
+            _INDEX.version = version
+    return _INDEX
+
+
+def _apply_local_change(cur, before: int, change) -> None:
+    after = _store_version(cur)
+    with _INIT_LOCK:
+        if _INDEX.version is not None and _INDEX.version == before and after == before + 1:
+            change(_INDEX)
+            _INDEX.version = after
+        else:
+            _INDEX.version = None
 
 
 def add_example(question: str, sql_text: str, tags=None, notes: str | None = None) -> int:
     init_examples_db()
     tags_json = json.dumps(tags or [])
-    embedding_json = None
+    embedding = None
     try:
-        embedding_json = json.dumps(embed_text(question.strip()))
+        embedding = embed_text(question.strip())
     except Exception:
-        embedding_json = None
+        embedding = None
     conn = _connect()
     cur = conn.cursor()
+    before = _store_version(cur)
     cur.execute(
-        'INSERT INTO sql_examples (question, sql_text, tags, notes, embedding) VALUES (?, ?, ?, ?, ?)',
-        (question.strip(), sql_text.strip(), tags_json, (notes or '').strip(), embedding_json),
+        '''
+        INSERT INTO sql_examples (question, sql_text, tags, notes, embedding_blob, embedding_model)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''',
+        (
+            question.strip(),
+            sql_text.strip(),
+            tags_json,
+            (notes or '').strip(),
+            to_blob(embedding) if embedding else None,
+            EMBEDDING_MODEL if embedding else None,
+        ),
     )
     row_id = int(cur.lastrowid)
     conn.commit()
+    if embedding:
+        _apply_local_change(cur, before, lambda index: index.upsert(row_id, embedding))
+    else:
+        _apply_local_change(cur, before, lambda index: None)
+        BACKFILL_NEEDED.set()
     conn.close()
     return row_id
 
@@ -60,7 +150,7 @@ def list_examples(limit: int = 200) -> list[dict]:
     cur = conn.cursor()
     cur.execute(
         '''
-        SELECT id, question, sql_text, tags, notes, created_at, embedding
+        SELECT id, question, sql_text, tags, notes, created_at, embedding_blob IS NOT NULL
         FROM sql_examples
         ORDER BY id DESC
         LIMIT ?
@@ -69,38 +159,187 @@ def list_examples(limit: int = 200) -> list[dict]:
     )
     rows = cur.fetchall()
     conn.close()
-    items = []
-    for row in rows:
+    return [_row_to_item(row) for row in rows]
+
+
+def _row_to_item(row) -> dict:
+    tags = []
+    try:
+        tags = json.loads(row[3] or '[]')
+    except Exception:
         tags = []
-        try:
-            tags = json.loads(row[3] or '[]')
-        except Exception:
-            tags = []
-        items.append(
-            {
-                'id': row[0],
-                'question': row[1],
-                'sql_text': row[2],
-                'tags': tags,
-                'notes': row[4],
-                'created_at': row[5],
-                'embedding': row[6],
-            }
-        )
-    return items
+    return {
+        'id': row[0],
+        'question': row[1],
+        'sql_text': row[2],
+        'tags': tags,
+        'notes': row[4],
+        'created_at': row[5],
+        'has_embedding': bool(row[6]),
+    }
 
 
 def delete_example(example_id: int) -> bool:
     init_examples_db()
     conn = _connect()
     cur = conn.cursor()
+    before = _store_version(cur)
     cur.execute('DELETE FROM sql_examples WHERE id = ?', (int(example_id),))
     deleted = cur.rowcount > 0
     conn.commit()
+    if deleted:
+        _apply_local_change(cur, before, lambda index: index.remove(int(example_id)))
     conn.close()
     return deleted
 
 
+IMPORT_CONFLICT_MODES = ('skip', 'update')
+MAX_REPORTED_ERRORS = 50
+
+
+def _import_fields(record) -> tuple[dict | None, str | None]:
+    if not isinstance(record, dict):
+        return None, 'Record must be a JSON object.'
+    if record.get('_error'):
+        return None, str(record['_error'])
+    question = str(record.get('question') or '').strip()
+    sql_text = str(record.get('sql') or record.get('sql_text') or '').strip()
+    if not question or not sql_text:
+        return None, 'question and sql are required.'
+    tags = record.get('tags') or []
+    if not isinstance(tags, list):
+        return None, 'tags must be a list.'
+    embedding = None
+    if record.get('embedding') and record.get('embedding_model') == EMBEDDING_MODEL:
+        try:
+            embedding = base64.b64decode(record['embedding'], validate=True)
+        except (ValueError, TypeError):
+            return None, 'embedding must be base64-encoded float32 bytes.'
+        if from_blob(embedding) is None:
+            return None, f'embedding is {len(embedding)} bytes; expected a non-empty multiple of 4 (float32).'
+    return {
+        'question': question,
+        'sql_text': sql_text,
+        'tags': json.dumps(tags),
+        'notes': str(record.get('notes') or '').strip(),
+        'created_at': str(record.get('created_at') or '').strip() or None,
+        'embedding_blob': embedding,
+    }, None
+
+
+def import_examples(records, *, on_conflict: str = 'skip', embed: bool = True) -> dict:
+    if on_conflict not in IMPORT_CONFLICT_MODES:
+        raise ValueError(f'on_conflict must be one of {", ".join(IMPORT_CONFLICT_MODES)}')
+    init_examples_db()
+    report = {'received': 0, 'inserted': 0, 'updated': 0, 'duplicates': 0, 'invalid': 0, 'embedded': 0, 'errors': []}
+
+    def reject(position: int, error: str) -> None:
+        report['invalid'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'record': position, 'error': error})
+
+    conn = _connect()
+    try:
+        dim = _ensure_index(conn.cursor()).dim
+        accepted: dict[str, dict] = {}
+        for position, record in enumerate(records, start=1):
+            report['received'] += 1
+            fields, error = _import_fields(record)
+            if error:
+                reject(position, error)
+                continue
+            blob = fields['embedding_blob']
+            if blob is not None:
+                size = len(blob) // 4
+                dim = dim or size
+                if size != dim:
+                    reject(position, f'embedding has {size} dimensions; the example index uses {dim}.')
+                    continue
+            key = normalize_question(fields['question'])
+            if key in accepted:
+                report['duplicates'] += 1
+            accepted[key] = fields
+
+        existing = {}
+        for row_id, question in conn.execute('SELECT id, question FROM sql_examples'):
+            existing.setdefault(normalize_question(question), row_id)
+        inserts = [f for key, f in accepted.items() if key not in existing]
+        updates = [(existing[key], f) for key, f in accepted.items() if key in existing]
+        if on_conflict == 'skip':
+            report['duplicates'] += len(updates)
+            updates = []
+
+        pending = [f for f in inserts if f['embedding_blob'] is None]
+        if embed and pending:
+            try:
+                vectors = embed_texts([f['question'] for f in pending])
+                for fields, vector in zip(pending, vectors):
+                    fields['embedding_blob'] = to_blob(vector)
+                report['embedded'] = len(vectors)
+            except Exception as exc:
+                report['embedding_error'] = str(exc)
+
+        cur = conn.cursor()
+        cur.executemany(
+            '''
+            INSERT INTO sql_examples (question, sql_text, tags, notes, created_at, embedding_blob, embedding_model)
+            VALUES (?, ?, ?, ?, COALESCE(?, datetime('now')), ?, ?)
+            ''',
+            [
+                (
+                    f['question'],
+                    f['sql_text'],
+                    f['tags'],
+                    f['notes'],
+                    f['created_at'],
+                    f['embedding_blob'],
+                    EMBEDDING_MODEL if f['embedding_blob'] is not None else None,
+                )
+                for f in inserts
+            ],
+        )
+        cur.executemany(
+            'UPDATE sql_examples SET sql_text = ?, tags = ?, notes = ? WHERE id = ?',
+            [(f['sql_text'], f['tags'], f['notes'], row_id) for row_id, f in updates],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    report['inserted'] = len(inserts)
+    report['updated'] = len(updates)
+    if any(f['embedding_blob'] is None for f in inserts):
+        BACKFILL_NEEDED.set()
+    return report
+
+
+def export_examples(include_embeddings: bool = False, batch_size: int = 500):
+    init_examples_db()
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            'SELECT question, sql_text, tags, notes, created_at, embedding_blob, embedding_model FROM sql_examples ORDER BY id'
+        )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for question, sql_text, tags, notes, created_at, blob, model in rows:
+                try:
+                    tags = json.loads(tags or '[]')
+                except ValueError:
+                    tags = []
+                item = {'question': question, 'sql_text': sql_text, 'tags': tags, 'notes': notes or '', 'created_at': created_at}
+                if include_embeddings and blob is not None and model:
+                    item['embedding'] = base64.b64encode(blob).decode('ascii')
+                    item['embedding_model'] = model
+                yield item
+    finally:
+        conn.close()
+
+
 def _token_set(text: str) -> set[str]:
     return {tok for tok in ''.join(c.lower() if c.isalnum() else ' ' for c in text).split() if len(tok) > 1}
 
@@ -117,63 +356,157 @@ def _score_similarity(a: str, b: str) -> float:
     return (0.6 * seq) + (0.4 * jaccard)
 
 
-def _cosine_similarity(a: list[float], b: list[float]) -> float:
-    if not a or not b or len(a) != len(b):
-        return -1.0
-    dot = sum(x * y for x, y in zip(a, b))
-    na = sqrt(sum(x * x for x in a))
-    nb = sqrt(sum(y * y for y in b))
-    if na == 0.0 or nb == 0.0:
-        return -1.0
-    return dot / (na * nb)
+def _lexical_scores(question: str, rows, min_score: float) -> list[tuple[float, int]]:
+    q = (question or '').strip().lower()
+    tq = _token_set(q)
+    matcher = SequenceMatcher(None)
+    matcher.set_seq2(q)
+    scored = []
+    for row_id, text in rows:
+        b = (text or '').strip().lower()
+        if not q or not b:
+            continue
+        tb = _token_set(b)
+        jaccard = (len(tq & tb) / len(tq | tb)) if (tq and tb) else 0.0
+        matcher.set_seq1(b)
+        if (0.6 * matcher.real_quick_ratio()) + (0.4 * jaccard) < min_score:
+            continue
+        score = (0.6 * matcher.ratio()) + (0.4 * jaccard)
+        if score >= min_score:
+            scored.append((score, row_id))
+    return scored
 
 
-def find_similar_examples(question: str, top_k: int = 3, min_score: float = 0.35) -> list[dict]:
-    candidates = list_examples(limit=500)
-    scored: list[tuple[float, dict]] = []
-    query_embedding = None
+def _safe_embed(text: str) -> list[float] | None:
     try:
-        query_embedding = embed_text(question)
+        return embed_text(text)
     except Exception:
-        query_embedding = None
+        return None
 
-    if query_embedding:
-        for item in candidates:
-            emb_raw = item.get('embedding')
-            emb = None
-            if emb_raw:
-                try:
-                    emb = json.loads(emb_raw)
-                except Exception:
-                    emb = None
-            if not emb:
-                try:
-                    emb = embed_text(item['question'])
-                    conn = _connect()
-                    cur = conn.cursor()
-                    cur.execute('UPDATE sql_examples SET embedding = ? WHERE id = ?', (json.dumps(emb), item['id']))
-                    conn.commit()
-                    conn.close()
-                except Exception:
-                    emb = None
-            score = _cosine_similarity(query_embedding, emb) if emb else _score_similarity(question, item['question'])
-            if score >= min_score:
-                scored.append((score, item))
-    else:
-        for item in candidates:
-            score = _score_similarity(question, item['question'])
-            if score >= min_score:
-                scored.append((score, item))
 
-    scored.sort(key=lambda x: x[0], reverse=True)
+@traced('find_similar_examples')
+def find_similar_examples(
+    question: str,
+    top_k: int = 3,
+    min_score: float = 0.35,
+    ctx: RequestContext | None = None,
+) -> list[dict]:
+    return memoize(
+        ctx,
+        'similar_examples',
+        (question, top_k, min_score),
+        lambda: _find_similar_examples(question, top_k, min_score, ctx),
+    )
+
+
+def _find_similar_examples(question: str, top_k: int, min_score: float, ctx: RequestContext | None) -> list[dict]:
+    init_examples_db()
+    query_embedding = memoize(ctx, 'embedding', question, lambda: _safe_embed(question))
+
+    conn = _connect()
+    cur = conn.cursor()
+    try:
+        index = _ensure_index(cur)
+        scored: list[tuple[float, int]] = []
+        if query_embedding and (index.dim is None or len(query_embedding) == index.dim):
+            # Rows without a usable vector (missing, truncated or another dimension) are scored lexically.
+            lexical_rows = cur.execute(
+                'SELECT id, question FROM sql_examples WHERE embedding_blob IS NULL OR length(embedding_blob) <> ?',
+                (len(query_embedding) * 4,),
+            ).fetchall()
+            if lexical_rows:
+                BACKFILL_NEEDED.set()
+            scored.extend((score, row_id) for row_id, score in index.search(query_embedding, top_k, min_score))
+            scored.extend(_lexical_scores(question, lexical_rows, min_score))
+        else:
+            rows = cur.execute('SELECT id, question FROM sql_examples').fetchall()
+            scored = _lexical_scores(question, rows, min_score)
+
+        scored.sort(key=lambda x: x[0], reverse=True)
+        top = scored[:top_k]
+        if not top:
+            return []
+        placeholders = ', '.join('?' for _ in top)
+        rows = cur.execute(
+            f'SELECT id, question, sql_text, tags, notes, created_at, 1 FROM sql_examples WHERE id IN ({placeholders})',
+            [row_id for _, row_id in top],
+        ).fetchall()
+    finally:
+        conn.close()
+    items = {row[0]: _row_to_item(row) for row in rows}
     return [
         {
-            'id': item['id'],
-            'question': item['question'],
-            'sql_text': item['sql_text'],
-            'tags': item.get('tags', []),
-            'notes': item.get('notes', ''),
+            'id': items[row_id]['id'],
+            'question': items[row_id]['question'],
+            'sql_text': items[row_id]['sql_text'],
+            'tags': items[row_id].get('tags', []),
+            'notes': items[row_id].get('notes', ''),
             'score': round(score, 4),
         }
-        for score, item in scored[:top_k]
+        for score, row_id in top
+        if row_id in items
     ]
+
+
+_PENDING_WHERE = (
+    'embedding_blob IS NULL OR length(embedding_blob) % 4 <> 0 OR embedding_model IS NULL OR embedding_model <> ?'
+)
+
+
+def pending_embeddings() -> int:
+    init_examples_db()
+    conn = _connect()
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM sql_examples WHERE {_PENDING_WHERE}', (EMBEDDING_MODEL,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def backfill_embeddings(max_rows: int = 500, batch_size: int | None = None) -> dict:
+    init_examples_db()
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f'''
+            SELECT id, question FROM sql_examples WHERE {_PENDING_WHERE}
+            ORDER BY embedding_blob IS NOT NULL, id LIMIT ?
+            ''',
+            (EMBEDDING_MODEL, max_rows),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    batch_size = batch_size or embed_batch_size()
+    updates = []
+    error = None
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start : start + batch_size]
+        try:
+            vectors = embed_texts([question for _, question in chunk], batch_size=batch_size)
+        except Exception as exc:
+            error = str(exc)
+            break
+        updates.extend(
+            (to_blob(vector), EMBEDDING_MODEL, row_id, question) for (row_id, question), vector in zip(chunk, vectors)
+        )
+
+    written = 0
+    if updates:
+        conn = _connect()
+        try:
+            cur = conn.cursor()
+            cur.executemany(
+                'UPDATE sql_examples SET embedding_blob = ?, embedding_model = ? WHERE id = ? AND question = ?',
+                updates,
+            )
+            written = cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    return {
+        'selected': len(rows),
+        'embedded': written,
+        'failed': len(rows) - len(updates),
+        'error': error,
+        'pending': pending_embeddings(),
+    }
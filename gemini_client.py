@@ -1,47 +1,95 @@
+import asyncio
+import http.client
 import json
 import os
 import threading
 import time
-from urllib import error, request
 
-GEMINI_SEM = threading.Semaphore(1)
+from . import llm_cache
+from .config import env_float, env_int
+from .http_pool import HTTPStatusError, KeepAlivePool
+from .metrics import CACHE_EVENTS, LLM_CALLS, LLM_RETRIES, span, traced
+from .request_context import RequestContext
 
+GEMINI_MODEL = 'gemini-2.0-flash'
+EMBEDDING_MODEL = 'text-embedding-004'
+DEFAULT_BASE_URL = 'https://generativelanguage.googleapis.com'
+RETRYABLE_HTTP = {429, 408, 500, 502, 503, 504}
+EMBED_BATCH_LIMIT = 100
 
-def gemini_request(payload: dict, *, timeout_s: int = 45, max_retries: int = 5) -> dict:
+_TRANSPORT = {'pool': None, 'base_url': None}
+_TRANSPORT_LOCK = threading.Lock()
+
+
+def get_transport() -> KeepAlivePool:
+    base_url = os.environ.get('GEMINI_BASE_URL', DEFAULT_BASE_URL)
+    pool = _TRANSPORT['pool']
+    if pool is not None and _TRANSPORT['base_url'] == base_url:
+        return pool
+    with _TRANSPORT_LOCK:
+        if _TRANSPORT['pool'] is None or _TRANSPORT['base_url'] != base_url:
+            if _TRANSPORT['pool'] is not None:
+                _TRANSPORT['pool'].close()
+            _TRANSPORT['pool'] = KeepAlivePool(
+                base_url,
+                max_connections=env_int('GEMINI_MAX_CONCURRENCY', 4),
+                timeout_s=env_float('GEMINI_TIMEOUT_S', 45.0),
+            )
+            _TRANSPORT['base_url'] = base_url
+        return _TRANSPORT['pool']
+
+
+def transport_stats() -> dict:
+    pool = _TRANSPORT['pool']
+    return pool.stats() if pool is not None else {}
+
+
+def _api_key() -> str:
     api_key = os.environ.get('GEMINI_API_KEY')
     if not api_key:
         raise RuntimeError('GEMINI_API_KEY missing in .env')
+    return api_key
+
 
-    url = (
-        'https://generativelanguage.googleapis.com/v1beta/models/'
-        'gemini-2.0-flash:generateContent?key='
-        + api_key
+def _post_json(path: str, payload: dict, timeout_s: float) -> dict:
+    body = json.dumps(payload).encode('utf-8')
+    status, headers, data = get_transport().request(
+        'POST',
+        f'{path}?key={_api_key()}',
+        body=body,
+        headers={'Content-Type': 'application/json'},
+        timeout_s=timeout_s,
     )
+    if status >= 400:
+        raise HTTPStatusError(status, data, headers)
+    return json.loads(data.decode('utf-8'))
+
 
-    retryable_http = {429, 408, 500, 502, 503, 504}
+def _post_with_retry(path: str, payload: dict, *, timeout_s: float, max_retries: int, kind: str) -> dict:
     backoff_s = 1.5
     last_error = None
 
     for attempt in range(max_retries + 1):
         try:
-            body = json.dumps(payload).encode('utf-8')
-            req = request.Request(url, data=body, headers={'Content-Type': 'application/json'})
-            with GEMINI_SEM:
-                with request.urlopen(req, timeout=timeout_s) as response:
-                    return json.loads(response.read().decode('utf-8'))
-        except error.HTTPError as exc:
-            detail = exc.read().decode('utf-8', errors='replace')
-            last_error = f'HTTP {exc.code}: {detail}'
-            retry_after = exc.headers.get('Retry-After')
-            if exc.code in retryable_http and attempt < max_retries:
+            data = _post_json(path, payload, timeout_s)
+            LLM_CALLS.inc(kind=kind, outcome='ok')
+            return data
+        except HTTPStatusError as exc:
+            LLM_CALLS.inc(kind=kind, outcome='error')
+            last_error = str(exc)
+            retry_after = exc.headers.get('retry-after')
+            if exc.status in RETRYABLE_HTTP and attempt < max_retries:
+                LLM_RETRIES.inc(kind=kind)
                 sleep_time = float(retry_after) if retry_after else backoff_s
                 time.sleep(sleep_time)
                 backoff_s = min(backoff_s * 2.0, 15.0)
                 continue
             raise RuntimeError(last_error) from exc
-        except error.URLError as exc:
-            last_error = f'URLError: {exc}'
+        except (OSError, http.client.HTTPException) as exc:
+            LLM_CALLS.inc(kind=kind, outcome='error')
+            last_error = f'Connection error: {exc}'
             if attempt < max_retries:
+                LLM_RETRIES.inc(kind=kind)
                 time.sleep(backoff_s)
                 backoff_s = min(backoff_s * 2.0, 15.0)
                 continue
@@ -50,11 +98,39 @@ def gemini_request(payload: dict, *, timeout_s: int = 45, max_retries: int = 5)
     raise RuntimeError(last_error or 'Gemini request failed.')
 
 
-def call_gemini(prompt: str) -> str | None:
+@traced('call_gemini')
+def gemini_request(payload: dict, *, timeout_s: int = 45, max_retries: int = 5) -> dict:
+    path = f'/v1beta/models/{GEMINI_MODEL}:generateContent'
+    return _post_with_retry(path, payload, timeout_s=timeout_s, max_retries=max_retries, kind='generate')
+
+
+def call_gemini(
+    prompt: str, *, use_cache: bool = True, ctx: RequestContext | None = None, info: dict | None = None
+) -> str | None:
+    generation_config = {'temperature': 0.0}
     payload = {
         'contents': [{'parts': [{'text': prompt}]}],
-        'generationConfig': {'temperature': 0.0},
+        'generationConfig': generation_config,
     }
+    key = None
+    if ctx is not None and not ctx.use_llm_cache:
+        use_cache = False
+    if use_cache and llm_cache.enabled():
+        key = llm_cache.cache_key(GEMINI_MODEL, generation_config, prompt)
+        with span('llm_cache'):
+            cached = llm_cache.get(key)
+        if cached is not None:
+            CACHE_EVENTS.inc(cache='llm', outcome='hit')
+            if ctx is not None:
+                ctx.defer('llm_hits', key, cached)
+            if info is not None:
+                info['cached'] = True
+            return cached
+        CACHE_EVENTS.inc(cache='llm', outcome='miss')
+    else:
+        llm_cache.record_bypass()
+    if info is not None:
+        info['cached'] = False
     data = gemini_request(payload, timeout_s=25, max_retries=2)
     candidates = data.get('candidates') or []
     if not candidates:
@@ -62,29 +138,104 @@ def call_gemini(prompt: str) -> str | None:
     parts = candidates[0].get('content', {}).get('parts') or []
     if not parts:
         return None
-    return parts[0].get('text')
+    text = parts[0].get('text')
+    if key is not None and text:
+        if ctx is None:
+            llm_cache.put(key, GEMINI_MODEL, text)
+        else:
+            ctx.defer('llm_pending', key, text)
+    return text
+
+
+def reject_response(ctx: RequestContext | None, text: str | None) -> None:
+    if ctx is None or not text:
+        return
+    for key, pending in ctx.deferred('llm_pending').items():
+        if pending == text:
+            ctx.discard('llm_pending', key)
+    stale = [key for key, cached in ctx.deferred('llm_hits').items() if cached == text]
+    for key in stale:
+        ctx.discard('llm_hits', key)
+    llm_cache.delete(stale)
+
+
+def commit_responses(ctx: RequestContext | None) -> None:
+    if ctx is None:
+        return
+    ctx.take('llm_hits')
+    for key, text in ctx.take('llm_pending').items():
+        llm_cache.put(key, GEMINI_MODEL, text)
+
+
+def discard_responses(ctx: RequestContext | None) -> None:
+    if ctx is None:
+        return
+    ctx.take('llm_pending')
+    llm_cache.delete(ctx.take('llm_hits'))
 
 
+@traced('embed_text')
 def embed_text(text: str) -> list[float]:
-    api_key = os.environ.get('GEMINI_API_KEY')
-    if not api_key:
-        raise RuntimeError('GEMINI_API_KEY missing in .env')
     payload = {
-        'model': 'models/text-embedding-004',
+        'model': f'models/{EMBEDDING_MODEL}',
         'content': {'parts': [{'text': text}]},
     }
-    body = json.dumps(payload).encode('utf-8')
-    url = (
-        'https://generativelanguage.googleapis.com/v1beta/models/'
-        'text-embedding-004:embedContent?key='
-        + api_key
-    )
-    req = request.Request(url, data=body, headers={'Content-Type': 'application/json'})
-    data = None
-    with GEMINI_SEM:
-        with request.urlopen(req, timeout=30) as response:
-            data = json.loads(response.read().decode('utf-8'))
+    try:
+        data = _post_json(f'/v1beta/models/{EMBEDDING_MODEL}:embedContent', payload, 30)
+    except HTTPStatusError as exc:
+        LLM_CALLS.inc(kind='embed', outcome='error')
+        raise RuntimeError(str(exc)) from exc
+    LLM_CALLS.inc(kind='embed', outcome='ok')
     values = (data or {}).get('embedding', {}).get('values') or []
     if not values:
         raise RuntimeError('Embedding API returned no vector.')
     return [float(v) for v in values]
+
+
+def embed_batch_size() -> int:
+    return max(1, min(env_int('EMBED_BATCH_SIZE', EMBED_BATCH_LIMIT), EMBED_BATCH_LIMIT))
+
+
+@traced('embed_batch')
+def embed_texts(texts: list[str], *, batch_size: int | None = None, max_retries: int = 3) -> list[list[float]]:
+    batch_size = max(1, min(batch_size or embed_batch_size(), EMBED_BATCH_LIMIT))
+    path = f'/v1beta/models/{EMBEDDING_MODEL}:batchEmbedContents'
+    model = f'models/{EMBEDDING_MODEL}'
+    vectors: list[list[float]] = []
+    for start in range(0, len(texts), batch_size):
+        chunk = texts[start : start + batch_size]
+        payload = {'requests': [{'model': model, 'content': {'parts': [{'text': text}]}} for text in chunk]}
+        data = _post_with_retry(path, payload, timeout_s=60, max_retries=max_retries, kind='embed_batch')
+        embeddings = (data or {}).get('embeddings') or []
+        if len(embeddings) != len(chunk):
+            raise RuntimeError(f'Batch embedding returned {len(embeddings)} vectors for {len(chunk)} texts.')
+        for item in embeddings:
+            values = (item or {}).get('values') or []
+            if not values:
+                raise RuntimeError('Embedding API returned no vector.')
+            vectors.append([float(v) for v in values])
+    return vectors
+
+
+async def gemini_request_async(payload: dict, *, timeout_s: int = 45, max_retries: int = 5) -> dict:
+    return await asyncio.to_thread(gemini_request, payload, timeout_s=timeout_s, max_retries=max_retries)
+
+
+async def call_gemini_async(
+    prompt: str, *, use_cache: bool = True, ctx: RequestContext | None = None
+) -> str | None:
+    return await asyncio.to_thread(call_gemini, prompt, use_cache=use_cache, ctx=ctx)
+
+
+async def embed_text_async(text: str) -> list[float]:
+    return await asyncio.to_thread(embed_text, text)
+
+
+async def embed_texts_async(texts: list[str], *, batch_size: int | None = None) -> list[list[float]]:
+    return await asyncio.to_thread(embed_texts, texts, batch_size=batch_size)
+
+
+async def call_gemini_many(
+    prompts: list[str], *, use_cache: bool = True, ctx: RequestContext | None = None
+) -> list[str | None]:
+    return list(await asyncio.gather(*(call_gemini_async(p, use_cache=use_cache, ctx=ctx) for p in prompts)))
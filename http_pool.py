@@ -0,0 +1,134 @@
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .metrics import WAIT_SECONDS
+
+_RETRYABLE_STALE = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+class HTTPStatusError(RuntimeError):
+    def __init__(self, status: int, body: bytes, headers: dict):
+        self.status = status
+        self.body = body
+        self.headers = headers
+        super().__init__(f'HTTP {status}: {body.decode("utf-8", errors="replace")}')
+
+
+class KeepAlivePool:
+    def __init__(self, base_url: str, max_connections: int = 4, timeout_s: float = 30.0, max_idle_s: float = 60.0):
+        parts = urlsplit(base_url)
+        if parts.scheme not in {'http', 'https'} or not parts.hostname:
+            raise ValueError(f'Unsupported base URL: {base_url!r}')
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/')
+        self.max_connections = max(1, max_connections)
+        self.timeout_s = timeout_s
+        self.max_idle_s = max_idle_s
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._idle: list[tuple[http.client.HTTPConnection, float]] = []
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'connects': 0, 'reuses': 0, 'stale_retries': 0, 'in_flight': 0, 'slot_wait_s': 0.0}
+
+    def _new_connection(self, timeout_s: float) -> http.client.HTTPConnection:
+        with self._lock:
+            self._stats['connects'] += 1
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout_s)
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout_s)
+
+    def _take(self, timeout_s: float) -> tuple[http.client.HTTPConnection, bool]:
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate, idle_since = self._idle.pop()
+                if now - idle_since > self.max_idle_s:
+                    stale.append(candidate)
+                    continue
+                conn = candidate
+                self._stats['reuses'] += 1
+                break
+        for old in stale:
+            old.close()
+        if conn is None:
+            return self._new_connection(timeout_s), False
+        conn.timeout = timeout_s
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout_s)
+        return conn, True
+
+    def _give_back(self, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        body: bytes | None = None,
+        headers: dict | None = None,
+        timeout_s: float | None = None,
+    ) -> tuple[int, dict, bytes]:
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=timeout_s):
+            WAIT_SECONDS.observe(time.monotonic() - started, resource='http_pool')
+            raise TimeoutError(f'No free HTTP connection to {self.host} after {timeout_s:.1f}s')
+        slot_wait_s = time.monotonic() - started
+        WAIT_SECONDS.observe(slot_wait_s, resource='http_pool')
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['in_flight'] += 1
+            self._stats['slot_wait_s'] += slot_wait_s
+        try:
+            target = self.base_path + path
+            send_headers = {'Connection': 'keep-alive'}
+            send_headers.update(headers or {})
+            conn, reused = self._take(timeout_s)
+            while True:
+                try:
+                    conn.request(method, target, body=body, headers=send_headers)
+                    response = conn.getresponse()
+                    data = response.read()
+                except _RETRYABLE_STALE:
+                    conn.close()
+                    if not reused:
+                        raise
+                    with self._lock:
+                        self._stats['stale_retries'] += 1
+                    conn, reused = self._new_connection(timeout_s), False
+                    continue
+                except Exception:
+                    conn.close()
+                    raise
+                break
+            response_headers = {k.lower(): v for k, v in response.getheaders()}
+            if response.will_close:
+                conn.close()
+            else:
+                self._give_back(conn)
+            return response.status, response_headers, data
+        finally:
+            with self._lock:
+                self._stats['in_flight'] -= 1
+            self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data['slot_wait_s'] = round(data['slot_wait_s'], 6)
+            data['idle'] = len(self._idle)
+            data['max_connections'] = self.max_connections
+            return data
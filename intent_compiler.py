@@ -0,0 +1,469 @@
+import re
+import threading
+
+from .business_rules import get_business_rules, legal_entity_name, stage_bucket_predicate
+
+
+class UnsupportedIntent(RuntimeError):
+    pass
+
+
+_METRICS = {
+    'revenue': 'ber.revenue_fx',
+    'margin': 'ber.margin_fx',
+    'tcv': 'ber.tcv_fx',
+    'deal_count': None,
+}
+_METRIC_ALIASES = {
+    'sales': 'revenue',
+    'total_revenue': 'revenue',
+    'revenue_fx': 'revenue',
+    'revenue_thousands': 'revenue',
+    'gross_margin': 'margin',
+    'margin_fx': 'margin',
+    'margin_thousands': 'margin',
+    'profit': 'margin',
+    'total_contract_value': 'tcv',
+    'tcv_fx': 'tcv',
+    'deals': 'deal_count',
+    'deal': 'deal_count',
+    'number_of_deals': 'deal_count',
+    'count_of_deals': 'deal_count',
+    'deal_volume': 'deal_count',
+    'count': 'deal_count',
+}
+_AGGREGATIONS = {
+    'sum': 'SUM',
+    'total': 'SUM',
+    'avg': 'AVG',
+    'average': 'AVG',
+    'mean': 'AVG',
+    'min': 'MIN',
+    'minimum': 'MIN',
+    'max': 'MAX',
+    'maximum': 'MAX',
+    'count': 'COUNT',
+}
+
+_JOINS = {
+    'date': 'JOIN dw.DimDate AS dd ON fs.close_date_key = dd.date_key',
+    'customer': 'JOIN grp.DimCustomer AS dc ON fs.customer_key = dc.customer_key',
+    'sales_person': 'JOIN grp.DimSalesPerson AS sp ON fs.sales_person_key = sp.sales_person_key',
+    'revenue_type': 'JOIN grp.DimRevenueType AS drt ON fs.revenue_type_key = drt.revenue_type_key',
+}
+_DIMENSIONS = {
+    'customer': (('dc.customer_name', 'customer_name'),),
+    'sales_person': (('sp.first_name', 'sales_person_first_name'), ('sp.last_name', 'sales_person_last_name')),
+    'revenue_type': (('drt.revenue_type_name', 'revenue_type_name'),),
+    'deal_stage': (('ds.deal_stage_name', 'deal_stage_name'),),
+    'deal': (('fs.deal_name', 'deal_name'),),
+    'year': (('dd.calendar_year', 'calendar_year'),),
+    'quarter': (('dd.calendar_year', 'calendar_year'), ('dd.calendar_quarter', 'calendar_quarter')),
+    'month': (('dd.calendar_year', 'calendar_year'), ('dd.calendar_month', 'calendar_month')),
+}
+_DIMENSION_JOINS = {
+    'customer': 'customer',
+    'sales_person': 'sales_person',
+    'revenue_type': 'revenue_type',
+    'year': 'date',
+    'quarter': 'date',
+    'month': 'date',
+}
+_DIMENSION_ALIASES = {
+    'customers': 'customer',
+    'customer_name': 'customer',
+    'client': 'customer',
+    'account': 'customer',
+    'salesperson': 'sales_person',
+    'sales_rep': 'sales_person',
+    'rep': 'sales_person',
+    'owner': 'sales_person',
+    'deal_owner': 'sales_person',
+    'sales_person_name': 'sales_person',
+    'revenue_type_name': 'revenue_type',
+    'stage': 'deal_stage',
+    'deal_stage_name': 'deal_stage',
+    'deal_name': 'deal',
+    'deals': 'deal',
+    'opportunity': 'deal',
+    'calendar_year': 'year',
+    'calendar_quarter': 'quarter',
+    'calendar_month': 'month',
+    'monthly': 'month',
+    'quarterly': 'quarter',
+    'yearly': 'year',
+}
+_FILTER_COLUMNS = {
+    'customer': ('dc.customer_name', 'customer'),
+    'revenue_type': ('drt.revenue_type_name', 'revenue_type'),
+    'deal_stage': ('ds.deal_stage_name', None),
+    'deal': ('fs.deal_name', None),
+    'year': ('dd.calendar_year', 'date'),
+    'quarter': ('dd.calendar_quarter', 'date'),
+    'month': ('dd.calendar_month', 'date'),
+}
+_MANDATORY_FILTER_FIELDS = {'legal_entity_name', 'country_code', 'region', 'reporting_currency_code', 'reporting_currency'}
+_OPERATORS = {
+    '=': '=',
+    '==': '=',
+    'eq': '=',
+    'equals': '=',
+    'is': '=',
+    '!=': '<>',
+    '<>': '<>',
+    'ne': '<>',
+    'not_equals': '<>',
+    '>': '>',
+    'gt': '>',
+    '>=': '>=',
+    'gte': '>=',
+    '<': '<',
+    'lt': '<',
+    '<=': '<=',
+    'lte': '<=',
+    'in': 'IN',
+    'not_in': 'NOT IN',
+    'like': 'LIKE',
+    'contains': 'LIKE',
+}
+_ENTITIES_WITHOUT_JOIN = {'', 'deal', 'deals', 'sale', 'sales', 'opportunity', 'opportunities', 'revenue', 'margin', 'pipeline'}
+_ANALYTICS_FIELDS = ('comparison_type', 'goal_type', 'analysis_mode', 'secondary_metric_comparison')
+
+_TODAY = 'CAST(GETDATE() AS date)'
+_TIME_PERIODS = {
+    'this year': ['dd.calendar_year = YEAR(GETDATE())'],
+    'current year': ['dd.calendar_year = YEAR(GETDATE())'],
+    'last year': ['dd.calendar_year = YEAR(GETDATE()) - 1'],
+    'previous year': ['dd.calendar_year = YEAR(GETDATE()) - 1'],
+    'year to date': ['dd.calendar_year = YEAR(GETDATE())', f'dd.calendar_date <= {_TODAY}'],
+    'ytd': ['dd.calendar_year = YEAR(GETDATE())', f'dd.calendar_date <= {_TODAY}'],
+    'this quarter': ['dd.calendar_year = YEAR(GETDATE())', 'dd.calendar_quarter = DATEPART(QUARTER, GETDATE())'],
+    'current quarter': ['dd.calendar_year = YEAR(GETDATE())', 'dd.calendar_quarter = DATEPART(QUARTER, GETDATE())'],
+    'quarter to date': [
+        'dd.calendar_year = YEAR(GETDATE())',
+        'dd.calendar_quarter = DATEPART(QUARTER, GETDATE())',
+        f'dd.calendar_date <= {_TODAY}',
+    ],
+    'qtd': [
+        'dd.calendar_year = YEAR(GETDATE())',
+        'dd.calendar_quarter = DATEPART(QUARTER, GETDATE())',
+        f'dd.calendar_date <= {_TODAY}',
+    ],
+    'last quarter': [
+        'dd.calendar_year = YEAR(DATEADD(QUARTER, -1, GETDATE()))',
+        'dd.calendar_quarter = DATEPART(QUARTER, DATEADD(QUARTER, -1, GETDATE()))',
+    ],
+    'previous quarter': [
+        'dd.calendar_year = YEAR(DATEADD(QUARTER, -1, GETDATE()))',
+        'dd.calendar_quarter = DATEPART(QUARTER, DATEADD(QUARTER, -1, GETDATE()))',
+    ],
+    'this month': ['dd.calendar_year = YEAR(GETDATE())', 'dd.calendar_month = MONTH(GETDATE())'],
+    'current month': ['dd.calendar_year = YEAR(GETDATE())', 'dd.calendar_month = MONTH(GETDATE())'],
+    'month to date': [
+        'dd.calendar_year = YEAR(GETDATE())',
+        'dd.calendar_month = MONTH(GETDATE())',
+        f'dd.calendar_date <= {_TODAY}',
+    ],
+    'mtd': [
+        'dd.calendar_year = YEAR(GETDATE())',
+        'dd.calendar_month = MONTH(GETDATE())',
+        f'dd.calendar_date <= {_TODAY}',
+    ],
+    'last month': [
+        'dd.calendar_month = MONTH(DATEADD(MONTH, -1, GETDATE()))',
+        'dd.calendar_year = YEAR(DATEADD(MONTH, -1, GETDATE()))',
+    ],
+    'previous month': [
+        'dd.calendar_month = MONTH(DATEADD(MONTH, -1, GETDATE()))',
+        'dd.calendar_year = YEAR(DATEADD(MONTH, -1, GETDATE()))',
+    ],
+}
+_ALL_TIME = {'', 'all', 'all time', 'overall', 'total', 'lifetime', 'none', 'null'}
+
+_STATS = {'compiled': 0, 'fallbacks': 0, 'reasons': {}}
+_STATS_LOCK = threading.Lock()
+
+
+def _key(value) -> str:
+    return re.sub(r'[\s\-]+', '_', str(value or '').strip().lower())
+
+
+def _quote(value) -> str:
+    if isinstance(value, bool):
+        raise UnsupportedIntent('Boolean filter values are not supported.')
+    if isinstance(value, (int, float)):
+        return repr(value)
+    text = str(value)
+    if re.fullmatch(r'-?\d+(\.\d+)?', text.strip()):
+        return text.strip()
+    return "'" + text.replace("'", "''") + "'"
+
+
+def _resolve_metric(name) -> str:
+    key = _key(name)
+    key = _METRIC_ALIASES.get(key, key)
+    if key not in _METRICS:
+        raise UnsupportedIntent(f'Unsupported metric: {name!r}')
+    return key
+
+
+def _resolve_dimension(field) -> str:
+    if isinstance(field, dict):
+        field = field.get('field') or field.get('name') or field.get('column')
+    key = _key(field)
+    for prefix in ('dd.', 'dc.', 'sp.', 'drt.', 'ds.', 'fs.'):
+        key = key[len(prefix) :] if key.startswith(prefix) else key
+    return _DIMENSION_ALIASES.get(key, key)
+
+
+def _metric_column(metric: str, aggregation: str) -> tuple[str, str]:
+    column = _METRICS[metric]
+    if column is None or aggregation == 'COUNT':
+        if aggregation not in {'SUM', 'COUNT'}:
+            raise UnsupportedIntent(f'Unsupported aggregation for deal count: {aggregation}')
+        return 'COUNT(DISTINCT fs.sale_key)', 'deal_count'
+    prefix = '' if aggregation == 'SUM' else aggregation.lower() + '_'
+    return f'CAST({aggregation}({column} / 1000.0) AS INT)', f'{prefix}{metric}_thousands'
+
+
+def _time_predicates(time_period) -> list[str]:
+    if time_period is None:
+        return []
+    if not isinstance(time_period, str):
+        raise UnsupportedIntent('Structured time_period values are not supported.')
+    text = re.sub(r'[\s_\-]+', ' ', time_period.strip().lower())
+    text = re.sub(r'^(in|for|during|over) ', '', text)
+    if text in _ALL_TIME:
+        return []
+    if text in _TIME_PERIODS:
+        return list(_TIME_PERIODS[text])
+    match = re.fullmatch(r'(?:fy|year )?(\d{4})', text)
+    if match:
+        return [f'dd.calendar_year = {int(match.group(1))}']
+    match = re.fullmatch(r'q([1-4]) (\d{4})', text) or re.fullmatch(r'(\d{4}) q([1-4])', text)
+    if match:
+        quarter, year = (match.group(1), match.group(2)) if text.startswith('q') else (match.group(2), match.group(1))
+        return [f'dd.calendar_year = {int(year)}', f'dd.calendar_quarter = {int(quarter)}']
+    match = re.fullmatch(r'(?:last|past|previous) (\d{1,3}) (day|week|month|year)s?', text)
+    if match:
+        count, unit = int(match.group(1)), match.group(2).upper()
+        return [f'dd.calendar_date >= DATEADD({unit}, -{count}, {_TODAY})', f'dd.calendar_date <= {_TODAY}']
+    raise UnsupportedIntent(f'Unsupported time_period: {time_period!r}')
+
+
+def _filter_predicate(item: dict, joins: set[str]) -> str | None:
+    if not isinstance(item, dict):
+        raise UnsupportedIntent('Free-text filters are not supported.')
+    if str(item.get('source', '')).strip().lower() == 'ui_stage_bucket':
+        return None
+    field = _key(item.get('field') or item.get('column'))
+    if field in _MANDATORY_FILTER_FIELDS:
+        return None
+    dimension = _resolve_dimension(field)
+    if dimension not in _FILTER_COLUMNS:
+        raise UnsupportedIntent(f'Unsupported filter field: {item.get("field")!r}')
+    column, join = _FILTER_COLUMNS[dimension]
+    operator = _OPERATORS.get(_key(item.get('operator') or '='))
+    if operator is None:
+        raise UnsupportedIntent(f'Unsupported filter operator: {item.get("operator")!r}')
+    values = item.get('values')
+    if values is None:
+        values = item.get('value')
+    if operator in {'IN', 'NOT IN'}:
+        values = values if isinstance(values, list) else [values]
+        if not values or any(v is None for v in values):
+            raise UnsupportedIntent('IN filters need at least one value.')
+        rendered = f'{column} {operator} (' + ', '.join(_quote(v) for v in values) + ')'
+    else:
+        if isinstance(values, list):
+            if len(values) != 1:
+                raise UnsupportedIntent('Scalar filter operators need exactly one value.')
+            values = values[0]
+        if values is None:
+            raise UnsupportedIntent('Filter value is missing.')
+        if operator == 'LIKE':
+            pattern = str(values)
+            if '%' not in pattern and _key(item.get('operator')) == 'contains':
+                pattern = f'%{pattern}%'
+            rendered = f'{column} LIKE {_quote(pattern)}'
+        else:
+            rendered = f'{column} {operator} {_quote(values)}'
+    if join:
+        joins.add(join)
+    return rendered
+
+
+def _order_terms(order_by) -> list[tuple[str, str | None]]:
+    if order_by is None or order_by == '' or order_by == []:
+        return []
+    items = order_by if isinstance(order_by, list) else [order_by]
+    terms = []
+    for item in items:
+        if isinstance(item, dict):
+            field = item.get('field') or item.get('metric') or item.get('column') or item.get('by')
+            direction = item.get('direction') or item.get('order')
+        elif isinstance(item, str):
+            parts = item.strip().split()
+            if not parts:
+                continue
+            field = ' '.join(parts[:-1]) if parts[-1].lower() in {'asc', 'desc', 'ascending', 'descending'} else item
+            direction = parts[-1] if field != item else None
+        else:
+            raise UnsupportedIntent(f'Unsupported order_by: {item!r}')
+        direction = str(direction).strip().lower()[:3] if direction else None
+        if direction not in {None, 'asc', 'des'}:
+            raise UnsupportedIntent(f'Unsupported sort direction: {direction!r}')
+        terms.append((_key(field), {'asc': 'ASC', 'des': 'DESC'}.get(direction)))
+    return terms
+
+
+def compile_intent(
+    intent: dict,
+    country_code: str,
+    reporting_currency: str,
+    stage_bucket: str,
+    rules: dict | None = None,
+) -> str:
+    if not isinstance(intent, dict):
+        raise UnsupportedIntent('Intent must be an object.')
+    rules = rules or get_business_rules()
+    if str(intent.get('_route') or 'normal_intent') != 'normal_intent':
+        raise UnsupportedIntent('Only normal_intent intents are compiled.')
+    for field in _ANALYTICS_FIELDS:
+        if intent.get(field):
+            raise UnsupportedIntent(f'Analytics field {field} is not supported.')
+    if intent.get('threshold') not in (None, '', [], {}):
+        raise UnsupportedIntent('Thresholds are not supported.')
+
+    aggregation_key = _key(intent.get('aggregation') or 'sum')
+    aggregation = _AGGREGATIONS.get(aggregation_key)
+    if aggregation is None:
+        raise UnsupportedIntent(f'Unsupported aggregation: {intent.get("aggregation")!r}')
+    if not intent.get('metric'):
+        raise UnsupportedIntent('Intent has no metric.')
+    metrics = [_resolve_metric(intent['metric'])]
+    if intent.get('secondary_metric'):
+        secondary = _resolve_metric(intent['secondary_metric'])
+        if secondary not in metrics:
+            metrics.append(secondary)
+
+    joins: set[str] = set()
+    group_by = intent.get('group_by') or []
+    if not isinstance(group_by, list):
+        group_by = [group_by]
+    dimensions = []
+    entity = _key(intent.get('entity'))
+    if entity not in _ENTITIES_WITHOUT_JOIN:
+        entity_dimension = _resolve_dimension(entity)
+        if entity_dimension not in {'customer', 'sales_person'}:
+            raise UnsupportedIntent(f'Unsupported entity: {intent.get("entity")!r}')
+        if not group_by:
+            dimensions.append(entity_dimension)
+        joins.add(_DIMENSION_JOINS[entity_dimension])
+    for field in group_by:
+        dimension = _resolve_dimension(field)
+        if dimension not in _DIMENSIONS:
+            raise UnsupportedIntent(f'Unsupported group_by field: {field!r}')
+        if dimension not in dimensions:
+            dimensions.append(dimension)
+
+    select_items: list[tuple[str, str]] = []
+    group_columns: list[str] = []
+    for dimension in dimensions:
+        if dimension in _DIMENSION_JOINS:
+            joins.add(_DIMENSION_JOINS[dimension])
+        for column, alias in _DIMENSIONS[dimension]:
+            if column not in group_columns:
+                group_columns.append(column)
+                select_items.append((column, alias))
+    metric_aliases = {}
+    for metric in metrics:
+        expression, alias = _metric_column(metric, aggregation)
+        metric_aliases[metric] = alias
+        select_items.append((expression, alias))
+
+    where = [
+        f"der.reporting_currency_code = {_quote(reporting_currency)}",
+        f"dle.legal_entity_name = {_quote(legal_entity_name(rules))}",
+        f"dle.country_code = {_quote(country_code)}",
+    ]
+    stage_sql = stage_bucket_predicate(stage_bucket, alias='ds', rules=rules)
+    if stage_sql != '1=1':
+        where.append(stage_sql)
+    time_predicates = _time_predicates(intent.get('time_period'))
+    if time_predicates:
+        joins.add('date')
+        where.extend(time_predicates)
+    filters = intent.get('filters') or []
+    if not isinstance(filters, list):
+        raise UnsupportedIntent('filters must be a list.')
+    for item in filters:
+        predicate = _filter_predicate(item, joins)
+        if predicate and predicate not in where:
+            where.append(predicate)
+
+    aliases = {alias for _, alias in select_items}
+    order_sql = []
+    for field, direction in _order_terms(intent.get('order_by')):
+        if field in aliases:
+            target, is_metric = field, field in metric_aliases.values()
+        elif field in {'value', 'amount', 'total', 'metric', ''} or _METRIC_ALIASES.get(field, field) in metric_aliases:
+            target, is_metric = metric_aliases.get(_METRIC_ALIASES.get(field, field), metric_aliases[metrics[0]]), True
+        else:
+            dimension = _resolve_dimension(field)
+            if dimension not in dimensions:
+                raise UnsupportedIntent(f'Unsupported order_by field: {field!r}')
+            target, is_metric = _DIMENSIONS[dimension][-1][1], False
+        order_sql.append(f'{target} {direction or ("DESC" if is_metric else "ASC")}')
+
+    limit = intent.get('limit')
+    top = ''
+    if limit not in (None, '', 0):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise UnsupportedIntent(f'Unsupported limit: {limit!r}')
+        if limit < 1 or limit > 100000:
+            raise UnsupportedIntent(f'Unsupported limit: {limit!r}')
+        top = f'TOP ({limit}) '
+        if not order_sql:
+            order_sql.append(f'{metric_aliases[metrics[0]]} DESC')
+    if not order_sql and any(d in {'year', 'quarter', 'month'} for d in dimensions):
+        order_sql = [f'{alias} ASC' for column, alias in select_items if column.startswith('dd.')]
+
+    lines = ['SELECT ' + top.rstrip()] if top else ['SELECT']
+    lines.append(',\n'.join(f'  {expression} AS {alias}' for expression, alias in select_items))
+    lines.extend(
+        [
+            'FROM grp.FactSale AS fs',
+            'JOIN grp.BridgeExchangeRate AS ber ON fs.sale_key = ber.sale_key',
+            'JOIN dw.DimExchangeRate AS der ON ber.exchange_rate_key = der.exchange_rate_key',
+            'JOIN grp.DimLegalEntity AS dle ON fs.legal_entity_id = dle.legal_entity_id',
+            'JOIN grp.DimDealStage AS ds ON fs.deal_stage_key = ds.deal_stage_key',
+        ]
+    )
+    lines.extend(_JOINS[name] for name in ('date', 'customer', 'sales_person', 'revenue_type') if name in joins)
+    lines.append('WHERE ' + '\n  AND '.join(where))
+    if group_columns:
+        lines.append('GROUP BY ' + ', '.join(group_columns))
+    if order_sql:
+        lines.append('ORDER BY ' + ', '.join(order_sql))
+    return '\n'.join(lines)
+
+
+def record(compiled: bool, reason: str = '') -> None:
+    with _STATS_LOCK:
+        if compiled:
+            _STATS['compiled'] += 1
+            return
+        _STATS['fallbacks'] += 1
+        label = reason.split(':', 1)[0] if reason else 'unknown'
+        _STATS['reasons'][label] = _STATS['reasons'].get(label, 0) + 1
+
+
+def stats() -> dict:
+    with _STATS_LOCK:
+        data = {'compiled': _STATS['compiled'], 'fallbacks': _STATS['fallbacks'], 'reasons': dict(_STATS['reasons'])}
+    total = data['compiled'] + data['fallbacks']
+    data['compile_rate'] = round(data['compiled'] / total, 4) if total else 0.0
+    return data
@@ -1,8 +1,12 @@
 import json
+import time
 
+from . import route_classifier
 from .business_rules import get_business_rules, normalize_stage_bucket
-from .gemini_client import call_gemini
+from .gemini_client import call_gemini, reject_response
+from .metrics import traced
 from .prompt_builder import build_intent_prompt, build_intent_prompt_analytics, build_router_prompt
+from .request_context import RequestContext, memoize
 
 
 def extract_json_object(text: str) -> str | None:
@@ -15,7 +19,8 @@ def extract_json_object(text: str) -> str | None:
     return text[start : end + 1]
 
 
-def route_question(question: str) -> dict:
+@traced('route_question')
+def route_question(question: str, ctx: RequestContext | None = None) -> dict:
     q = (question or '').lower()
     keyword_hits = [
         'on track',
@@ -34,23 +39,38 @@ def route_question(question: str) -> dict:
     ]
     if any(k in q for k in keyword_hits):
         return {'route': 'analytics_agent', 'reason': 'keyword heuristic'}
-    raw = call_gemini(build_router_prompt(question))
+    local = route_classifier.classify(question)
+    if local and local[1] >= route_classifier.confidence_threshold():
+        route_classifier.record_local_hit()
+        return {'route': local[0], 'reason': 'local classifier', 'confidence': round(local[1], 4)}
+    started = time.perf_counter()
+    info: dict = {}
+    raw = call_gemini(build_router_prompt(question), ctx=ctx, info=info)
+    # A cache hit says nothing about router latency; log it without one so retrain() averages real calls only.
+    latency_ms = None if info.get('cached') else (time.perf_counter() - started) * 1000.0
     if not raw:
         return {'route': 'normal_intent', 'reason': 'router llm empty'}
     json_text = extract_json_object(raw) or raw.strip()
     try:
         obj = json.loads(json_text)
     except json.JSONDecodeError:
+        reject_response(ctx, raw)
         return {'route': 'normal_intent', 'reason': 'router json parse failed'}
     route = str(obj.get('route', 'normal_intent')).strip().lower()
     if route not in {'normal_intent', 'analytics_agent'}:
         route = 'normal_intent'
-    return {'route': route, 'reason': str(obj.get('reason', '')), '_raw': raw}
+    route_classifier.log_decision(question, route, 'llm', latency_ms=latency_ms, local=local)
+    result = {'route': route, 'reason': str(obj.get('reason', '')), '_raw': raw}
+    if local:
+        result['local_route'] = local[0]
+        result['local_confidence'] = round(local[1], 4)
+    return result
 
 
-def apply_stage_bucket_to_intent(intent: dict, stage_bucket: str | None) -> dict:
-    normalized_bucket = normalize_stage_bucket(stage_bucket)
-    stage_rule = get_business_rules().get('stage_buckets', {}).get(normalized_bucket, {})
+def apply_stage_bucket_to_intent(intent: dict, stage_bucket: str | None, ctx: RequestContext | None = None) -> dict:
+    rules = memoize(ctx, 'business_rules', None, get_business_rules)
+    normalized_bucket = normalize_stage_bucket(stage_bucket, rules)
+    stage_rule = rules.get('stage_buckets', {}).get(normalized_bucket, {})
     mode = str(stage_rule.get('mode', 'none')).lower()
     values = [str(v) for v in stage_rule.get('values', [])]
 
@@ -83,21 +103,29 @@ def apply_stage_bucket_to_intent(intent: dict, stage_bucket: str | None) -> dict
     return intent
 
 
-def plan_intent(question: str, route: str = 'normal_intent', stage_bucket: str | None = None) -> dict:
+@traced('plan_intent')
+def plan_intent(
+    question: str,
+    route: str = 'normal_intent',
+    stage_bucket: str | None = None,
+    ctx: RequestContext | None = None,
+) -> dict:
     prompt = (
         build_intent_prompt_analytics(question, stage_bucket=normalize_stage_bucket(stage_bucket))
         if route == 'analytics_agent'
         else build_intent_prompt(question, stage_bucket=normalize_stage_bucket(stage_bucket))
     )
-    raw = call_gemini(prompt)
+    raw = call_gemini(prompt, ctx=ctx)
     if not raw:
         raise RuntimeError('LLM returned no intent JSON.')
     json_text = extract_json_object(raw) or raw.strip()
     try:
         obj = json.loads(json_text)
     except json.JSONDecodeError:
+        reject_response(ctx, raw)
         raise RuntimeError(f'Intent planner did not return valid JSON. Raw: {raw!r}')
     if not isinstance(obj, dict):
+        reject_response(ctx, raw)
         raise RuntimeError('Intent planner JSON must be an object.')
 
     normalized = {
@@ -123,4 +151,4 @@ def plan_intent(question: str, route: str = 'normal_intent', stage_bucket: str |
 
     normalized['_raw'] = raw
     normalized['_route'] = route
-    return apply_stage_bucket_to_intent(normalized, stage_bucket)
+    return apply_stage_bucket_to_intent(normalized, stage_bucket, ctx=ctx)
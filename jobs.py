@@ -0,0 +1,193 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .config import env_float, env_int, log_error
+from .metrics import end_trace, start_trace
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+
+class JobCancelled(RuntimeError):
+    pass
+
+
+class JobQueueFull(RuntimeError):
+    def __init__(self, message: str, retry_after_s: int):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class Job:
+    def __init__(self, kind: str, payload: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stages: list[dict] = []
+        self.result = None
+        self.error = None
+        self.timings = None
+        self.future = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def cancel_event(self) -> threading.Event:
+        return self._cancel
+
+    def _close_stage(self, status: str, now: float) -> None:
+        if self.stages and self.stages[-1]['status'] == 'running':
+            current = self.stages[-1]
+            current['status'] = status
+            current['ms'] = round((now - current['_started']) * 1000.0, 1)
+
+    def stage(self, name: str) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(f'Job cancelled before {name}.')
+        now = time.monotonic()
+        with self._lock:
+            self._close_stage('done', now)
+            self.stages.append({'name': name, 'status': 'running', 'started_at': time.time(), '_started': now})
+
+    def _finish(self, status: str, result=None, error: str | None = None) -> None:
+        with self._lock:
+            self._close_stage('done' if status == 'succeeded' else status, time.monotonic())
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+
+    def snapshot(self, include_result: bool = True) -> dict:
+        with self._lock:
+            data = {
+                'id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'cancel_requested': self._cancel.is_set(),
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'stage': self.stages[-1]['name'] if self.stages else None,
+                'stages': [{k: v for k, v in s.items() if not k.startswith('_')} for s in self.stages],
+                'error': self.error,
+            }
+            if self.started_at:
+                data['elapsed_s'] = round((self.finished_at or time.time()) - self.started_at, 3)
+            if include_result and self.status in FINISHED:
+                data['result'] = self.result
+                data['timings'] = self.timings
+        return data
+
+
+class JobManager:
+    def __init__(self, workers: int = 2, max_pending: int = 32, ttl_s: float = 900.0):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.ttl_s = ttl_s
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0, 'rejected': 0, 'expired': 0}
+
+    def _active(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status not in FINISHED)
+
+    def cleanup(self) -> int:
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.status in FINISHED and (job.finished_at or 0) <= cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._stats['expired'] += len(expired)
+        return len(expired)
+
+    def submit(self, kind: str, payload: dict, fn) -> Job:
+        self.cleanup()
+        job = Job(kind, payload)
+        with self._lock:
+            if self._active() >= self.max_pending:
+                self._stats['rejected'] += 1
+                raise JobQueueFull(f'Too many pending jobs (limit {self.max_pending}).', retry_after_s=5)
+            self._jobs[job.id] = job
+            self._stats['submitted'] += 1
+        job.future = self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn) -> None:
+        if job.cancel_requested:
+            self._record(job, 'cancelled', error='Job cancelled before it started.')
+            return
+        with job._lock:
+            job.status = 'running'
+            job.started_at = time.time()
+        trace = start_trace()
+        try:
+            result = fn(job)
+        except JobCancelled as exc:
+            self._record(job, 'cancelled', error=str(exc))
+        except Exception as exc:
+            log_error(traceback.format_exc())
+            self._record(job, 'failed', error=str(exc))
+        else:
+            self._record(job, 'succeeded', result=result)
+        finally:
+            job.timings = trace.summary()
+            end_trace()
+
+    def _record(self, job: Job, status: str, result=None, error: str | None = None) -> None:
+        job._finish(status, result=result, error=error)
+        with self._lock:
+            self._stats[status] += 1
+
+    def get(self, job_id: str) -> Job | None:
+        self.cleanup()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> list[Job]:
+        self.cleanup()
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Job | None:
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            self._record(job, 'cancelled', error='Job cancelled before it started.')
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            statuses = [job.status for job in self._jobs.values()]
+        data['queued'] = statuses.count('queued')
+        data['running'] = statuses.count('running')
+        data['retained'] = len(statuses)
+        data['workers'] = self.workers
+        data['max_pending'] = self.max_pending
+        data['ttl_s'] = self.ttl_s
+        return data
+
+
+def build_job_manager() -> JobManager:
+    return JobManager(
+        workers=env_int('JOBS_WORKERS', 2),
+        max_pending=env_int('JOBS_MAX_PENDING', 32),
+        ttl_s=env_float('JOBS_TTL_S', 900.0),
+    )
@@ -0,0 +1,236 @@
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .business_rules import (
+    compiled_rules,
+    country_code_for_region,
+    get_business_rules,
+    legal_entity_name,
+    stage_bucket_predicate,
+)
+from .config import env_float, env_int, log_error
+from .query_budget import budget_for
+from .replica import run_query
+
+
+def build_kpi_strip_sql(stage_bucket: str, rules: dict | None = None) -> str:
+    stage_sql = stage_bucket_predicate(stage_bucket, alias='ds', rules=rules)
+    pipeline_sql = stage_bucket_predicate('pipeline', alias='ds', rules=rules)
+    return f"""
+WITH current_quarter AS (
+  SELECT
+    MIN(dd.calendar_date) AS q_start,
+    MAX(dd.calendar_date) AS q_end,
+    MAX(dd.calendar_year) AS q_year,
+    MAX(dd.calendar_quarter) AS q_quarter
+  FROM dw.DimDate dd
+  WHERE dd.calendar_year = YEAR(GETDATE())
+    AND dd.calendar_quarter = DATEPART(QUARTER, GETDATE())
+),
+actuals AS (
+  SELECT
+    SUM(ber.revenue_fx) / 1000.0 AS revenue_k,
+    SUM(ber.margin_fx) / 1000.0 AS margin_k
+  FROM grp.FactSale fs
+  JOIN grp.BridgeExchangeRate ber ON fs.sale_key = ber.sale_key
+  JOIN dw.DimExchangeRate der ON ber.exchange_rate_key = der.exchange_rate_key
+  JOIN grp.DimLegalEntity dle ON fs.legal_entity_id = dle.legal_entity_id
+  JOIN dw.DimDate dd ON fs.close_date_key = dd.date_key
+  JOIN grp.DimDealStage ds ON fs.deal_stage_key = ds.deal_stage_key
+  CROSS JOIN current_quarter cq
+  WHERE der.reporting_currency_code = ?
+    AND dle.legal_entity_name = ?
+    AND dle.country_code = ?
+    AND dd.calendar_date >= cq.q_start
+    AND dd.calendar_date <= cq.q_end
+    AND ({stage_sql})
+),
+budget AS (
+  SELECT
+    SUM(bber.revenue_fx) / 1000.0 AS budget_revenue_k
+  FROM dw.FactBudget fb
+  JOIN grp.BridgeBudgetExchangeRate bber ON fb.budget_key = bber.budget_key
+  JOIN dw.DimExchangeRate der ON bber.exchange_rate_key = der.exchange_rate_key
+  JOIN grp.DimLegalEntity dle ON fb.legal_entity_id = dle.legal_entity_id
+  JOIN dw.DimDate dd ON fb.month_end_date_key = dd.date_key
+  CROSS JOIN current_quarter cq
+  WHERE der.reporting_currency_code = ?
+    AND dle.legal_entity_name = ?
+    AND dle.country_code = ?
+    AND dd.calendar_year = cq.q_year
+    AND dd.calendar_quarter = cq.q_quarter
+),
+pipeline AS (
+  SELECT
+    SUM(ber.revenue_fx) / 1000.0 AS pipeline_k
+  FROM grp.FactSale fs
+  JOIN grp.BridgeExchangeRate ber ON fs.sale_key = ber.sale_key
+  JOIN dw.DimExchangeRate der ON ber.exchange_rate_key = der.exchange_rate_key
+  JOIN grp.DimLegalEntity dle ON fs.legal_entity_id = dle.legal_entity_id
+  JOIN dw.DimDate dd ON fs.close_date_key = dd.date_key
+  JOIN grp.DimDealStage ds ON fs.deal_stage_key = ds.deal_stage_key
+  CROSS JOIN current_quarter cq
+  WHERE der.reporting_currency_code = ?
+    AND dle.legal_entity_name = ?
+    AND dle.country_code = ?
+    AND dd.calendar_date >= cq.q_start
+    AND dd.calendar_date <= cq.q_end
+    AND ({pipeline_sql})
+)
+SELECT
+  a.revenue_k,
+  a.margin_k,
+  b.budget_revenue_k,
+  (b.budget_revenue_k - a.revenue_k) AS gap_k,
+  CASE WHEN b.budget_revenue_k = 0 THEN NULL ELSE p.pipeline_k / b.budget_revenue_k END AS coverage_ratio
+FROM actuals a
+CROSS JOIN budget b
+CROSS JOIN pipeline p;
+"""
+
+
+def _as_float(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def compute_kpi_strip(region: str, reporting_currency: str, stage_bucket: str) -> dict:
+    rules = get_business_rules()
+    country_code = country_code_for_region(region, rules)
+    params = (reporting_currency, legal_entity_name(rules), country_code) * 3
+    budget = budget_for('kpi')
+    _, rows = run_query(build_kpi_strip_sql(stage_bucket, rules), budget, params)
+    row = rows[0] if rows else None
+    now = datetime.now(timezone.utc)
+    return {
+        'quarter': f'Q{((now.month - 1) // 3) + 1} {now.year}',
+        'region': region,
+        'reporting_currency': reporting_currency,
+        'stage_bucket': stage_bucket,
+        'kpis': {
+            'revenue_k': _as_float(row[0]) if row else None,
+            'margin_k': _as_float(row[1]) if row else None,
+            'budget_revenue_k': _as_float(row[2]) if row else None,
+            'gap_k': _as_float(row[3]) if row else None,
+            'coverage_ratio': _as_float(row[4]) if row else None,
+        },
+        'as_of': now.isoformat(timespec='seconds'),
+        'source': budget.source,
+    }
+
+
+def kpi_combinations(rules: dict | None = None) -> list[tuple[str, str, str]]:
+    return list(compiled_rules(rules).kpi_combinations)
+
+
+class KpiService:
+    def __init__(self, compute=compute_kpi_strip, *, max_age_s: float = 300.0, refresh_interval_s: float = 300.0, workers: int = 2):
+        self._compute = compute
+        self.max_age_s = max_age_s
+        self.refresh_interval_s = refresh_interval_s
+        self._snapshots: dict[tuple, tuple[float, dict]] = {}
+        self._inflight: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='kpi-refresh')
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'served_fresh': 0, 'served_stale': 0, 'cold_misses': 0, 'refreshes': 0, 'refresh_errors': 0, 'deduplicated': 0}
+
+    def _run(self, key: tuple) -> dict:
+        try:
+            data = self._compute(*key)
+        except Exception:
+            with self._lock:
+                self._inflight.pop(key, None)
+                self._stats['refresh_errors'] += 1
+            raise
+        with self._lock:
+            self._snapshots[key] = (time.time(), data)
+            self._inflight.pop(key, None)
+            self._stats['refreshes'] += 1
+        return data
+
+    def refresh(self, key: tuple) -> Future:
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['deduplicated'] += 1
+                return future
+            future = self._executor.submit(self._run, key)
+            self._inflight[key] = future
+            return future
+
+    def get(self, region: str, reporting_currency: str, stage_bucket: str, *, timeout_s: float | None = None) -> dict:
+        key = (region, reporting_currency, stage_bucket)
+        now = time.time()
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot is not None:
+            stored_at, data = snapshot
+            age_s = now - stored_at
+            stale = age_s >= self.max_age_s
+            if stale:
+                self.refresh(key)
+            with self._lock:
+                self._stats['served_stale' if stale else 'served_fresh'] += 1
+            return dict(data, age_s=round(age_s, 1), stale=stale)
+        with self._lock:
+            self._stats['cold_misses'] += 1
+        data = self.refresh(key).result(timeout=timeout_s)
+        return dict(data, age_s=0.0, stale=False)
+
+    def refresh_all(self) -> list[Future]:
+        futures = []
+        for key in kpi_combinations():
+            futures.append(self.refresh(key))
+        return futures
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                for future in self.refresh_all():
+                    try:
+                        future.result()
+                    except Exception:
+                        log_error(traceback.format_exc())
+            except Exception:
+                log_error(traceback.format_exc())
+            self._stop.wait(self.refresh_interval_s)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='kpi-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            data = dict(self._stats)
+            data['snapshots'] = len(self._snapshots)
+            data['inflight'] = len(self._inflight)
+            ages = [now - stored_at for stored_at, _ in self._snapshots.values()]
+        data['oldest_snapshot_s'] = round(max(ages), 1) if ages else None
+        data['max_age_s'] = self.max_age_s
+        data['refresh_interval_s'] = self.refresh_interval_s
+        data['scheduler_running'] = bool(self._thread and self._thread.is_alive())
+        return data
+
+
+def build_kpi_service() -> KpiService:
+    return KpiService(
+        max_age_s=env_float('KPI_MAX_AGE_S', 300.0),
+        refresh_interval_s=env_float('KPI_REFRESH_INTERVAL_S', 300.0),
+        workers=env_int('KPI_REFRESH_WORKERS', 2),
+    )
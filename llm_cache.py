@@ -0,0 +1,167 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import traceback
+
+from .config import LLM_CACHE_DB_PATH, env_float, env_int, log_error
+
+_STATS = {'hits': 0, 'misses': 0, 'stores': 0, 'bypassed': 0, 'evictions': 0, 'rejected': 0, 'errors': 0}
+_STATS_LOCK = threading.Lock()
+_INIT = {'path': None}
+
+
+def _bump(name: str, amount: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[name] += amount
+
+
+def record_bypass() -> None:
+    _bump('bypassed')
+
+
+def enabled() -> bool:
+    return env_int('LLM_CACHE_ENABLED', 1) == 1
+
+
+def _connect(path: str | None = None):
+    path = path or LLM_CACHE_DB_PATH
+    conn = sqlite3.connect(path, timeout=5.0)
+    if _INIT['path'] != path:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            '''
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit_at)')
+        conn.commit()
+        _INIT['path'] = path
+    return conn
+
+
+def cache_key(model: str, generation_config: dict, prompt: str) -> str:
+    material = json.dumps(
+        {'model': model, 'config': generation_config or {}, 'prompt_sha256': hashlib.sha256(prompt.encode('utf-8')).hexdigest()},
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def get(key: str, path: str | None = None) -> str | None:
+    max_age_s = env_float('LLM_CACHE_MAX_AGE_S', 7 * 24 * 3600.0)
+    now = time.time()
+    try:
+        conn = _connect(path)
+        try:
+            row = conn.execute('SELECT response, created_at FROM llm_cache WHERE cache_key = ?', (key,)).fetchone()
+            if row and (max_age_s <= 0 or now - row[1] < max_age_s):
+                conn.execute('UPDATE llm_cache SET hits = hits + 1, last_hit_at = ? WHERE cache_key = ?', (now, key))
+                conn.commit()
+                _bump('hits')
+                return row[0]
+        finally:
+            conn.close()
+    except Exception:
+        _bump('errors')
+        log_error(traceback.format_exc())
+    _bump('misses')
+    return None
+
+
+def put(key: str, model: str, response: str, path: str | None = None) -> None:
+    now = time.time()
+    try:
+        conn = _connect(path)
+        try:
+            conn.execute(
+                '''
+                INSERT OR REPLACE INTO llm_cache (cache_key, model, response, size, created_at, last_hit_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, 0)
+                ''',
+                (key, model, response, len(response.encode('utf-8')), now, now),
+            )
+            conn.commit()
+            _bump('stores')
+            _evict(conn, now)
+        finally:
+            conn.close()
+    except Exception:
+        _bump('errors')
+        log_error(traceback.format_exc())
+
+
+def delete(keys, path: str | None = None) -> int:
+    keys = [(key,) for key in keys]
+    if not keys:
+        return 0
+    try:
+        conn = _connect(path)
+        try:
+            removed = conn.executemany('DELETE FROM llm_cache WHERE cache_key = ?', keys).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        _bump('errors')
+        log_error(traceback.format_exc())
+        return 0
+    _bump('rejected', removed)
+    return removed
+
+
+def _evict(conn, now: float) -> None:
+    max_age_s = env_float('LLM_CACHE_MAX_AGE_S', 7 * 24 * 3600.0)
+    max_bytes = env_int('LLM_CACHE_MAX_BYTES', 50 * 1024 * 1024)
+    removed = 0
+    if max_age_s > 0:
+        removed += conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - max_age_s,)).rowcount
+    total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM llm_cache').fetchone()[0]
+    if max_bytes > 0 and total > max_bytes:
+        freed = 0
+        doomed = []
+        for key, size in conn.execute('SELECT cache_key, size FROM llm_cache ORDER BY last_hit_at ASC'):
+            if total - freed <= max_bytes:
+                break
+            doomed.append((key,))
+            freed += size
+        conn.executemany('DELETE FROM llm_cache WHERE cache_key = ?', doomed)
+        removed += len(doomed)
+    if removed:
+        conn.commit()
+        _bump('evictions', removed)
+
+
+def clear(path: str | None = None) -> int:
+    conn = _connect(path)
+    try:
+        removed = conn.execute('DELETE FROM llm_cache').rowcount
+        conn.commit()
+        return removed
+    finally:
+        conn.close()
+
+
+def stats(path: str | None = None) -> dict:
+    with _STATS_LOCK:
+        data = dict(_STATS)
+    try:
+        conn = _connect(path)
+        try:
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+        finally:
+            conn.close()
+        data['entries'] = entries
+        data['bytes'] = size
+    except Exception:
+        log_error(traceback.format_exc())
+    return data
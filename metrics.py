@@ -0,0 +1,270 @@
+import contextvars
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'assistant_'
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MAX_TRACE_SPANS = 200
+
+_LOCK = threading.Lock()
+_METRICS: dict[str, object] = {}
+_COLLECTORS: list = []
+_TRACE: contextvars.ContextVar = contextvars.ContextVar('assistant_trace', default=None)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> dict:
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None:
+                return {'count': 0, 'sum': 0.0}
+            return {'count': series[2], 'sum': series[1]}
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{_format_labels(key, (("le", _format_value(bound)),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+def counter(name: str, help_text: str) -> Counter:
+    with _LOCK:
+        metric = _METRICS.get(PREFIX + name)
+        if metric is None:
+            metric = _METRICS[PREFIX + name] = Counter(PREFIX + name, help_text)
+        return metric
+
+
+def histogram(name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    with _LOCK:
+        metric = _METRICS.get(PREFIX + name)
+        if metric is None:
+            metric = _METRICS[PREFIX + name] = Histogram(PREFIX + name, help_text, buckets)
+        return metric
+
+
+STAGE_SECONDS = histogram('stage_duration_seconds', 'Time spent in each pipeline stage.')
+HTTP_SECONDS = histogram('http_request_duration_seconds', 'HTTP request latency by endpoint and status.')
+WAIT_SECONDS = histogram('wait_seconds', 'Time spent waiting for a slot (admission, warehouse pool, Gemini connections).')
+LLM_CALLS = counter('llm_calls_total', 'Gemini API requests by kind and outcome.')
+LLM_RETRIES = counter('llm_retries_total', 'Gemini API retries by kind.')
+CACHE_EVENTS = counter('cache_events_total', 'Cache lookups by cache and outcome.')
+ROWS_RETURNED = counter('rows_returned_total', 'Rows fetched from the warehouse.')
+
+
+def register_stats(name: str, fn, label: str | None = None, counters=()) -> None:
+    # `counters` names the monotonic keys; they are exported as `<name>_total` counters, the rest as gauges.
+    # A counter key that holds a dict marks every value in that dict as a counter.
+    with _LOCK:
+        _COLLECTORS.append((name, fn, label, frozenset(counters)))
+
+
+def _flatten(
+    prefix: str, data: dict, labels: tuple, out: dict, counters=frozenset(), all_counters: bool = False
+) -> None:
+    for key, value in data.items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)) and math.isfinite(value):
+            metric = f'{prefix}_{key}'.lower().replace('-', '_').replace('.', '_')
+            kind = 'gauge'
+            if all_counters or key in counters:
+                kind = 'counter'
+                if not metric.endswith('_total'):
+                    metric += '_total'
+            out.setdefault(metric, (kind, []))[1].append((labels, value))
+
+
+def _collect() -> dict[str, tuple]:
+    series: dict[str, tuple] = {}
+    with _LOCK:
+        collectors = list(_COLLECTORS)
+    for name, fn, label, counters in collectors:
+        try:
+            data = fn() or {}
+        except Exception:
+            continue
+        prefix = PREFIX + name
+        if label:
+            for group, values in data.items():
+                if isinstance(values, dict):
+                    _flatten(prefix, values, ((label, str(group)),), series, counters)
+        else:
+            _flatten(prefix, data, (), series, counters)
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    _flatten(f'{prefix}_{key}', value, (), series, all_counters=key in counters)
+    return series
+
+
+def render_prometheus() -> str:
+    lines: list[str] = []
+    with _LOCK:
+        metrics = sorted(_METRICS.items())
+    for name, metric in metrics:
+        body = metric.render()
+        if not body:
+            continue
+        lines.append(f'# HELP {name} {metric.help}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(body)
+    for name, (kind, series) in sorted(_collect().items()):
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{name}{_format_labels(labels)} {_format_value(value)}' for labels, value in series)
+    return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: list[tuple[str, float, float]] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, started: float, duration_s: float) -> None:
+        with self._lock:
+            if len(self.spans) >= MAX_TRACE_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append((stage, started - self.started, duration_s))
+
+    def summary(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        stages: dict[str, dict] = {}
+        for stage, _, duration in spans:
+            entry = stages.setdefault(stage, {'ms': 0.0, 'count': 0})
+            entry['ms'] += duration * 1000.0
+            entry['count'] += 1
+        for entry in stages.values():
+            entry['ms'] = round(entry['ms'], 3)
+        return {
+            'total_ms': round((time.perf_counter() - self.started) * 1000.0, 3),
+            'stages': stages,
+            'spans': [
+                {'stage': stage, 'start_ms': round(offset * 1000.0, 3), 'ms': round(duration * 1000.0, 3)}
+                for stage, offset, duration in spans
+            ],
+            'dropped_spans': self.dropped,
+        }
+
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _TRACE.set(trace)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _TRACE.get()
+
+
+def end_trace() -> Trace | None:
+    trace = _TRACE.get()
+    _TRACE.set(None)
+    return trace
+
+
+@contextmanager
+def span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=stage)
+        trace = _TRACE.get()
+        if trace is not None:
+            trace.add(stage, started, duration)
+
+
+def traced(stage: str):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
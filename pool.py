@@ -0,0 +1,298 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .metrics import WAIT_SECONDS
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+class _Slot:
+    __slots__ = ('conn', 'created_at', 'last_used_at')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used_at = now
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        factory,
+        *,
+        min_size: int = 0,
+        max_size: int = 4,
+        acquire_timeout_s: float = 30.0,
+        max_idle_s: float = 300.0,
+        max_lifetime_s: float = 1800.0,
+        ping_after_s: float = 30.0,
+        ping_sql: str = 'SELECT 1',
+        maintenance_interval_s: float = 60.0,
+    ):
+        if max_size < 1:
+            raise ValueError('max_size must be >= 1')
+        self._factory = factory
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max_size
+        self.acquire_timeout_s = acquire_timeout_s
+        self.max_idle_s = max_idle_s
+        self.max_lifetime_s = max_lifetime_s
+        self.ping_after_s = ping_after_s
+        self.ping_sql = ping_sql
+        self.maintenance_interval_s = maintenance_interval_s
+        self._idle: deque[_Slot] = deque()
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats = {
+            'creates': 0,
+            'create_failures': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_s': 0.0,
+            'timeouts': 0,
+            'health_failures': 0,
+            'idle_evictions': 0,
+            'lifetime_recycles': 0,
+            'discards': 0,
+            'rollback_failures': 0,
+            'warm_failures': 0,
+            'maintenance_runs': 0,
+        }
+
+    @property
+    def size(self) -> int:
+        return self._in_use + len(self._idle)
+
+    def stats(self) -> dict:
+        with self._cond:
+            data = dict(self._stats)
+            data['wait_time_s'] = round(data['wait_time_s'], 6)
+            data['in_use'] = self._in_use
+            data['idle'] = len(self._idle)
+            data['size'] = self.size
+            data['min_size'] = self.min_size
+            data['max_size'] = self.max_size
+            data['maintenance_running'] = self._thread is not None and self._thread.is_alive()
+            return data
+
+    def _expired(self, slot: _Slot, now: float) -> str | None:
+        if self.max_lifetime_s and now - slot.created_at >= self.max_lifetime_s:
+            return 'lifetime_recycles'
+        if self.max_idle_s and now - slot.last_used_at >= self.max_idle_s:
+            return 'idle_evictions'
+        return None
+
+    def _close_quietly(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn) -> bool:
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.ping_sql)
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+        finally:
+            if cursor is not None:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def _create(self):
+        try:
+            conn = self._factory()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._stats['create_failures'] += 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['creates'] += 1
+        return _Slot(conn)
+
+    def prune(self) -> int:
+        now = time.monotonic()
+        stale: list[_Slot] = []
+        with self._cond:
+            keep: deque[_Slot] = deque()
+            for slot in self._idle:
+                reason = self._expired(slot, now)
+                if reason == 'idle_evictions' and self.size - len(stale) <= self.min_size:
+                    reason = None
+                if reason:
+                    self._stats[reason] += 1
+                    stale.append(slot)
+                else:
+                    keep.append(slot)
+            self._idle = keep
+            if stale:
+                self._cond.notify_all()
+        for slot in stale:
+            self._close_quietly(slot.conn)
+        return len(stale)
+
+    def warm(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed or self.size >= self.min_size:
+                    return
+                self._in_use += 1
+            slot = self._create()
+            with self._cond:
+                self._in_use -= 1
+                self._idle.append(slot)
+                self._cond.notify()
+
+    def maintain(self) -> None:
+        self.prune()
+        try:
+            self.warm()
+        except Exception:
+            with self._cond:
+                self._stats['warm_failures'] += 1
+        with self._cond:
+            self._stats['maintenance_runs'] += 1
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.maintain()
+            self._stop.wait(self.maintenance_interval_s)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='db-pool', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _checkout(self, timeout_s: float) -> _Slot:
+        deadline = time.monotonic() + timeout_s
+        waited_from = None
+        waited_s = 0.0
+        while True:
+            to_close: list[_Slot] = []
+            slot = None
+            create = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError('Connection pool is closed.')
+                    now = time.monotonic()
+                    while self._idle:
+                        candidate = self._idle.pop()
+                        reason = self._expired(candidate, now)
+                        if reason:
+                            self._stats[reason] += 1
+                            to_close.append(candidate)
+                            continue
+                        slot = candidate
+                        break
+                    if slot is not None:
+                        self._in_use += 1
+                        break
+                    if self.size < self.max_size:
+                        self._in_use += 1
+                        create = True
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        if waited_from is not None:
+                            self._stats['wait_time_s'] += now - waited_from
+                            waited_s += now - waited_from
+                        WAIT_SECONDS.observe(waited_s, resource='db_pool')
+                        raise PoolTimeout(
+                            f'Timed out after {timeout_s:.1f}s waiting for a warehouse connection '
+                            f'(pool size {self.max_size}).'
+                        )
+                    if waited_from is None:
+                        waited_from = now
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                if waited_from is not None:
+                    self._stats['wait_time_s'] += time.monotonic() - waited_from
+                    waited_s += time.monotonic() - waited_from
+                    waited_from = None
+            for stale in to_close:
+                self._close_quietly(stale.conn)
+            if create:
+                slot = self._create()
+            elif self.ping_after_s is not None and time.monotonic() - slot.last_used_at >= self.ping_after_s:
+                if not self._healthy(slot.conn):
+                    self._close_quietly(slot.conn)
+                    with self._cond:
+                        self._in_use -= 1
+                        self._stats['health_failures'] += 1
+                        self._cond.notify()
+                    continue
+            with self._cond:
+                self._stats['checkouts'] += 1
+            WAIT_SECONDS.observe(waited_s, resource='db_pool')
+            return slot
+
+    def _reset(self, conn) -> bool:
+        try:
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _checkin(self, slot: _Slot, discard: bool = False) -> None:
+        rolled_back = discard or self._reset(slot.conn)
+        now = time.monotonic()
+        slot.last_used_at = now
+        close = discard or not rolled_back
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._stats['discards'] += 1
+            elif not rolled_back:
+                self._stats['rollback_failures'] += 1
+            elif self._closed:
+                close = True
+            elif self.max_lifetime_s and now - slot.created_at >= self.max_lifetime_s:
+                self._stats['lifetime_recycles'] += 1
+                close = True
+            else:
+                self._idle.append(slot)
+            self._cond.notify()
+        if close:
+            self._close_quietly(slot.conn)
+
+    @contextmanager
+    def connection(self, timeout_s: float | None = None):
+        slot = self._checkout(self.acquire_timeout_s if timeout_s is None else timeout_s)
+        try:
+            yield slot.conn
+        except BaseException:
+            self._checkin(slot, discard=not self._healthy(slot.conn))
+            raise
+        self._checkin(slot)
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for slot in idle:
+            self._close_quietly(slot.conn)
@@ -3,6 +3,26 @@ import json
 from .business_rules import legal_entity_name, stage_bucket_rule_text
 
 
+DATE_JOIN_RULES = (
+    'DATE JOIN RULES (MANDATORY):\n'
+    '- FactSale.close_date_key is INT and must join to dw.DimDate.date_key (INT).\n'
+    '- NEVER compare date_key (INT) to calendar_date (DATE).\n'
+    '- NEVER compare calendar_date to integer literals.\n'
+    '- Join pattern must always be: JOIN dw.DimDate AS dd ON fs.close_date_key = dd.date_key\n'
+    '- All time filtering must use dd.calendar_year, dd.calendar_month, dd.calendar_quarter.\n'
+    "- Do NOT filter using dd.calendar_date unless comparing to DATE literal (e.g. '2024-01-01').\n"
+    '- For month-to-date, use dd.calendar_month = current month AND dd.calendar_year = current year.\n\n'
+)
+
+
+def date_rules_for(schema_text: str) -> str:
+    return DATE_JOIN_RULES if 'dimdate' in (schema_text or '').lower() else ''
+
+
+def intent_json(intent: dict) -> str:
+    return json.dumps({k: v for k, v in (intent or {}).items() if k != '_raw'}, ensure_ascii=True)
+
+
 def build_intent_prompt(question: str, stage_bucket: str = 'not_applied') -> str:
     stage_hint = stage_bucket_rule_text(stage_bucket)
     return (
@@ -122,29 +142,9 @@ def build_sql_from_intent_prompt(
         'Return thousands as whole numbers (no decimal places).\n\n'
         'Schema and rules:\n'
         f'{schema_text}\n\n'
-        """Date Schema
-        date_key (int)
-        calendar_date (date)
-        calendar_year (smallint)
-        calendar_month (smallint)
-        calendar_quarter (smallint)
-        start_of_month_date (date)
-        end_of_month_date (date)
-        DATE JOIN RULES (MANDATORY):
-
-        - FactSale.close_date_key is INT and must join to dw.DimDate.date_key (INT).
-        - NEVER compare date_key (INT) to calendar_date (DATE).
-        - NEVER compare calendar_date to integer literals.
-        - Join pattern must always be:
-
-        JOIN dw.DimDate AS dd
-            ON fs.close_date_key = dd.date_key
-
-        - All time filtering must use dd.calendar_year, dd.calendar_month, dd.calendar_quarter.
-        - Do NOT filter using dd.calendar_date unless comparing to DATE literal (e.g. '2024-01-01').
-        - For month-to-date, use dd.calendar_month = current month AND dd.calendar_year = current year"""
+        f'{date_rules_for(schema_text)}'
         'Input intent JSON:\n'
-        f'{json.dumps(intent, ensure_ascii=True)}\n\n'
+        f'{intent_json(intent)}\n\n'
         'Task: Generate a single T-SQL SELECT query that answers the intent.\n'
     )
 
@@ -186,30 +186,10 @@ def build_sql_from_analytics_prompt(
         'grp.FactSale, grp.BridgeExchangeRate, dw.DimExchangeRate, grp.DimLegalEntity, dw.DimDate, grp.DimDealStage,\n'
         'dw.FactBudget, grp.BridgeBudgetExchangeRate\n\n'
         'Schema and rules:\n'
-        """Date Schema
-        date_key (int)
-        calendar_date (date)
-        calendar_year (smallint)
-        calendar_month (smallint)
-        calendar_quarter (smallint)
-        start_of_month_date (date)
-        end_of_month_date (date)
-        DATE JOIN RULES (MANDATORY):
-
-        - FactSale.close_date_key is INT and must join to dw.DimDate.date_key (INT).
-        - NEVER compare date_key (INT) to calendar_date (DATE).
-        - NEVER compare calendar_date to integer literals.
-        - Join pattern must always be:
-
-        JOIN dw.DimDate AS dd
-            ON fs.close_date_key = dd.date_key
-
-        - All time filtering must use dd.calendar_year, dd.calendar_month, dd.calendar_quarter.
-        - Do NOT filter using dd.calendar_date unless comparing to DATE literal (e.g. '2024-01-01').
-        - For month-to-date, use dd.calendar_month = current month AND dd.calendar_year = current year"""""
         f'{schema_text}\n\n'
+        f'{date_rules_for(schema_text)}'
         'Intent JSON:\n'
-        f'{json.dumps(intent, ensure_ascii=True)}\n\n'
+        f'{intent_json(intent)}\n\n'
         'Use BridgeExchangeRate and BudgetBridgeExchangeRate for currency conversion. Join with DimExchangeRate for reporting currency filter.\n\n'
         'Generate ONLY the SQL that returns these two numeric columns.\n'
     )
@@ -265,7 +245,7 @@ def build_sql_validator_prompt(
         f"- country filter: dle.country_code = '{country_code}'\n"
         f"- stage bucket rule: {stage_bucket_rule_text(stage_bucket)}\n\n"
         f'Question: {question}\n'
-        f'Intent JSON: {json.dumps(intent, ensure_ascii=True)}\n\n'
+        f'Intent JSON: {intent_json(intent)}\n\n'
         f'{examples_block}'
         'Use intent fields as the source of truth for metric/time/filters/grouping.\n\n'
         'Proposed SQL:\n'
@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+
+from .config import env_float, env_int, log_error
+from .metrics import counter
+
+ROUTE_DEFAULTS = {
+    'normal_intent': {'timeout_s': 60.0, 'max_rows': 50000, 'max_bytes': 32 * 1024 * 1024},
+    'analytics_agent': {'timeout_s': 120.0, 'max_rows': 100000, 'max_bytes': 64 * 1024 * 1024},
+    'kpi': {'timeout_s': 30.0, 'max_rows': 1000, 'max_bytes': 1024 * 1024},
+    'default': {'timeout_s': 60.0, 'max_rows': 50000, 'max_bytes': 32 * 1024 * 1024},
+}
+
+BUDGET_EVENTS = counter('query_budget_events_total', 'Query budget enforcements by route and kind.')
+_STATS = {'queries': 0, 'timeouts': 0, 'cancelled': 0, 'truncated_rows': 0, 'truncated_bytes': 0}
+_STATS_LOCK = threading.Lock()
+
+
+class QueryBudgetExceeded(RuntimeError):
+    def __init__(self, message: str, kind: str, budget: 'QueryBudget'):
+        super().__init__(message)
+        self.kind = kind
+        self.budget = budget
+
+
+class QueryBudget:
+    def __init__(self, route: str, timeout_s: float, max_rows: int, max_bytes: int):
+        self.route = route
+        self.timeout_s = timeout_s
+        self.max_rows = max(1, max_rows)
+        self.max_bytes = max(1, max_bytes)
+        self.truncated = False
+        self.truncated_reason = None
+        self.row_count = 0
+        self.bytes = 0
+        self.elapsed_s = None
+        self.column_types = None
+        self.source = None
+
+    def reset_usage(self) -> None:
+        self.truncated = False
+        self.truncated_reason = None
+        self.row_count = 0
+        self.bytes = 0
+        self.elapsed_s = None
+        self.column_types = None
+
+    def limit_rows(self, max_rows) -> 'QueryBudget':
+        try:
+            requested = int(max_rows)
+        except (TypeError, ValueError):
+            return self
+        if requested > 0:
+            self.max_rows = min(self.max_rows, requested)
+        return self
+
+    def mark_truncated(self, reason: str, sql_text: str = '') -> None:
+        self.truncated = True
+        self.truncated_reason = reason
+        record(
+            'truncated_rows' if reason == 'max_rows' else 'truncated_bytes',
+            self,
+            sql_text,
+            rows=self.row_count,
+            bytes=self.bytes,
+        )
+
+    def clip(self, columns: list[str], rows: list, sql_text: str = '') -> list:
+        if len(rows) <= self.max_rows:
+            self.row_count = len(rows)
+            return rows
+        self.row_count = self.max_rows
+        self.mark_truncated('max_rows', sql_text)
+        return rows[: self.max_rows]
+
+    def report(self) -> dict:
+        return {
+            'route': self.route,
+            'timeout_s': self.timeout_s,
+            'max_rows': self.max_rows,
+            'max_bytes': self.max_bytes,
+            'row_count': self.row_count,
+            'bytes_est': self.bytes,
+            'truncated': self.truncated,
+            'truncated_reason': self.truncated_reason,
+            'elapsed_s': self.elapsed_s,
+        }
+
+
+def budget_for(route: str | None) -> QueryBudget:
+    name = route if route in ROUTE_DEFAULTS else 'default'
+    defaults = ROUTE_DEFAULTS[name]
+    prefix = f'QUERY_BUDGET_{name.upper()}'
+    return QueryBudget(
+        name,
+        timeout_s=env_float(f'{prefix}_TIMEOUT_S', env_float('QUERY_TIMEOUT_S', defaults['timeout_s'])),
+        max_rows=env_int(f'{prefix}_MAX_ROWS', env_int('QUERY_MAX_ROWS', defaults['max_rows'])),
+        max_bytes=env_int(f'{prefix}_MAX_BYTES', env_int('QUERY_MAX_BYTES', defaults['max_bytes'])),
+    )
+
+
+def record(kind: str, budget: QueryBudget, sql_text: str = '', **details) -> None:
+    with _STATS_LOCK:
+        _STATS[kind] += 1
+    BUDGET_EVENTS.inc(route=budget.route, kind=kind)
+    entry = {'event': 'query_budget', 'kind': kind, 'route': budget.route, 'sql': ' '.join((sql_text or '').split())[:500]}
+    entry.update(details)
+    entry['budget'] = {'timeout_s': budget.timeout_s, 'max_rows': budget.max_rows, 'max_bytes': budget.max_bytes}
+    log_error(json.dumps(entry, default=str))
+
+
+def count_query() -> None:
+    with _STATS_LOCK:
+        _STATS['queries'] += 1
+
+
+def stats() -> dict:
+    with _STATS_LOCK:
+        data = dict(_STATS)
+    data['routes'] = {route: budget_for(route).report() for route in ROUTE_DEFAULTS}
+    for budget in data['routes'].values():
+        for key in ('row_count', 'bytes_est', 'truncated', 'truncated_reason', 'elapsed_s'):
+            budget.pop(key)
+    return data
+
+
+class Watchdog:
+    def __init__(self, cursor, budget: QueryBudget, cancel_event: threading.Event | None = None):
+        self.cursor = cursor
+        self.budget = budget
+        self.cancel_event = cancel_event
+        self.reason = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='query-watchdog', daemon=True)
+
+    def __enter__(self) -> 'Watchdog':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._done.set()
+
+    def _run(self) -> None:
+        deadline = time.monotonic() + self.budget.timeout_s
+        while not self._done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.reason = 'timeout'
+                break
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                self.reason = 'cancelled'
+                break
+            self._done.wait(min(remaining, 0.25))
+        else:
+            return
+        try:
+            self.cursor.cancel()
+        except Exception:
+            pass
@@ -0,0 +1,385 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+import traceback
+
+from .business_rules import compiled_rules
+from .config import EXAMPLES_DB_PATH, env_float, env_int, log_error
+from .embedding_index import EmbeddingIndex, from_blob, to_blob
+from .gemini_client import embed_text
+from .metrics import CACHE_EVENTS, traced
+from .request_context import RequestContext, memoize
+
+# Words that never change what is asked. Everything else (entities, months, numbers, metrics, negations)
+# must match token for token before a semantic hit can replay another question's SQL.
+_STOPWORDS = {
+    'a', 'an', 'the', 'of', 'for', 'in', 'on', 'at', 'to', 'from', 'and', 'with', 'as', 'is', 'are', 'was', 'were',
+    'be', 'been', 'do', 'does', 'did', 'what', 'whats', 's', 'how', 'much', 'many', 'show', 'me', 'us', 'give',
+    'tell', 'get', 'list', 'find', 'display', 'please', 'can', 'could', 'you', 'i', 'we', 'our', 'my', 'want',
+    'see', 'know', 'there', 'which', 'that', 'so', 'far',
+}
+
+_STATS = {'lookups': 0, 'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'guard_rejects': 0, 'stores': 0, 'evictions': 0, 'errors': 0}
+_STATS_LOCK = threading.Lock()
+_EVENT_OUTCOMES = {'exact_hits': 'hit', 'semantic_hits': 'hit', 'misses': 'miss'}
+_INDEXES: dict[tuple, EmbeddingIndex] = {}
+_INDEX_LOCK = threading.Lock()
+_INIT = {'path': None}
+
+
+def _bump(name: str, amount: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[name] += amount
+    if name in _EVENT_OUTCOMES:
+        CACHE_EVENTS.inc(amount, cache='question', outcome=_EVENT_OUTCOMES[name])
+
+
+def enabled() -> bool:
+    return env_int('QUESTION_CACHE_ENABLED', 1) == 1
+
+
+def min_score() -> float:
+    return env_float('QUESTION_CACHE_MIN_SCORE', 0.95)
+
+
+def normalize_question(question: str) -> str:
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', (question or '').lower()).split())
+
+
+def _content_tokens(normalized: str) -> tuple:
+    return tuple(tok for tok in normalized.split() if tok not in _STOPWORDS)
+
+
+def rules_fingerprint(rules: dict | None = None) -> str:
+    return compiled_rules(rules).fingerprint
+
+
+def _connect():
+    conn = sqlite3.connect(EXAMPLES_DB_PATH, timeout=5.0)
+    if _INIT['path'] != EXAMPLES_DB_PATH:
+        conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS question_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                region TEXT NOT NULL,
+                reporting_currency TEXT NOT NULL,
+                stage_bucket TEXT NOT NULL,
+                rules_hash TEXT NOT NULL,
+                route TEXT NOT NULL,
+                intent_json TEXT NOT NULL,
+                sql_text TEXT NOT NULL,
+                embedding_blob BLOB,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_hit_at REAL NOT NULL
+            )
+            '''
+        )
+        conn.execute(
+            '''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_question_cache_key
+            ON question_cache (normalized, region, reporting_currency, stage_bucket, rules_hash)
+            '''
+        )
+        conn.execute(
+            '''
+            CREATE TABLE IF NOT EXISTS question_cache_scope (
+                region TEXT NOT NULL,
+                reporting_currency TEXT NOT NULL,
+                stage_bucket TEXT NOT NULL,
+                rules_hash TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                PRIMARY KEY (region, reporting_currency, stage_bucket, rules_hash)
+            )
+            '''
+        )
+        conn.commit()
+        _INIT['path'] = EXAMPLES_DB_PATH
+    return conn
+
+
+_SCOPE_WHERE = 'region = ? AND reporting_currency = ? AND stage_bucket = ? AND rules_hash = ?'
+
+
+def _bump_versions(conn, scopes) -> dict[tuple, tuple[int, int]]:
+    # Versions come from one counter shared by every scope and scope rows are never deleted, so a version
+    # number is never issued twice, even when the rules fingerprint flips back to an earlier value.
+    versions = {}
+    for scope in scopes:
+        found = conn.execute(f'SELECT version FROM question_cache_scope WHERE {_SCOPE_WHERE}', scope).fetchone()
+        version = conn.execute(
+            '''
+            INSERT INTO question_cache_scope (region, reporting_currency, stage_bucket, rules_hash, version)
+            VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM question_cache_scope))
+            ON CONFLICT (region, reporting_currency, stage_bucket, rules_hash) DO UPDATE SET version = excluded.version
+            RETURNING version
+            ''',
+            scope,
+        ).fetchone()[0]
+        versions[scope] = (found[0] if found else 0, version)
+    return versions
+
+
+def _apply_to_indexes(
+    versions: dict[tuple, tuple[int, int]], upserts: dict[tuple, list], removals: dict[tuple, list]
+) -> None:
+    # Patch indexes that were current before this write; any other index rebuilds on its next lookup.
+    with _INDEX_LOCK:
+        for scope, (previous, version) in versions.items():
+            index = _INDEXES.get(scope)
+            if index is None or index.version != previous:
+                continue
+            for row_id in removals.get(scope, ()):
+                index.remove(row_id)
+            for row_id, vector in upserts.get(scope, ()):
+                index.upsert(row_id, vector)
+            index.version = version
+
+
+def _scope_index(conn, scope: tuple) -> EmbeddingIndex:
+    found = conn.execute(f'SELECT version FROM question_cache_scope WHERE {_SCOPE_WHERE}', scope).fetchone()
+    version = found[0] if found else 0
+    index = _INDEXES.get(scope)
+    if index is not None and index.version == version:
+        return index
+    with _INDEX_LOCK:
+        index = _INDEXES.get(scope)
+        if index is None or index.version != version:
+            rows = conn.execute(
+                f'SELECT id, embedding_blob FROM question_cache WHERE {_SCOPE_WHERE} AND embedding_blob IS NOT NULL',
+                scope,
+            ).fetchall()
+            pairs = [(row[0], from_blob(row[1])) for row in rows]
+            pairs = [(i, v) for i, v in pairs if v is not None]
+            index = index or EmbeddingIndex()
+            index.bulk_load([i for i, _ in pairs], [v for _, v in pairs])
+            index.version = version
+            _INDEXES[scope] = index
+        return index
+
+
+def _drop_stale_indexes(rules_hash: str) -> None:
+    with _INDEX_LOCK:
+        for scope in [scope for scope in _INDEXES if scope[3] != rules_hash]:
+            del _INDEXES[scope]
+
+
+def _safe_embed(text: str) -> list[float] | None:
+    try:
+        return embed_text(text)
+    except Exception:
+        return None
+
+
+def _entry(row, match: str, score: float) -> dict:
+    return {
+        'id': row[0],
+        'question': row[1],
+        'route': row[2],
+        'intent': json.loads(row[3]),
+        'sql_text': row[4],
+        'match': match,
+        'score': round(score, 4),
+    }
+
+
+@traced('question_cache_lookup')
+def lookup(
+    question: str,
+    region: str,
+    reporting_currency: str,
+    stage_bucket: str,
+    ctx: RequestContext | None = None,
+) -> dict | None:
+    if not enabled():
+        return None
+    _bump('lookups')
+    normalized = normalize_question(question)
+    if not normalized:
+        _bump('misses')
+        return None
+    rules_hash = memoize(ctx, 'rules_fingerprint', None, rules_fingerprint)
+    scope = (region, reporting_currency, stage_bucket, rules_hash)
+    select = 'SELECT id, question, route, intent_json, sql_text, normalized FROM question_cache'
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                select + ' WHERE normalized = ? AND region = ? AND reporting_currency = ? AND stage_bucket = ? AND rules_hash = ?',
+                (normalized, *scope),
+            ).fetchone()
+            match, score = 'exact', 1.0
+            if row is None:
+                query_embedding = memoize(ctx, 'embedding', question, lambda: _safe_embed(question))
+                if not query_embedding:
+                    _bump('misses')
+                    return None
+                found = _scope_index(conn, scope).search(query_embedding, top_k=5, min_score=min_score())
+                tokens = _content_tokens(normalized)
+                for row_id, score in found:
+                    row = conn.execute(select + ' WHERE id = ?', (row_id,)).fetchone()
+                    if row is not None and _content_tokens(row[5]) == tokens:
+                        break
+                    if row is not None:
+                        _bump('guard_rejects')
+                    row = None
+                if row is None:
+                    _bump('misses')
+                    return None
+                match = 'semantic'
+            conn.execute(
+                'UPDATE question_cache SET hits = hits + 1, last_hit_at = ? WHERE id = ?',
+                (time.time(), row[0]),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        _bump('errors')
+        log_error(traceback.format_exc())
+        return None
+    _bump('exact_hits' if match == 'exact' else 'semantic_hits')
+    return _entry(row, match, score)
+
+
+def store(
+    question: str,
+    region: str,
+    reporting_currency: str,
+    stage_bucket: str,
+    route: str,
+    intent: dict,
+    sql_text: str,
+    ctx: RequestContext | None = None,
+) -> None:
+    normalized = normalize_question(question)
+    if not enabled() or not normalized or not sql_text or sql_text.strip() == '-- CANNOT_ANSWER':
+        return
+    rules_hash = memoize(ctx, 'rules_fingerprint', None, rules_fingerprint)
+    scope = (region, reporting_currency, stage_bucket, rules_hash)
+    embedding = memoize(ctx, 'embedding', question, lambda: _safe_embed(question))
+    intent_json = json.dumps({k: v for k, v in (intent or {}).items() if k != '_raw'}, ensure_ascii=True, default=str)
+    now = time.time()
+    try:
+        conn = _connect()
+        try:
+            row_id = conn.execute(
+                '''
+                INSERT INTO question_cache (
+                    question, normalized, region, reporting_currency, stage_bucket, rules_hash,
+                    route, intent_json, sql_text, embedding_blob, created_at, last_hit_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (normalized, region, reporting_currency, stage_bucket, rules_hash) DO UPDATE SET
+                    question = excluded.question,
+                    route = excluded.route,
+                    intent_json = excluded.intent_json,
+                    sql_text = excluded.sql_text,
+                    embedding_blob = COALESCE(excluded.embedding_blob, question_cache.embedding_blob),
+                    last_hit_at = excluded.last_hit_at
+                RETURNING id
+                ''',
+                (
+                    question.strip(),
+                    normalized,
+                    region,
+                    reporting_currency,
+                    stage_bucket,
+                    rules_hash,
+                    route,
+                    intent_json,
+                    sql_text,
+                    to_blob(embedding) if embedding else None,
+                    now,
+                    now,
+                ),
+            ).fetchone()[0]
+            # Entries under another fingerprint are purged only once they are older than the grace period, so a
+            # worker that has not yet seen a rules change cannot wipe the entries written under the new rules.
+            grace_s = env_float('QUESTION_CACHE_STALE_GRACE_S', 300.0)
+            max_entries = env_int('QUESTION_CACHE_MAX_ENTRIES', 5000)
+            removals: dict[tuple, list] = {}
+            evicted = 0
+            for sql, params in (
+                (
+                    '''
+                    DELETE FROM question_cache WHERE rules_hash <> ? AND last_hit_at < ?
+                    RETURNING id, region, reporting_currency, stage_bucket, rules_hash
+                    ''',
+                    (rules_hash, now - grace_s),
+                ),
+                (
+                    '''
+                    DELETE FROM question_cache WHERE id IN (
+                        SELECT id FROM question_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+                    )
+                    RETURNING id, region, reporting_currency, stage_bucket, rules_hash
+                    ''',
+                    (max_entries,),
+                ),
+            ):
+                for row in conn.execute(sql, params).fetchall():
+                    removals.setdefault(tuple(row[1:]), []).append(row[0])
+                    evicted += 1
+            versions = _bump_versions(conn, {scope, *removals})
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        _bump('errors')
+        log_error(traceback.format_exc())
+        return
+    _apply_to_indexes(versions, {scope: [(row_id, embedding)] if embedding else []}, removals)
+    _drop_stale_indexes(rules_hash)
+    _bump('stores')
+    if evicted:
+        _bump('evictions', evicted)
+
+
+def invalidate(region: str | None = None, reporting_currency: str | None = None, stage_bucket: str | None = None) -> int:
+    clauses = []
+    params = []
+    for column, value in (('region', region), ('reporting_currency', reporting_currency), ('stage_bucket', stage_bucket)):
+        if value:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    where = (' WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    conn = _connect()
+    try:
+        removals: dict[tuple, list] = {}
+        for row in conn.execute(
+            'DELETE FROM question_cache' + where + ' RETURNING id, region, reporting_currency, stage_bucket, rules_hash',
+            params,
+        ).fetchall():
+            removals.setdefault(tuple(row[1:]), []).append(row[0])
+        versions = _bump_versions(conn, removals)
+        conn.commit()
+    finally:
+        conn.close()
+    _apply_to_indexes(versions, {}, removals)
+    return sum(len(ids) for ids in removals.values())
+
+
+def stats() -> dict:
+    with _STATS_LOCK:
+        data = dict(_STATS)
+    hits = data['exact_hits'] + data['semantic_hits']
+    data['hit_rate'] = round(hits / data['lookups'], 4) if data['lookups'] else 0.0
+    data['min_score'] = min_score()
+    data['enabled'] = enabled()
+    try:
+        conn = _connect()
+        try:
+            current = rules_fingerprint()
+            data['entries'], data['stale_entries'] = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(rules_hash <> ?), 0) FROM question_cache', (current,)
+            ).fetchone()
+        finally:
+            conn.close()
+        data['rules_hash'] = current
+    except Exception:
+        log_error(traceback.format_exc())
+    return data
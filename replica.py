@@ -0,0 +1,686 @@
+import csv
+import functools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from .config import REPLICA_PATH, env_float, env_int, log_error
+from .db import budget_error, fetch_within_budget, pooled_connection, run_query_budgeted
+from .metrics import ROWS_RETURNED, counter, span
+from .query_budget import QueryBudget, QueryBudgetExceeded, Watchdog, count_query
+
+DIMENSIONS = (
+    'dw.DimDate',
+    'dw.DimExchangeRate',
+    'grp.DimCustomer',
+    'grp.DimDealStage',
+    'grp.DimLegalEntity',
+    'grp.DimRevenueType',
+    'grp.DimSalesPerson',
+)
+FACTS = {
+    'grp.FactSale': ('close_date_key', 'sale_key'),
+    'dw.FactBudget': ('month_end_date_key', 'budget_key'),
+}
+BRIDGES = {
+    'grp.BridgeExchangeRate': 'grp.FactSale',
+    'grp.BridgeBudgetExchangeRate': 'dw.FactBudget',
+}
+REPLICA_TABLES = DIMENSIONS + tuple(FACTS) + tuple(BRIDGES)
+_TABLE_NAMES = {name.lower() for name in REPLICA_TABLES}
+
+QUERY_ROUTES = counter('replica_queries_total', 'Queries by engine chosen and reason for falling back to Fabric.')
+
+_SESSION_SETTINGS = (
+    'SET integer_division = true',
+    "SET default_collation = 'nocase'",
+    "SET default_null_order = 'nulls_first_on_asc_last_on_desc'",
+)
+_LOAD_BATCH = 5000
+_KEY_BATCH = 500
+_NULL = '\\N'
+
+_FUNCTIONS = {
+    'ABS', 'AVG', 'CAST', 'CEILING', 'COALESCE', 'CONCAT', 'COUNT', 'DATEADD', 'DATEPART', 'DAY', 'DENSE_RANK',
+    'FIRST_VALUE', 'FLOOR', 'GETDATE', 'ISNULL', 'LAG', 'LAST_VALUE', 'LEAD', 'LEFT', 'LOWER', 'LTRIM', 'MAX', 'MIN',
+    'MONTH', 'NTILE', 'NULLIF', 'POWER', 'RANK', 'REPLACE', 'RIGHT', 'ROUND', 'ROW_NUMBER', 'RTRIM', 'SIGN', 'SQRT',
+    'SUBSTRING', 'SUM', 'TRIM', 'UPPER', 'YEAR',
+}
+_KEYWORDS = {
+    'ALL', 'AND', 'ANY', 'AS', 'BETWEEN', 'BY', 'CASE', 'ELSE', 'END', 'EXISTS', 'FROM', 'HAVING', 'IN', 'IS', 'JOIN',
+    'NOT', 'ON', 'OR', 'OVER', 'SELECT', 'SOME', 'THEN', 'TOP', 'UNION', 'VALUES', 'WHEN', 'WHERE', 'WITH',
+}
+_DATE_UNITS = {
+    'year': 'YEAR', 'yy': 'YEAR', 'yyyy': 'YEAR',
+    'quarter': 'QUARTER', 'qq': 'QUARTER', 'q': 'QUARTER',
+    'month': 'MONTH', 'mm': 'MONTH', 'm': 'MONTH',
+    'day': 'DAY', 'dd': 'DAY', 'd': 'DAY',
+    'hour': 'HOUR', 'hh': 'HOUR',
+    'minute': 'MINUTE', 'mi': 'MINUTE', 'n': 'MINUTE',
+    'second': 'SECOND', 'ss': 'SECOND', 's': 'SECOND',
+}
+_CAST_TYPES = {
+    'int': 'INTEGER', 'integer': 'INTEGER', 'bigint': 'BIGINT', 'smallint': 'SMALLINT',
+    'float': 'DOUBLE', 'real': 'REAL', 'date': 'DATE', 'datetime': 'TIMESTAMP', 'datetime2': 'TIMESTAMP',
+    'bit': 'BOOLEAN', 'money': 'DECIMAL(19,4)', 'varchar': 'VARCHAR', 'nvarchar': 'VARCHAR', 'char': 'VARCHAR',
+    'nchar': 'VARCHAR', 'decimal': 'DECIMAL', 'numeric': 'DECIMAL',
+}
+_INTEGER_CASTS = {'INTEGER', 'BIGINT', 'SMALLINT'}
+_TSQL_ONLY = re.compile(r'[@#]|\b(APPLY|FETCH|INTO|NOLOCK|OFFSET|OPTION|PERCENT|PIVOT|TIES|UNPIVOT)\b', re.I)
+_STRING = re.compile(r"(?<!\w)N?'(?:[^']|'')*'")
+_CALL = re.compile(r'\b([A-Za-z_]\w*)\s*\(')
+_SOURCE = re.compile(r'\b(?:FROM|JOIN)\s+(?!\()([\w.\[\]"]+)', re.I)
+_COMMA_JOIN = re.compile(r'\bFROM\s+[\w.\[\]"]+(?:\s+(?:AS\s+)?\w+)?\s*,', re.I)
+_CTE = re.compile(r'\b(\w+)\s+AS\s*\(', re.I)
+_TOP = re.compile(r'\bTOP\s*(?:\(\s*(\d+)\s*\)|(\d+))', re.I)
+
+
+class ReplicaUnavailable(RuntimeError):
+    pass
+
+
+class _Ineligible(ValueError):
+    pass
+
+
+def _close_paren(sql: str, open_index: int) -> int:
+    depth = 0
+    for index in range(open_index, len(sql)):
+        if sql[index] == '(':
+            depth += 1
+        elif sql[index] == ')':
+            depth -= 1
+            if depth == 0:
+                return index
+    raise _Ineligible('unbalanced parentheses')
+
+
+def _depth_at(sql: str, position: int) -> int:
+    return sql.count('(', 0, position) - sql.count(')', 0, position)
+
+
+def _split_args(text: str) -> list[str]:
+    args, depth, start = [], 0, 0
+    for index, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            args.append(text[start:index].strip())
+            start = index + 1
+    args.append(text[start:].strip())
+    return args
+
+
+def _rewrite_calls(sql: str, name: str, rewrite) -> str:
+    pattern = re.compile(rf'\b{name}\s*\(', re.I)
+    parts, pos = [], 0
+    while True:
+        match = pattern.search(sql, pos)
+        if not match:
+            break
+        open_index = match.end() - 1
+        close_index = _close_paren(sql, open_index)
+        inner = _rewrite_calls(sql[open_index + 1 : close_index], name, rewrite)
+        parts.append(sql[pos : match.start()])
+        parts.append(rewrite(_split_args(inner)))
+        pos = close_index + 1
+    parts.append(sql[pos:])
+    return ''.join(parts)
+
+
+def _date_unit(token: str) -> str:
+    unit = _DATE_UNITS.get(token.strip().strip('\'"[]').lower())
+    if unit is None:
+        raise _Ineligible(f'date part {token.strip()} is not translated')
+    return unit
+
+
+def _dateadd(args: list[str]) -> str:
+    if len(args) != 3:
+        raise _Ineligible('DATEADD needs three arguments')
+    return f'({args[2]} + INTERVAL ({args[1]}) {_date_unit(args[0])})'
+
+
+def _datepart(args: list[str]) -> str:
+    if len(args) != 2:
+        raise _Ineligible('DATEPART needs two arguments')
+    return f"date_part('{_date_unit(args[0]).lower()}', {args[1]})"
+
+
+def _cast(args: list[str]) -> str:
+    match = re.match(r'^(.*)\s+AS\s+(\w+)\s*(\([\d\s,]*\))?\s*$', args[0], re.I | re.S) if len(args) == 1 else None
+    if not match:
+        raise _Ineligible('unsupported CAST')
+    expr, type_name, size = match.group(1), match.group(2).lower(), match.group(3) or ''
+    target = _CAST_TYPES.get(type_name)
+    if target is None:
+        raise _Ineligible(f'CAST to {type_name} is not translated')
+    if target in _INTEGER_CASTS:
+        return f'CAST(TRUNC({expr}) AS {target})'
+    if target == 'DECIMAL':
+        return f'CAST({expr} AS DECIMAL{size.replace(" ", "")})'
+    return f'CAST({expr} AS {target})'
+
+
+@functools.lru_cache(maxsize=512)
+def translate(sql_text: str) -> tuple[str | None, str | None]:
+    literals: list[str] = []
+
+    def mask(match) -> str:
+        literal = match.group(0)
+        literals.append(literal[1:] if literal[0] in 'Nn' else literal)
+        return f'\x00{len(literals) - 1}\x00'
+
+    try:
+        sql = _STRING.sub(mask, sql_text or '')
+        sql = re.sub(r'--[^\n]*', ' ', sql)
+        sql = re.sub(r'/\*.*?\*/', ' ', sql, flags=re.S)
+        sql = sql.strip().rstrip(';').strip()
+        if not re.match(r'^(SELECT|WITH)\b', sql, re.I):
+            raise _Ineligible('not a read-only SELECT')
+        if ';' in sql or "'" in sql:
+            raise _Ineligible('multiple statements or unbalanced quotes')
+        if _TSQL_ONLY.search(sql):
+            raise _Ineligible(f'uses {_TSQL_ONLY.search(sql).group(0).upper()}')
+        sql = re.sub(r'\[([^\]]+)\]', r'"\1"', sql)
+        ctes = {name.lower() for name in _CTE.findall(sql)}
+        for name in _CALL.findall(sql):
+            if name.upper() not in _FUNCTIONS | _KEYWORDS and name.lower() not in ctes | set(_CAST_TYPES):
+                raise _Ineligible(f'function {name.upper()} is not translated')
+        if _COMMA_JOIN.search(sql):
+            raise _Ineligible('comma joins are not analysed')
+        for source in _SOURCE.findall(sql):
+            name = source.replace('"', '').lower()
+            if name not in _TABLE_NAMES and name not in ctes:
+                raise _Ineligible(f'{source} is not replicated')
+
+        tops = list(_TOP.finditer(sql))
+        limit = None
+        if len(tops) > 1 or (tops and re.search(r'\bUNION\b', sql, re.I)):
+            raise _Ineligible('TOP is only translated for a single SELECT')
+        if tops:
+            top = tops[0]
+            last_select = [m.start() for m in re.finditer(r'\bSELECT\b', sql, re.I) if _depth_at(sql, m.start()) == 0]
+            if _depth_at(sql, top.start()) != 0 or not last_select or top.start() < last_select[-1]:
+                raise _Ineligible('TOP outside the outer SELECT')
+            limit = int(top.group(1) or top.group(2))
+            sql = sql[: top.start()] + sql[top.end() :]
+
+        sql = re.sub(r'\bGETDATE\s*\(\s*\)', 'current_localtimestamp()', sql, flags=re.I)
+        sql = _rewrite_calls(sql, 'DATEADD', _dateadd)
+        sql = _rewrite_calls(sql, 'DATEPART', _datepart)
+        sql = re.sub(r'\bISNULL\s*\(', 'COALESCE(', sql, flags=re.I)
+        sql = re.sub(r'\bLIKE\b', 'ILIKE', sql, flags=re.I)
+        sql = _rewrite_calls(sql, 'CAST', _cast)
+        if limit is not None:
+            sql = f'{sql}\nLIMIT {limit}'
+    except _Ineligible as exc:
+        return None, str(exc)
+    return re.sub(r'\x00(\d+)\x00', lambda m: literals[int(m.group(1))], sql), None
+
+
+def _duck_type(desc) -> str:
+    py_type = desc[1]
+    if py_type is bool:
+        return 'BOOLEAN'
+    if py_type is int:
+        return 'BIGINT'
+    if py_type is float:
+        return 'DOUBLE'
+    if py_type is Decimal:
+        precision = min(int(desc[4] or 38), 38)
+        scale = min(int(desc[5] or 0), precision)
+        return f'DECIMAL({precision},{scale})'
+    if py_type is datetime:
+        return 'TIMESTAMP'
+    if py_type is date:
+        return 'DATE'
+    return 'VARCHAR'
+
+
+def _result_types(description) -> list[str]:
+    names = []
+    for desc in description or []:
+        type_name = str(desc[1]).upper()
+        if type_name.startswith('DECIMAL'):
+            names.append('decimal')
+        elif type_name in ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT', 'UINTEGER', 'UBIGINT'):
+            names.append('int')
+        elif type_name in ('DOUBLE', 'FLOAT', 'REAL'):
+            names.append('float')
+        elif type_name == 'VARCHAR':
+            names.append('str')
+        elif type_name == 'BOOLEAN':
+            names.append('bool')
+        elif type_name == 'DATE':
+            names.append('date')
+        elif type_name.startswith('TIMESTAMP'):
+            names.append('datetime')
+        elif type_name == 'TIME':
+            names.append('time')
+        elif type_name == 'BLOB':
+            names.append('bytes')
+        else:
+            names.append('unknown')
+    return names
+
+
+def _csv_value(value):
+    if value is None:
+        return _NULL
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    return value
+
+
+def _lower_bound(watermark, lookback_days: int):
+    if watermark is None:
+        return None
+    # Open pipeline deals close in the future, so anchor on today rather than the latest key.
+    try:
+        anchor = min(int(watermark), int(date.today().strftime('%Y%m%d')))
+        day = datetime.strptime(str(anchor), '%Y%m%d').date()
+    except (TypeError, ValueError):
+        return watermark
+    return int((day - timedelta(days=lookback_days)).strftime('%Y%m%d'))
+
+
+class _Interruptible:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def cancel(self) -> None:
+        self.cursor.interrupt()
+
+
+class Replica:
+    def __init__(
+        self,
+        path: str,
+        max_staleness_s: float = 3600.0,
+        lookback_days: int = 35,
+        interval_s: float = 300.0,
+        full_sync_interval_s: float = 1800.0,
+    ):
+        self.path = path
+        self.max_staleness_s = max_staleness_s
+        self.lookback_days = max(0, lookback_days)
+        self.interval_s = interval_s
+        self.full_sync_interval_s = full_sync_interval_s
+        self._last_full = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._full = False
+        self._thread: threading.Thread | None = None
+        self._tables: dict[str, dict] = {}
+        self._error = None
+        self._stats = {'routed': 0, 'fallbacks': 0, 'ineligible': 0, 'errors': 0, 'syncs': 0, 'sync_errors': 0, 'rows_synced': 0}
+        self._last_sync = {'at': None, 'duration_s': None, 'error': None, 'rows': None, 'full': None}
+
+    def _bump(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def _connection(self):
+        if self._conn is not None:
+            return self._conn
+        with self._lock:
+            if self._conn is None:
+                try:
+                    import duckdb
+                except ImportError as exc:
+                    raise ReplicaUnavailable('The replica requires the optional duckdb package.') from exc
+                conn = duckdb.connect(self.path)
+                for statement in _SESSION_SETTINGS:
+                    conn.execute(statement)
+                for schema in sorted({name.split('.')[0] for name in REPLICA_TABLES}):
+                    conn.execute(f'CREATE SCHEMA IF NOT EXISTS {schema}')
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS _replica_sync ('
+                    'table_name VARCHAR PRIMARY KEY, watermark BIGINT, row_count BIGINT, synced_at DOUBLE)'
+                )
+                conn.execute('ALTER TABLE _replica_sync ADD COLUMN IF NOT EXISTS full_synced_at DOUBLE')
+                self._tables = {
+                    row[0]: {'watermark': row[1], 'rows': row[2], 'synced_at': row[3], 'full_synced_at': row[4]}
+                    for row in conn.execute(
+                        'SELECT table_name, watermark, row_count, synced_at, full_synced_at FROM _replica_sync'
+                    ).fetchall()
+                }
+                full = [self._tables.get(name, {}).get('full_synced_at') for name in FACTS]
+                self._last_full = min(full) if full and None not in full else 0.0
+                self._conn = conn
+        return self._conn
+
+    def _cursor(self):
+        cursor = self._connection().cursor()
+        for statement in _SESSION_SETTINGS:
+            cursor.execute(statement)
+        return cursor
+
+    def freshness(self) -> dict:
+        # Incremental runs only cover the recent window; a table is complete as of its last full load.
+        with self._lock:
+            complete = [self._tables.get(name, {}).get('full_synced_at') for name in REPLICA_TABLES]
+            synced = [self._tables.get(name, {}).get('synced_at') for name in REPLICA_TABLES]
+            watermarks = {name: self._tables[name]['watermark'] for name in FACTS if name in self._tables}
+        if any(value is None for value in complete + synced):
+            return {'synced_at': None, 'age_s': None, 'stale': True, 'incremental_at': None, 'watermarks': watermarks}
+        synced_at = min(complete)
+        age = round(time.time() - synced_at, 1)
+        return {
+            'synced_at': synced_at,
+            'age_s': age,
+            'stale': age > self.max_staleness_s,
+            'incremental_at': min(synced),
+            'watermarks': watermarks,
+        }
+
+    def route(self, sql_text: str) -> tuple[str | None, str | None]:
+        try:
+            self._connection()
+        except Exception as exc:
+            self._error = str(exc)
+            return None, 'unavailable'
+        freshness = self.freshness()
+        if freshness['synced_at'] is None:
+            return None, 'not_synced'
+        if freshness['stale']:
+            return None, 'stale'
+        duck_sql, reason = translate(sql_text)
+        if duck_sql is None:
+            self._bump('ineligible')
+            return None, 'ineligible'
+        return duck_sql, reason
+
+    def execute(self, duck_sql: str, budget: QueryBudget, params=None, cancel_event: threading.Event | None = None):
+        count_query()
+        started = time.monotonic()
+        cursor = _Interruptible(self._cursor())
+        watchdog = Watchdog(cursor, budget, cancel_event)
+        try:
+            with watchdog:
+                try:
+                    with span('replica_execute'):
+                        cursor.execute(duck_sql, list(params) if params is not None else None)
+                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+                    with span('fetch'):
+                        types = _result_types(cursor.description)
+                        rows = fetch_within_budget(cursor, columns, budget, duck_sql, types) if columns else []
+                except Exception as exc:
+                    if watchdog.reason:
+                        raise budget_error(watchdog, budget, duck_sql, started) from exc
+                    raise
+                if watchdog.reason:
+                    raise budget_error(watchdog, budget, duck_sql, started)
+        finally:
+            cursor.close()
+        budget.elapsed_s = round(time.monotonic() - started, 3)
+        ROWS_RETURNED.inc(len(rows))
+        self._bump('routed')
+        return columns, rows
+
+    def _create(self, duck, table: str, description, replace: bool) -> None:
+        columns = ', '.join(f'"{desc[0]}" {_duck_type(desc)}' for desc in description)
+        verb = 'CREATE OR REPLACE TABLE' if replace else 'CREATE TABLE IF NOT EXISTS'
+        duck.execute(f'{verb} {table} ({columns})')
+
+    def _copy(self, fabric, duck, table: str, select_sql: str, params: tuple, replace: bool, key: str | None = None, dependents=()) -> int:
+        if params:
+            fabric.execute(select_sql, params)
+        else:
+            fabric.execute(select_sql)
+        self._create(duck, table, fabric.description, replace)
+        fd, path = tempfile.mkstemp(prefix='replica-', suffix='.csv')
+        copied = 0
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as handle:
+                writer = csv.writer(handle)
+                while True:
+                    batch = fabric.fetchmany(_LOAD_BATCH)
+                    if not batch:
+                        break
+                    writer.writerows([_csv_value(value) for value in row] for row in batch)
+                    copied += len(batch)
+            if not copied:
+                return 0
+            duck.execute(f'CREATE OR REPLACE TEMP TABLE _replica_stage AS SELECT * FROM {table} LIMIT 0')
+            duck.execute(f"COPY _replica_stage FROM '{path.replace(chr(39), chr(39) * 2)}' (FORMAT csv, HEADER false, NULLSTR '{_NULL}')")
+            if key:
+                for name in dependents + (table,):
+                    duck.execute(f'DELETE FROM {name} WHERE {key} IN (SELECT {key} FROM _replica_stage)')
+            duck.execute(f'INSERT INTO {table} SELECT * FROM _replica_stage')
+            duck.execute('DROP TABLE _replica_stage')
+        finally:
+            os.remove(path)
+        return copied
+
+    def _mark(self, duck, table: str, watermark, synced_at: float, full_synced_at: float | None) -> dict:
+        row_count = duck.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        duck.execute(
+            'INSERT OR REPLACE INTO _replica_sync (table_name, watermark, row_count, synced_at, full_synced_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [table, watermark, row_count, synced_at, full_synced_at],
+        )
+        return {'watermark': watermark, 'rows': row_count, 'synced_at': synced_at, 'full_synced_at': full_synced_at}
+
+    def _table_exists(self, duck, table: str) -> bool:
+        schema, name = table.split('.')
+        return bool(
+            duck.execute(
+                'SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = ? AND table_name = ?', [schema, name]
+            ).fetchone()[0]
+        )
+
+    def _sync_tables(self, fabric, duck, full: bool, synced_at: float) -> tuple[dict, dict]:
+        copied, tables = {}, {}
+        for table in DIMENSIONS:
+            exists = self._table_exists(duck, table)
+            if exists and not full:
+                duck.execute(f'DELETE FROM {table}')
+            copied[table] = self._copy(fabric, duck, table, f'SELECT * FROM {table}', (), full or not exists)
+            tables[table] = self._mark(duck, table, None, synced_at, synced_at)
+        for fact, (watermark_column, key) in FACTS.items():
+            bridges = tuple(bridge for bridge, parent in BRIDGES.items() if parent == fact)
+            incremental = not full and all(self._table_exists(duck, name) for name in (fact,) + bridges)
+            lower = _lower_bound(self._tables.get(fact, {}).get('watermark'), self.lookback_days) if incremental else None
+            where, params = (f' WHERE {watermark_column} >= ?', (lower,)) if lower is not None else ('', ())
+            if incremental:
+                duck.execute(f'CREATE OR REPLACE TEMP TABLE _replica_window AS SELECT {key} FROM {fact}{where}', list(params))
+                for bridge in bridges:
+                    duck.execute(f'DELETE FROM {bridge} WHERE {key} IN (SELECT {key} FROM {fact}{where})', list(params))
+                duck.execute(f'DELETE FROM {fact}{where}', list(params))
+            copied[fact] = self._copy(
+                fabric,
+                duck,
+                fact,
+                f'SELECT * FROM {fact}{where}',
+                params,
+                not incremental,
+                key=key if incremental else None,
+                dependents=bridges,
+            )
+            bridge_where = f' WHERE f.{watermark_column} >= ?' if lower is not None else ''
+            for bridge in bridges:
+                copied[bridge] = self._copy(
+                    fabric,
+                    duck,
+                    bridge,
+                    f'SELECT b.* FROM {bridge} b JOIN {fact} f ON b.{key} = f.{key}{bridge_where}',
+                    params,
+                    not incremental,
+                )
+            if incremental:
+                self._reload_moved(fabric, duck, fact, key, bridges, copied)
+            full_synced_at = self._tables.get(fact, {}).get('full_synced_at') if incremental else synced_at
+            watermark = duck.execute(f'SELECT MAX({watermark_column}) FROM {fact}').fetchone()[0]
+            tables[fact] = self._mark(duck, fact, watermark, synced_at, full_synced_at)
+            for bridge in bridges:
+                tables[bridge] = self._mark(duck, bridge, None, synced_at, full_synced_at)
+        return copied, tables
+
+    def _reload_moved(self, fabric, duck, fact: str, key: str, bridges: tuple, copied: dict) -> None:
+        # Rows that left the window were either deleted upstream or moved to an earlier date; fetch the latter by key.
+        missing = [
+            row[0]
+            for row in duck.execute(
+                f'SELECT {key} FROM _replica_window WHERE {key} NOT IN (SELECT {key} FROM {fact})'
+            ).fetchall()
+        ]
+        duck.execute('DROP TABLE _replica_window')
+        for start in range(0, len(missing), _KEY_BATCH):
+            chunk = tuple(missing[start:start + _KEY_BATCH])
+            placeholders = ', '.join('?' for _ in chunk)
+            copied[fact] += self._copy(
+                fabric, duck, fact, f'SELECT * FROM {fact} WHERE {key} IN ({placeholders})', chunk, False,
+                key=key, dependents=bridges,
+            )
+            for bridge in bridges:
+                copied[bridge] += self._copy(
+                    fabric, duck, bridge, f'SELECT * FROM {bridge} WHERE {key} IN ({placeholders})', chunk, False,
+                )
+
+    def sync(self, full: bool = False) -> dict:
+        with self._sync_lock:
+            started = time.monotonic()
+            synced_at = time.time()
+            try:
+                duck = self._cursor()
+                try:
+                    with pooled_connection() as conn:
+                        fabric = conn.cursor()
+                        duck.execute('BEGIN TRANSACTION')
+                        try:
+                            copied, tables = self._sync_tables(fabric, duck, full, synced_at)
+                            duck.execute('COMMIT')
+                        except Exception:
+                            duck.execute('ROLLBACK')
+                            raise
+                        finally:
+                            fabric.close()
+                finally:
+                    duck.close()
+            except Exception as exc:
+                log_error(traceback.format_exc())
+                with self._lock:
+                    self._stats['sync_errors'] += 1
+                    self._last_sync = {
+                        'at': synced_at,
+                        'duration_s': round(time.monotonic() - started, 3),
+                        'error': str(exc),
+                        'rows': None,
+                        'full': full,
+                    }
+                return {'ok': False, 'full': full, 'error': str(exc)}
+            duration = round(time.monotonic() - started, 3)
+            with self._lock:
+                self._tables.update(tables)
+                self._stats['syncs'] += 1
+                self._stats['rows_synced'] += sum(copied.values())
+                self._last_sync = {'at': synced_at, 'duration_s': duration, 'error': None, 'rows': copied, 'full': full}
+                if full:
+                    self._last_full = synced_at
+            log_error(json.dumps({'event': 'replica_sync', 'full': full, 'rows': copied, 'duration_s': duration}))
+            return {'ok': True, 'full': full, 'rows': copied, 'freshness': self.freshness()}
+
+    def trigger(self, full: bool = False) -> None:
+        self._full = self._full or full
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            full, self._full = self._full, False
+            if self.full_sync_interval_s > 0 and time.time() - self._last_full >= self.full_sync_interval_s:
+                full = True
+            self._wake.clear()
+            self.sync(full=full)
+            self._wake.wait(self.interval_s)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='replica-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data.update({f'last_sync_{key}': value for key, value in self._last_sync.items() if key != 'rows'})
+            data['tables'] = {name: dict(info) for name, info in self._tables.items()}
+        data['path'] = self.path
+        data['error'] = self._error
+        data['max_staleness_s'] = self.max_staleness_s
+        data['interval_s'] = self.interval_s
+        data['sync_running'] = bool(self._thread and self._thread.is_alive())
+        data['freshness'] = self.freshness()
+        return data
+
+
+_REPLICA = {'replica': None}
+_REPLICA_LOCK = threading.Lock()
+
+
+def enabled() -> bool:
+    return env_int('REPLICA_ENABLED', 0) == 1
+
+
+def get_replica() -> Replica | None:
+    if not enabled():
+        return None
+    replica = _REPLICA['replica']
+    if replica is not None:
+        return replica
+    with _REPLICA_LOCK:
+        if _REPLICA['replica'] is None:
+            _REPLICA['replica'] = Replica(
+                os.environ.get('REPLICA_PATH') or REPLICA_PATH,
+                max_staleness_s=env_float('REPLICA_MAX_STALENESS_S', 3600.0),
+                lookback_days=env_int('REPLICA_LOOKBACK_DAYS', 35),
+                interval_s=env_float('REPLICA_SYNC_INTERVAL_S', 300.0),
+                full_sync_interval_s=env_float('REPLICA_FULL_SYNC_INTERVAL_S', 1800.0),
+            )
+        return _REPLICA['replica']
+
+
+def run_query(sql_text: str, budget: QueryBudget, params=None, cancel_event: threading.Event | None = None):
+    replica = get_replica()
+    if replica is None:
+        budget.source = {'engine': 'fabric'}
+        return run_query_budgeted(sql_text, budget, params, cancel_event)
+    duck_sql, reason = replica.route(sql_text)
+    if duck_sql is not None:
+        try:
+            columns, rows = replica.execute(duck_sql, budget, params, cancel_event)
+        except QueryBudgetExceeded:
+            raise
+        except Exception:
+            log_error(traceback.format_exc())
+            replica._bump('errors')
+            budget.reset_usage()
+            reason = 'replica_error'
+        else:
+            QUERY_ROUTES.inc(engine='replica', reason='eligible')
+            budget.source = {'engine': 'replica', **replica.freshness()}
+            return columns, rows
+    replica._bump('fallbacks')
+    QUERY_ROUTES.inc(engine='fabric', reason=reason)
+    budget.source = {'engine': 'fabric', 'replica_skipped': reason}
+    return run_query_budgeted(sql_text, budget, params, cancel_event)
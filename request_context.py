@@ -0,0 +1,55 @@
+import threading
+
+_MISSING = object()
+
+
+class RequestContext:
+    def __init__(self):
+        self._memo: dict[tuple, object] = {}
+        self._lock = threading.RLock()
+        self.computed: dict[str, int] = {}
+        self.saved: dict[str, int] = {}
+        self.use_llm_cache = True
+        self._deferred: dict[str, dict] = {}
+
+    def memo(self, kind: str, key, factory):
+        memo_key = (kind, key)
+        with self._lock:
+            value = self._memo.get(memo_key, _MISSING)
+            if value is not _MISSING:
+                self.saved[kind] = self.saved.get(kind, 0) + 1
+                return value
+            value = factory()
+            self._memo[memo_key] = value
+            self.computed[kind] = self.computed.get(kind, 0) + 1
+            return value
+
+    def defer(self, kind: str, key, value) -> None:
+        with self._lock:
+            self._deferred.setdefault(kind, {})[key] = value
+
+    def deferred(self, kind: str) -> dict:
+        with self._lock:
+            return dict(self._deferred.get(kind, {}))
+
+    def discard(self, kind: str, key) -> None:
+        with self._lock:
+            self._deferred.get(kind, {}).pop(key, None)
+
+    def take(self, kind: str) -> dict:
+        with self._lock:
+            return self._deferred.pop(kind, {})
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'computed': dict(self.computed),
+                'saved': dict(self.saved),
+                'saved_total': sum(self.saved.values()),
+            }
+
+
+def memoize(ctx: RequestContext | None, kind: str, key, factory):
+    if ctx is None:
+        return factory()
+    return ctx.memo(kind, key, factory)
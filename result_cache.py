@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+
+from .config import env_float, env_int
+from .metrics import CACHE_EVENTS
+
+
+def normalize_sql(sql_text: str) -> str:
+    out: list[str] = []
+    in_quote = False
+    pending_space = False
+    for ch in (sql_text or '').strip().rstrip(';').strip():
+        if ch == "'":
+            in_quote = not in_quote
+        if not in_quote and ch.isspace():
+            pending_space = True
+            continue
+        if pending_space and out:
+            out.append(' ')
+        pending_space = False
+        out.append(ch)
+    return ''.join(out)
+
+
+def _cell_bytes(value) -> int:
+    if value is None:
+        return 4
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, (bytes, bytearray)):
+        return 33 + len(value)
+    if isinstance(value, (Decimal, datetime, date)):
+        return 48
+    return 24
+
+
+def estimate_rows_bytes(columns: list[str], rows: list) -> int:
+    size = sum(_cell_bytes(c) for c in columns)
+    for row in rows:
+        size += 56 + 8 * len(row)
+        for cell in row:
+            size += _cell_bytes(cell)
+    return size
+
+
+class _Entry:
+    __slots__ = ('columns', 'rows', 'types', 'size', 'stored_at', 'expires_at')
+
+    def __init__(self, columns, rows, size, ttl_s, types=None):
+        now = time.time()
+        self.columns = columns
+        self.rows = rows
+        self.types = types
+        self.size = size
+        self.stored_at = now
+        self.expires_at = now + ttl_s
+
+
+class ResultCache:
+    def __init__(self, ttl_s: float = 300.0, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int | None = None):
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max(1, max_bytes // 4)
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stores': 0, 'evictions': 0, 'oversize': 0, 'invalidations': 0}
+
+    @staticmethod
+    def make_key(sql_text: str, region: str, reporting_currency: str, stage_bucket: str) -> tuple:
+        return (normalize_sql(sql_text), str(region).upper(), str(reporting_currency).upper(), str(stage_bucket).lower())
+
+    def get(self, key: tuple) -> tuple[str, _Entry | None]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return 'miss', None
+            if entry.expires_at <= time.time():
+                self._drop(key)
+                self._stats['stale'] += 1
+                return 'stale', None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return 'hit', entry
+
+    def put(self, key: tuple, columns: list[str], rows: list, types: list[str] | None = None) -> bool:
+        size = estimate_rows_bytes(columns, rows)
+        with self._lock:
+            if size > self.max_entry_bytes:
+                self._stats['oversize'] += 1
+                return False
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(columns, rows, size, self.ttl_s, types)
+            self._bytes += size
+            self._stats['stores'] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats['evictions'] += 1
+            return True
+
+    def _drop(self, key: tuple) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, sql_text: str | None = None, **scope) -> int:
+        with self._lock:
+            if sql_text is None and not scope:
+                count = len(self._entries)
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                norm = normalize_sql(sql_text) if sql_text is not None else None
+                region = scope.get('region')
+                currency = scope.get('reporting_currency')
+                bucket = scope.get('stage_bucket')
+                doomed = [
+                    key
+                    for key in self._entries
+                    if (norm is None or key[0] == norm)
+                    and (region is None or key[1] == str(region).upper())
+                    and (currency is None or key[2] == str(currency).upper())
+                    and (bucket is None or key[3] == str(bucket).lower())
+                ]
+                for key in doomed:
+                    self._drop(key)
+                count = len(doomed)
+            self._stats['invalidations'] += count
+            return count
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data['entries'] = len(self._entries)
+            data['bytes'] = self._bytes
+            data['max_bytes'] = self.max_bytes
+            data['ttl_s'] = self.ttl_s
+            return data
+
+
+_RESULT_CACHE = {'cache': None}
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    cache = _RESULT_CACHE['cache']
+    if cache is not None:
+        return cache
+    with _RESULT_CACHE_LOCK:
+        if _RESULT_CACHE['cache'] is None:
+            _RESULT_CACHE['cache'] = ResultCache(
+                ttl_s=env_float('RESULT_CACHE_TTL_S', 300.0),
+                max_bytes=env_int('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+            )
+        return _RESULT_CACHE['cache']
+
+
+def cached_query(
+    runner,
+    sql_text: str,
+    region: str,
+    reporting_currency: str,
+    stage_bucket: str,
+    *,
+    bypass: bool = False,
+    cache: ResultCache | None = None,
+    budget=None,
+) -> tuple[list[str], list, str]:
+    cache = cache or get_result_cache()
+    if cache.ttl_s <= 0:
+        columns, rows = runner(sql_text)
+        return columns, rows, 'miss'
+    key = cache.make_key(sql_text, region, reporting_currency, stage_bucket)
+    status = 'miss'
+    if not bypass:
+        status, entry = cache.get(key)
+        CACHE_EVENTS.inc(cache='result', outcome=status)
+        if entry is not None:
+            rows = entry.rows
+            if budget is not None:
+                rows = budget.clip(entry.columns, entry.rows, sql_text)
+                budget.column_types = entry.types
+                budget.bytes += entry.size if rows is entry.rows else estimate_rows_bytes(entry.columns, rows)
+                budget.source = {'engine': 'result_cache'}
+            return entry.columns, rows, status
+    columns, rows = runner(sql_text)
+    if budget is None or not budget.truncated:
+        cache.put(key, columns, rows, budget.column_types if budget is not None else None)
+    return columns, rows, status
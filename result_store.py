@@ -0,0 +1,278 @@
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+from .config import RESULT_SNAPSHOT_DIR, env_float, env_int, log_error
+
+SORT_ORDERS = ('asc', 'desc')
+_SUFFIX = '.sqlite'
+
+
+class SnapshotNotFound(RuntimeError):
+    pass
+
+
+def _column_name(index: int) -> str:
+    return f'c{index}'
+
+
+def encode_cursor(offset: int, sort: str | None, order: str) -> str:
+    raw = json.dumps({'o': offset, 's': sort, 'd': order}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> dict:
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return {'offset': max(0, int(data['o'])), 'sort': data.get('s'), 'order': data.get('d') or 'asc'}
+    except Exception as exc:
+        raise ValueError('Invalid cursor.') from exc
+
+
+class ResultStore:
+    def __init__(self, directory: str, ttl_s: float = 3600.0, max_bytes: int = 512 * 1024 * 1024, max_page: int = 1000):
+        self.directory = directory
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.max_page = max(1, max_page)
+        self._lock = threading.Lock()
+        self._stats = {'saved': 0, 'pages': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'deleted': 0, 'errors': 0}
+
+    def _bump(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def _path(self, snapshot_id: str) -> str:
+        if not snapshot_id or not snapshot_id.isalnum():
+            raise SnapshotNotFound('Snapshot not found.')
+        return os.path.join(self.directory, snapshot_id + _SUFFIX)
+
+    def _files(self) -> list[tuple[float, int, str]]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            if not name.endswith(_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+        files.sort()
+        return files
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def cleanup(self) -> int:
+        now = time.time()
+        files = self._files()
+        removed = 0
+        kept = []
+        for mtime, size, path in files:
+            if now - mtime >= self.ttl_s:
+                if self._remove(path):
+                    self._bump('expired')
+                    removed += 1
+            else:
+                kept.append((mtime, size, path))
+        total = sum(size for _, size, _ in kept)
+        for _, size, path in kept:
+            if total <= self.max_bytes:
+                break
+            if self._remove(path):
+                self._bump('evicted')
+                removed += 1
+            total -= size
+        return removed
+
+    def save(self, columns: list[str], rows: list, types: list[str] | None = None, meta: dict | None = None) -> dict:
+        os.makedirs(self.directory, exist_ok=True)
+        snapshot_id = uuid.uuid4().hex
+        path = self._path(snapshot_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        created_at = time.time()
+        header = {
+            'columns': list(columns),
+            'types': types,
+            'meta': meta or {},
+            'row_count': len(rows),
+            'created_at': created_at,
+        }
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE snapshot (header TEXT NOT NULL)')
+            conn.execute('INSERT INTO snapshot (header) VALUES (?)', (json.dumps(header, default=str),))
+            names = [_column_name(i) for i in range(len(columns))]
+            conn.execute(f'CREATE TABLE rows (_row INTEGER PRIMARY KEY, {", ".join(names) or "_empty"})')
+            if names and rows:
+                placeholders = ', '.join('?' for _ in names)
+                conn.executemany(f'INSERT INTO rows ({", ".join(names)}) VALUES ({placeholders})', rows)
+            conn.commit()
+        except Exception:
+            conn.close()
+            self._remove(tmp_path)
+            raise
+        conn.close()
+        os.replace(tmp_path, path)
+        self._bump('saved')
+        self.cleanup()
+        return self._describe(snapshot_id, header, os.path.getsize(path))
+
+    def _describe(self, snapshot_id: str, header: dict, size: int) -> dict:
+        return {
+            'id': snapshot_id,
+            'row_count': header['row_count'],
+            'bytes': size,
+            'created_at': header['created_at'],
+            'expires_at': header['created_at'] + self.ttl_s,
+        }
+
+    def _open(self, snapshot_id: str) -> tuple[sqlite3.Connection, dict, str]:
+        path = self._path(snapshot_id)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            self._bump('misses')
+            raise SnapshotNotFound('Snapshot not found or expired.') from None
+        if time.time() - mtime >= self.ttl_s:
+            if self._remove(path):
+                self._bump('expired')
+            raise SnapshotNotFound('Snapshot not found or expired.')
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+        header = json.loads(conn.execute('SELECT header FROM snapshot').fetchone()[0])
+        return conn, header, path
+
+    def describe(self, snapshot_id: str) -> dict:
+        conn, header, path = self._open(snapshot_id)
+        conn.close()
+        data = self._describe(snapshot_id, header, os.path.getsize(path))
+        data.update(columns=header['columns'], types=header['types'], meta=header['meta'])
+        return data
+
+    def page(
+        self,
+        snapshot_id: str,
+        *,
+        limit: int = 100,
+        cursor: str | None = None,
+        sort: str | None = None,
+        order: str | None = None,
+        columns: list[str] | None = None,
+    ) -> dict:
+        limit = min(max(1, int(limit)), self.max_page)
+        offset = 0
+        if cursor:
+            state = decode_cursor(cursor)
+            if (sort and sort != state['sort']) or (order and order != state['order']):
+                raise ValueError('Cursor was issued for a different sort; start again without a cursor.')
+            offset, sort, order = state['offset'], state['sort'], state['order']
+        order = (order or 'asc').lower()
+        if order not in SORT_ORDERS:
+            raise ValueError('order must be asc or desc.')
+        conn, header, _ = self._open(snapshot_id)
+        try:
+            all_columns = header['columns']
+            all_types = header['types'] or [None] * len(all_columns)
+            positions = {name: index for index, name in enumerate(all_columns)}
+            selected = columns or all_columns
+            unknown = [name for name in list(selected) + ([sort] if sort else []) if name not in positions]
+            if unknown:
+                raise ValueError(f"Unknown column(s): {', '.join(unknown)}.")
+            if not selected:
+                rows = []
+            else:
+                select = ', '.join(_column_name(positions[name]) for name in selected)
+                order_by = '_row'
+                if sort:
+                    direction = order.upper()
+                    order_by = f'{_column_name(positions[sort])} {direction}, _row {direction}'
+                rows = conn.execute(
+                    f'SELECT {select} FROM rows ORDER BY {order_by} LIMIT ? OFFSET ?', (limit + 1, offset)
+                ).fetchall()
+        finally:
+            conn.close()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        self._bump('pages')
+        return {
+            'id': snapshot_id,
+            'columns': list(selected),
+            'types': [all_types[positions[name]] for name in selected],
+            'rows': rows,
+            'row_count': header['row_count'],
+            'offset': offset,
+            'limit': limit,
+            'sort': sort,
+            'order': order,
+            'next_cursor': encode_cursor(offset + len(rows), sort, order) if has_more else None,
+            'expires_at': header['created_at'] + self.ttl_s,
+            'meta': header['meta'],
+        }
+
+    def delete(self, snapshot_id: str) -> bool:
+        removed = self._remove(self._path(snapshot_id))
+        if removed:
+            self._bump('deleted')
+        return removed
+
+    def stats(self) -> dict:
+        files = self._files()
+        with self._lock:
+            data = dict(self._stats)
+        data['snapshots'] = len(files)
+        data['bytes'] = sum(size for _, size, _ in files)
+        data['max_bytes'] = self.max_bytes
+        data['ttl_s'] = self.ttl_s
+        return data
+
+
+_RESULT_STORE = {'store': None}
+_RESULT_STORE_LOCK = threading.Lock()
+
+
+def enabled() -> bool:
+    return env_int('RESULT_SNAPSHOTS_ENABLED', 1) == 1
+
+
+def get_result_store() -> ResultStore:
+    store = _RESULT_STORE['store']
+    if store is not None:
+        return store
+    with _RESULT_STORE_LOCK:
+        if _RESULT_STORE['store'] is None:
+            _RESULT_STORE['store'] = ResultStore(
+                os.environ.get('RESULT_SNAPSHOT_DIR') or RESULT_SNAPSHOT_DIR,
+                ttl_s=env_float('RESULT_SNAPSHOT_TTL_S', 3600.0),
+                max_bytes=env_int('RESULT_SNAPSHOT_MAX_BYTES', 512 * 1024 * 1024),
+                max_page=env_int('RESULT_SNAPSHOT_MAX_PAGE', 1000),
+            )
+        return _RESULT_STORE['store']
+
+
+def save_snapshot(columns: list[str], rows: list, types: list[str] | None = None, meta: dict | None = None) -> dict | None:
+    if not enabled() or not columns:
+        return None
+    store = get_result_store()
+    try:
+        return store.save(columns, rows, types, meta)
+    except Exception:
+        store._bump('errors')
+        log_error(traceback.format_exc())
+        return None
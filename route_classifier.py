@@ -0,0 +1,312 @@
+import json
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from .config import BASE_DIR, EXAMPLES_DB_PATH, env_float, env_int, log_error
+
+ROUTE_MODEL_PATH = os.path.join(BASE_DIR, 'route_model.json')
+ROUTES = ('normal_intent', 'analytics_agent')
+
+_MODEL = {'model': None, 'mtime': None}
+_MODEL_LOCK = threading.Lock()
+_STATS = {'local_hits': 0, 'llm_fallbacks': 0, 'local_latency_s': 0.0, 'predictions': 0}
+_STATS_LOCK = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(EXAMPLES_DB_PATH, timeout=5.0)
+    conn.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS route_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT NOT NULL,
+            route TEXT NOT NULL,
+            source TEXT NOT NULL,
+            latency_ms REAL,
+            local_route TEXT,
+            local_confidence REAL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now'))
+        )
+        '''
+    )
+    return conn
+
+
+def tokenize(text: str) -> list[str]:
+    words = [w for w in ''.join(c.lower() if c.isalnum() else ' ' for c in (text or '')).split() if w]
+    return words + [f'{a}_{b}' for a, b in zip(words, words[1:])]
+
+
+class RouteModel:
+    def __init__(self, vocab: dict[str, int], idf: np.ndarray, weights: np.ndarray, bias: float, meta: dict | None = None):
+        self.vocab = vocab
+        self.idf = idf
+        self.weights = weights
+        self.bias = bias
+        self.meta = meta or {}
+
+    @staticmethod
+    def _features(questions: list[str], vocab: dict[str, int], idf: np.ndarray) -> np.ndarray:
+        matrix = np.zeros((len(questions), len(vocab)), dtype=np.float32)
+        for row, question in enumerate(questions):
+            counts: dict[int, int] = {}
+            for tok in tokenize(question):
+                col = vocab.get(tok)
+                if col is not None:
+                    counts[col] = counts.get(col, 0) + 1
+            for col, count in counts.items():
+                matrix[row, col] = (1.0 + math.log(count)) * idf[col]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        return matrix / norms
+
+    @classmethod
+    def fit(
+        cls,
+        questions: list[str],
+        labels: list[int],
+        *,
+        min_df: int = 1,
+        l2: float = 1e-3,
+        epochs: int = 300,
+        lr: float = 2.0,
+    ) -> 'RouteModel':
+        df: dict[str, int] = {}
+        for question in questions:
+            for tok in set(tokenize(question)):
+                df[tok] = df.get(tok, 0) + 1
+        terms = sorted(t for t, n in df.items() if n >= min_df)
+        vocab = {t: i for i, t in enumerate(terms)}
+        n_docs = len(questions)
+        idf = np.array([math.log((1 + n_docs) / (1 + df[t])) + 1.0 for t in terms], dtype=np.float32)
+        x = cls._features(questions, vocab, idf)
+        y = np.asarray(labels, dtype=np.float32)
+        pos = float(y.sum())
+        neg = float(len(y) - pos)
+        sample_w = np.where(y == 1.0, len(y) / (2.0 * max(pos, 1.0)), len(y) / (2.0 * max(neg, 1.0))).astype(np.float32)
+        w = np.zeros(x.shape[1], dtype=np.float32)
+        b = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(x @ w + b)))
+            err = (p - y) * sample_w
+            w -= lr * ((x.T @ err) / len(y) + l2 * w)
+            b -= lr * float(err.mean())
+        return cls(vocab, idf, w, b)
+
+    def predict_proba(self, questions: list[str]) -> np.ndarray:
+        x = self._features(questions, self.vocab, self.idf)
+        return 1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias)))
+
+    def predict(self, question: str) -> tuple[str, float]:
+        p = float(self.predict_proba([question])[0])
+        if p >= 0.5:
+            return ROUTES[1], p
+        return ROUTES[0], 1.0 - p
+
+    def to_dict(self) -> dict:
+        return {
+            'vocab': self.vocab,
+            'idf': self.idf.tolist(),
+            'weights': self.weights.tolist(),
+            'bias': self.bias,
+            'meta': self.meta,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'RouteModel':
+        return cls(
+            {str(k): int(v) for k, v in data['vocab'].items()},
+            np.asarray(data['idf'], dtype=np.float32),
+            np.asarray(data['weights'], dtype=np.float32),
+            float(data['bias']),
+            data.get('meta') or {},
+        )
+
+
+def _route_from_tags(tags) -> str | None:
+    for tag in tags or []:
+        value = str(tag).strip().lower()
+        if value.startswith('route:'):
+            value = value[len('route:') :].strip()
+        if value in ROUTES:
+            return value
+        if value in {'analytics', 'analytics_agent'}:
+            return 'analytics_agent'
+    return None
+
+
+def load_training_data() -> list[tuple[str, str]]:
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT question, route FROM route_log WHERE source = 'llm' ORDER BY id").fetchall()
+        try:
+            tagged = conn.execute('SELECT question, tags FROM sql_examples').fetchall()
+        except sqlite3.OperationalError:
+            tagged = []
+    finally:
+        conn.close()
+    latest: dict[str, str] = {}
+    for question, tags_json in tagged:
+        try:
+            route = _route_from_tags(json.loads(tags_json or '[]'))
+        except Exception:
+            route = None
+        if route:
+            latest[question.strip().lower()] = route
+    for question, route in rows:
+        if route in ROUTES:
+            latest[question.strip().lower()] = route
+    return list(latest.items())
+
+
+def _accuracy(model: RouteModel, data: list[tuple[str, str]]) -> float:
+    if not data:
+        return 0.0
+    correct = sum(1 for q, route in data if model.predict(q)[0] == route)
+    return correct / len(data)
+
+
+def retrain(path: str | None = None, holdout: float = 0.2, seed: int = 7) -> dict:
+    data = load_training_data()
+    classes = {route for _, route in data}
+    min_samples = env_int('ROUTE_CLASSIFIER_MIN_SAMPLES', 20)
+    if len(data) < min_samples or len(classes) < 2:
+        return {
+            'trained': False,
+            'reason': f'Need at least {min_samples} labelled questions covering both routes; have {len(data)}.',
+            'samples': len(data),
+        }
+    shuffled = list(data)
+    random.Random(seed).shuffle(shuffled)
+    cut = max(1, int(len(shuffled) * holdout))
+    test, train = shuffled[:cut], shuffled[cut:]
+    label = lambda route: 1 if route == 'analytics_agent' else 0
+    candidate = RouteModel.fit([q for q, _ in train], [label(r) for _, r in train])
+    holdout_accuracy = _accuracy(candidate, test)
+
+    model = RouteModel.fit([q for q, _ in data], [label(r) for _, r in data])
+    started = time.perf_counter()
+    for q, _ in test:
+        model.predict(q)
+    local_latency_ms = (time.perf_counter() - started) * 1000.0 / max(1, len(test))
+
+    conn = _connect()
+    try:
+        llm_latency_ms, agreement = conn.execute(
+            '''
+            SELECT AVG(latency_ms), AVG(CASE WHEN local_route IS NULL THEN NULL WHEN local_route = route THEN 1.0 ELSE 0.0 END)
+            FROM route_log
+            WHERE source = 'llm'
+            '''
+        ).fetchone()
+    finally:
+        conn.close()
+
+    model.meta = {
+        'trained_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'samples': len(data),
+        'vocab_size': len(model.vocab),
+        'holdout_accuracy': round(holdout_accuracy, 4),
+        'local_latency_ms': round(local_latency_ms, 4),
+        'llm_router_latency_ms': round(llm_latency_ms, 1) if llm_latency_ms is not None else None,
+        'logged_agreement_with_llm': round(agreement, 4) if agreement is not None else None,
+    }
+    target = path or ROUTE_MODEL_PATH
+    tmp = target + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as handle:
+        json.dump(model.to_dict(), handle)
+    os.replace(tmp, target)
+    with _MODEL_LOCK:
+        _MODEL['model'] = model
+        _MODEL['mtime'] = os.path.getmtime(target)
+    return {'trained': True, **model.meta}
+
+
+def get_model() -> RouteModel | None:
+    try:
+        mtime = os.path.getmtime(ROUTE_MODEL_PATH)
+    except OSError:
+        return None
+    if _MODEL['model'] is not None and _MODEL['mtime'] == mtime:
+        return _MODEL['model']
+    with _MODEL_LOCK:
+        if _MODEL['model'] is None or _MODEL['mtime'] != mtime:
+            try:
+                with open(ROUTE_MODEL_PATH, 'r', encoding='utf-8') as handle:
+                    _MODEL['model'] = RouteModel.from_dict(json.load(handle))
+            except Exception:
+                log_error(traceback.format_exc())
+                _MODEL['model'] = None
+            _MODEL['mtime'] = mtime
+        return _MODEL['model']
+
+
+def classify(question: str) -> tuple[str, float] | None:
+    model = get_model()
+    if model is None:
+        return None
+    started = time.perf_counter()
+    route, confidence = model.predict(question)
+    with _STATS_LOCK:
+        _STATS['predictions'] += 1
+        _STATS['local_latency_s'] += time.perf_counter() - started
+    return route, confidence
+
+
+def confidence_threshold() -> float:
+    return env_float('ROUTE_CLASSIFIER_THRESHOLD', 0.85)
+
+
+def record_local_hit() -> None:
+    with _STATS_LOCK:
+        _STATS['local_hits'] += 1
+
+
+def log_decision(
+    question: str,
+    route: str,
+    source: str,
+    latency_ms: float | None = None,
+    local: tuple[str, float] | None = None,
+) -> None:
+    if source == 'llm':
+        with _STATS_LOCK:
+            _STATS['llm_fallbacks'] += 1
+    try:
+        conn = _connect()
+        try:
+            conn.execute(
+                '''
+                INSERT INTO route_log (question, route, source, latency_ms, local_route, local_confidence)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''',
+                (question, route, source, latency_ms, local[0] if local else None, local[1] if local else None),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception:
+        log_error(traceback.format_exc())
+
+
+def stats() -> dict:
+    with _STATS_LOCK:
+        data = dict(_STATS)
+    data['avg_local_latency_ms'] = (
+        round(data.pop('local_latency_s') * 1000.0 / data['predictions'], 4) if data['predictions'] else 0.0
+    )
+    data['threshold'] = confidence_threshold()
+    model = get_model()
+    data['model'] = model.meta if model is not None else None
+    return data
+
+
+if __name__ == '__main__':
+    print(json.dumps(retrain(), indent=2))
@@ -0,0 +1,254 @@
+import json
+import math
+import os
+import re
+import threading
+
+from .config import SCHEMA_DETAILS_PATH, env_int
+
+MANDATORY_TABLES = (
+    'grp.FactSale',
+    'grp.BridgeExchangeRate',
+    'dw.DimExchangeRate',
+    'grp.DimLegalEntity',
+    'grp.DimDealStage',
+)
+ANALYTICS_TABLES = ('dw.DimDate', 'dw.FactBudget', 'grp.BridgeBudgetExchangeRate')
+_RENDERED_SECTIONS = {'SCHEMA (ALLOWED TABLES ONLY)', 'TABLE DEFINITIONS', 'RELATIONSHIPS'}
+_SYNONYMS = {
+    'rep': 'salesperson',
+    'reps': 'salesperson',
+    'owner': 'salesperson',
+    'seller': 'salesperson',
+    'sales_person': 'salesperson',
+    'client': 'customer',
+    'clients': 'customer',
+    'account': 'customer',
+    'accounts': 'customer',
+    'customers': 'customer',
+    'target': 'budget',
+    'targets': 'budget',
+    'plan': 'budget',
+    'gap': 'budget',
+    'run': 'budget',
+    'day': 'date',
+    'week': 'date',
+    'month': 'date',
+    'monthly': 'date',
+    'quarter': 'date',
+    'quarterly': 'date',
+    'year': 'date',
+    'yearly': 'date',
+    'ytd': 'date',
+    'mtd': 'date',
+    'qtd': 'date',
+    'today': 'date',
+    'trend': 'date',
+    'period': 'date',
+    'calendar': 'date',
+}
+_HEADING_RE = re.compile(r"^[A-Z0-9][A-Z0-9 &/().,'-]*[A-Z)]$")
+_TABLE_RE = re.compile(r'^(\w+)\.(\w+)$')
+_COLUMN_RE = re.compile(r'^(\w+)\s*\(([^)]*)\)$')
+
+_CACHE = {'catalog': None, 'mtime': None}
+_CACHE_LOCK = threading.Lock()
+
+
+def estimate_tokens(text: str | int) -> int:
+    chars = text if isinstance(text, int) else len(text or '')
+    return int(math.ceil(chars / 4.0))
+
+
+def _is_heading(line: str) -> bool:
+    outside = re.sub(r'\([^)]*\)', '', line).strip()
+    return bool(outside) and bool(_HEADING_RE.match(outside)) and sum(c.isalpha() for c in outside) >= 3
+
+
+def _words(name: str) -> list[str]:
+    base = re.sub(r'^(Dim|Fact|Bridge)', '', name.split('.', 1)[-1])
+    return [w.lower() for w in re.findall(r'[A-Z][a-z]*|[a-z]+', base)]
+
+
+def _is_measure_table(name: str) -> bool:
+    base = name.split('.', 1)[-1]
+    return base.startswith('Fact') or base.startswith('Bridge')
+
+
+def _intent_tokens(intent: dict | None, question: str = '') -> set[str]:
+    intent = intent or {}
+    parts = [question or '']
+    for key in ('entity', 'metric', 'secondary_metric', 'time_period', 'group_by', 'order_by', 'comparison_type', 'goal_type'):
+        value = intent.get(key)
+        if value:
+            parts.append(json.dumps(value, default=str) if not isinstance(value, str) else value)
+    for item in intent.get('filters') or []:
+        if isinstance(item, dict):
+            parts.append(str(item.get('field') or ''))
+        else:
+            parts.append(str(item))
+    tokens = set()
+    for word in re.findall(r'[a-z0-9]+(?:_[a-z0-9]+)*', ' '.join(parts).lower()):
+        tokens.add(word)
+        tokens.update(word.split('_'))
+    tokens.update(_SYNONYMS[t] for t in list(tokens) if t in _SYNONYMS)
+    if intent.get('time_period'):
+        tokens.add('date')
+    return tokens
+
+
+class SchemaCatalog:
+    def __init__(
+        self,
+        sections: list[tuple[str, str]],
+        allowed: list[str],
+        tables: dict[str, list[tuple[str, str]]],
+        relationships: list[tuple[str, str, str]],
+    ):
+        self.sections = sections
+        self.allowed = allowed
+        self.tables = tables
+        self.relationships = relationships
+        self.full_text = self.render(allowed, None)
+
+    @classmethod
+    def parse(cls, text: str) -> 'SchemaCatalog':
+        sections: list[tuple[str, list[str]]] = [('', [])]
+        for raw in (text or '').splitlines():
+            line = raw.rstrip()
+            stripped = line.strip()
+            if stripped and _is_heading(stripped):
+                sections.append((stripped, []))
+            else:
+                sections[-1][1].append(line)
+        parsed = [(heading, '\n'.join(body).strip()) for heading, body in sections]
+
+        allowed: list[str] = []
+        tables: dict[str, list[tuple[str, str]]] = {}
+        relationships: list[tuple[str, str, str]] = []
+        for heading, body in parsed:
+            lines = [l.strip() for l in body.splitlines() if l.strip()]
+            if heading == 'SCHEMA (ALLOWED TABLES ONLY)':
+                allowed.extend(l for l in lines if _TABLE_RE.match(l))
+            elif heading == 'TABLE DEFINITIONS':
+                current = None
+                for line in lines:
+                    if _TABLE_RE.match(line):
+                        current = line
+                        tables[current] = []
+                    elif current and _COLUMN_RE.match(line):
+                        name, col_type = _COLUMN_RE.match(line).groups()
+                        tables[current].append((name, col_type.strip()))
+            elif heading == 'RELATIONSHIPS':
+                for line in lines:
+                    if '→' in line:
+                        left, right = [p.strip() for p in line.split('→', 1)]
+                        relationships.append((left.split('.', 1)[0], right.split('.', 1)[0], line))
+        for name in tables:
+            if name not in allowed:
+                allowed.append(name)
+        return cls(parsed, allowed, tables, relationships)
+
+    def select_tables(self, intent: dict | None = None, question: str = '', analytics: bool = False) -> list[str]:
+        tokens = _intent_tokens(intent, question)
+        wanted = set(MANDATORY_TABLES)
+        if analytics:
+            wanted.update(ANALYTICS_TABLES)
+        for name in self.allowed:
+            words = _words(name)
+            if words and (all(w in tokens for w in words) or ''.join(words) in tokens):
+                wanted.add(name)
+                continue
+            labels = [c for c, _ in self.tables.get(name, []) if not c.endswith(('_key', '_id'))]
+            if not _is_measure_table(name) and any(c in tokens for c in labels):
+                wanted.add(name)
+        if 'budget' in tokens:
+            wanted.update(ANALYTICS_TABLES)
+        return [name for name in self.allowed if name in wanted]
+
+    def _columns(self, name: str, tokens: set[str] | None) -> list[tuple[str, str]]:
+        columns = self.tables.get(name, [])
+        if tokens is None or not _is_measure_table(name):
+            return columns
+        keys = [c for c in columns if c[0].endswith(('_key', '_id'))]
+        measures = [c for c in columns if c not in keys]
+        mentioned = [c for c in measures if c[0] in tokens or c[0].split('_', 1)[0] in tokens]
+        kept = set(keys + (mentioned or measures))
+        return [c for c in columns if c in kept]
+
+    def _section_relevant(self, heading: str, intent: dict | None, selected: set[str], tokens: set[str]) -> bool:
+        if intent is None:
+            return True
+        key = re.sub(r'^\d+\.\s*', '', heading).upper()
+        if key.startswith('ENTITY RULES'):
+            return bool(intent.get('entity'))
+        if key.startswith('GROUP BY RULES'):
+            return bool(intent.get('group_by'))
+        if key.startswith('ORDER BY RULES'):
+            return bool(intent.get('order_by'))
+        if key.startswith('LIMIT RULES'):
+            return intent.get('limit') not in (None, '', 0)
+        if key.startswith('TIME PERIOD RULES'):
+            return 'dw.DimDate' in selected
+        if key.startswith('FACT TABLE SAFETY'):
+            return 'dw.FactBudget' in selected
+        if key.startswith('REVENUE & MARGIN RULES'):
+            return bool(tokens & {'revenue', 'margin', 'tcv', 'budget'})
+        return True
+
+    def render(self, tables: list[str] | None, intent: dict | None, question: str = '') -> str:
+        selected = list(tables) if tables is not None else list(self.allowed)
+        selected_set = set(selected)
+        tokens = _intent_tokens(intent, question) if intent is not None else None
+        out: list[str] = []
+        for heading, body in self.sections:
+            if heading in _RENDERED_SECTIONS:
+                if heading == 'SCHEMA (ALLOWED TABLES ONLY)':
+                    out.append(heading + '\n\nYou may query ONLY the following tables:\n\n' + '\n'.join(selected))
+                elif heading == 'TABLE DEFINITIONS':
+                    blocks = []
+                    for name in selected:
+                        columns = self._columns(name, tokens)
+                        if columns:
+                            blocks.append(name + '\n\n' + '\n'.join(f'{c} ({t})' for c, t in columns))
+                    out.append(heading + '\n' + '\n\n'.join(blocks))
+                else:
+                    shorts = {n.split('.', 1)[-1] for n in selected}
+                    lines = [line for left, right, line in self.relationships if left in shorts and right in shorts]
+                    if lines:
+                        out.append(heading + '\n\n' + '\n'.join(lines))
+                continue
+            if heading and not self._section_relevant(heading, intent, selected_set, tokens or set()):
+                continue
+            out.append(f'{heading}\n\n{body}'.strip() if heading else body)
+        return '\n\n'.join(part for part in out if part)
+
+
+def get_catalog() -> SchemaCatalog | None:
+    try:
+        mtime = os.path.getmtime(SCHEMA_DETAILS_PATH)
+    except OSError:
+        return None
+    if _CACHE['catalog'] is not None and _CACHE['mtime'] == mtime:
+        return _CACHE['catalog']
+    with _CACHE_LOCK:
+        if _CACHE['catalog'] is None or _CACHE['mtime'] != mtime:
+            with open(SCHEMA_DETAILS_PATH, 'r', encoding='utf-8') as handle:
+                _CACHE['catalog'] = SchemaCatalog.parse(handle.read())
+            _CACHE['mtime'] = mtime
+        return _CACHE['catalog']
+
+
+def pruning_enabled() -> bool:
+    return env_int('SCHEMA_PRUNING_ENABLED', 1) == 1
+
+
+def build_schema_context(intent: dict | None, question: str = '', analytics: bool = False) -> tuple[str, dict] | None:
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    if not pruning_enabled():
+        return catalog.full_text, {'pruned': False, 'tables': list(catalog.allowed), 'schema_chars_full': len(catalog.full_text)}
+    tables = catalog.select_tables(intent, question, analytics)
+    text = catalog.render(tables, intent or {}, question)
+    return text, {'pruned': True, 'tables': tables, 'schema_chars_full': len(catalog.full_text)}
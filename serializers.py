@@ -1,6 +1,9 @@
-from datetime import date, datetime
+import json
+from datetime import date, datetime, time
 from decimal import Decimal
 
+from .metrics import traced
+
 
 def format_rows(rows, columns):
     if not rows or not columns:
@@ -23,5 +26,129 @@ def json_value(value):
     return value
 
 
+@traced('json_rows')
 def json_rows(rows):
     return [[json_value(cell) for cell in row] for row in rows]
+
+
+RESULT_FORMATS = ('rows', 'columnar', 'arrow')
+ARROW_MIME = 'application/vnd.apache.arrow.stream'
+
+_TYPE_NAMES = {
+    bool: 'bool',
+    int: 'int',
+    float: 'float',
+    Decimal: 'decimal',
+    str: 'str',
+    datetime: 'datetime',
+    date: 'date',
+    time: 'time',
+    bytes: 'bytes',
+    bytearray: 'bytes',
+}
+_NATIVE_TYPES = {'bool', 'int', 'float', 'str'}
+_CONVERTERS = {
+    'decimal': float,
+    'datetime': lambda value: value.isoformat(),
+    'date': lambda value: value.isoformat(),
+    'time': lambda value: value.isoformat(),
+    'bytes': lambda value: bytes(value).hex(),
+}
+
+
+class FormatUnavailable(RuntimeError):
+    pass
+
+
+def result_format(value) -> str:
+    fmt = str(value or 'rows').strip().lower()
+    if fmt == 'json':
+        return 'rows'
+    if fmt not in RESULT_FORMATS:
+        raise ValueError(f"format must be one of: json, {', '.join(RESULT_FORMATS)}.")
+    return fmt
+
+
+def column_types(description) -> list[str]:
+    return [_TYPE_NAMES.get(desc[1], 'unknown') for desc in description or []]
+
+
+def column_converters(types: list[str]) -> list:
+    converters = []
+    for name in types:
+        if name in _NATIVE_TYPES:
+            converters.append(None)
+        else:
+            converters.append(_CONVERTERS.get(name, json_value))
+    return converters
+
+
+def convert_rows(rows: list, converters: list) -> list[tuple]:
+    if not rows:
+        return []
+    if not any(converters):
+        return [tuple(row) for row in rows]
+    columns = list(zip(*rows))
+    for index, convert in enumerate(converters):
+        if convert is not None:
+            columns[index] = [None if value is None else convert(value) for value in columns[index]]
+    return list(zip(*columns))
+
+
+def columnar(rows: list, width: int) -> list[list]:
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(column) for column in zip(*rows)]
+
+
+def shape_result(fmt: str, columns: list[str], rows: list, types: list[str] | None = None) -> dict:
+    if fmt == 'rows':
+        return {'columns': columns, 'rows': rows}
+    return {'columns': columns, 'types': types, 'data': columnar(rows, len(columns))}
+
+
+def _arrow_array(pa, values: list, type_name: str | None):
+    array = pa.array(values, from_pandas=False)
+    target = {'datetime': pa.timestamp('us'), 'date': pa.date32(), 'decimal': pa.float64()}.get(type_name)
+    if target is not None and not pa.types.is_null(array.type):
+        try:
+            array = array.cast(target)
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    return array
+
+
+def require_arrow():
+    try:
+        import pyarrow as pa
+    except ImportError as exc:
+        raise FormatUnavailable('format=arrow requires the optional pyarrow package.') from exc
+    return pa
+
+
+@traced('arrow_ipc')
+def arrow_ipc(columns: list[str], data: list[list], types: list[str] | None = None, metadata: dict | None = None) -> bytes:
+    pa = require_arrow()
+    types = types or [None] * len(columns)
+    arrays = [_arrow_array(pa, values, type_name) for values, type_name in zip(data, types)]
+    schema_meta = {'meta': json.dumps(metadata, default=_json_default)} if metadata else None
+    table = pa.Table.from_arrays(arrays, names=list(columns), metadata=schema_meta)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _json_default(value):
+    converted = json_value(value)
+    if converted is value:
+        return str(value)
+    return converted
+
+
+def ndjson_line(obj: dict) -> str:
+    return json.dumps(obj, default=_json_default, separators=(',', ':')) + '\n'
+
+
+def sse_event(event: str, obj: dict) -> str:
+    return f'event: {event}\ndata: {json.dumps(obj, default=_json_default, separators=(",", ":"))}\n\n'
@@ -1,10 +1,10 @@
+import json
 import os
 import sys
+import time
 import traceback
-import threading
-from datetime import datetime
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory, stream_with_context
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 if BASE_DIR not in sys.path:
@@ -12,18 +12,45 @@ if BASE_DIR not in sys.path:
 
 from core.business_rules import (
     country_code_for_region,
-    legal_entity_name,
     normalize_region,
     normalize_reporting_currency,
     normalize_stage_bucket,
-    stage_bucket_predicate,
 )
-from core.config import BASE_DIR, load_env, log_error
-from core.db import get_connection, list_tables
-from core.example_store import add_example, delete_example, find_similar_examples, init_examples_db, list_examples
+from core import business_rules, intent_compiler, llm_cache, metrics, query_budget, question_cache, replica, route_classifier
+from core.admission import Overloaded, build_admission_controller
+from core.config import BASE_DIR, env_int, load_env, log_error
+from core.db import get_pool, pool_stats, stream_query
+from core.embedding_backfill import build_embedding_backfill
+from core.example_store import (
+    add_example,
+    delete_example,
+    export_examples,
+    find_similar_examples,
+    import_examples,
+    init_examples_db,
+    list_examples,
+)
+from core.gemini_client import commit_responses, discard_responses, transport_stats
 from core.intent_router import apply_stage_bucket_to_intent, plan_intent, route_question
-from core.serializers import format_rows, json_rows
-from core.sql_engine import call_gemini_nl, generate_sql_for_route
+from core.jobs import JobCancelled, JobQueueFull, build_job_manager
+from core.kpi_service import build_kpi_service
+from core.query_budget import QueryBudgetExceeded, budget_for
+from core.request_context import RequestContext
+from core.result_cache import cached_query, get_result_cache
+from core.result_store import SnapshotNotFound, get_result_store, save_snapshot
+from core.serializers import (
+    ARROW_MIME,
+    FormatUnavailable,
+    arrow_ipc,
+    format_rows,
+    ndjson_line,
+    require_arrow,
+    result_format,
+    shape_result,
+    sse_event,
+)
+from core.sql_engine import call_gemini_nl, generate_sql_for_route, validator_stats
+from core.warehouse_schema import get_schema_cache, list_tables
 
 load_env()
 init_examples_db()
@@ -39,8 +66,255 @@ HTML_PAGES = {
     "examples.html",
 }
 
-# Global request gate: only one long-running query at a time.
-REQUEST_SEM = threading.Semaphore(1)
+# Precomputed KPI strip snapshots, refreshed in the background.
+KPI_SERVICE = build_kpi_service()
+if env_int("KPI_BACKGROUND_REFRESH", 1) == 1:
+    KPI_SERVICE.start()
+
+# Bounded worker pool for asynchronous question -> answer jobs.
+JOBS = build_job_manager()
+
+# Fills missing or stale example embeddings in bulk, off the request path.
+EMBEDDING_BACKFILL = build_embedding_backfill()
+if env_int("EMBEDDING_BACKFILL_ENABLED", 1) == 1:
+    EMBEDDING_BACKFILL.start()
+
+# Optional local DuckDB copy of the sales star schema; eligible queries read from it instead of Fabric.
+REPLICA = replica.get_replica()
+if REPLICA is not None:
+    REPLICA.start()
+
+# Warehouse connection pool: warm FABRIC_POOL_MIN connections and prune idle/expired ones in the background.
+if env_int("FABRIC_POOL_MAINTENANCE_ENABLED", 1) == 1:
+    get_pool().start()
+
+# Warehouse schema catalog shared by all workers through a checksummed file; refreshed only on probe change.
+SCHEMA_CACHE = get_schema_cache()
+SCHEMA_CACHE.warm()
+if env_int("SCHEMA_CACHE_REFRESH_ENABLED", 1) == 1:
+    SCHEMA_CACHE.start()
+
+# Per-endpoint-class concurrency limits with a bounded, client-fair wait queue.
+ADMISSION = build_admission_controller()
+ADMISSION_ENDPOINTS = {
+    "api_sql": "query",
+    "api_sql_from_intent": "query",
+    "api_intent": "intent",
+    "api_kpi_strip": "kpi",
+}
+CLIENT_ID_HEADER = os.environ.get("ADMISSION_CLIENT_HEADER", "X-Client-Id")
+
+# Sampled from the existing stats endpoints on every /api/metrics scrape; `counters` are the monotonic keys.
+metrics.register_stats(
+    "admission",
+    ADMISSION.stats,
+    label="endpoint_class",
+    counters=(
+        "admitted",
+        "queued_total",
+        "rejected_queue_full",
+        "rejected_timeout",
+        "completed",
+        "wait_time_s",
+        "service_time_s",
+    ),
+)
+metrics.register_stats(
+    "db_pool",
+    pool_stats,
+    counters=(
+        "creates",
+        "create_failures",
+        "checkouts",
+        "waits",
+        "wait_time_s",
+        "timeouts",
+        "health_failures",
+        "idle_evictions",
+        "lifetime_recycles",
+        "discards",
+        "rollback_failures",
+        "warm_failures",
+        "maintenance_runs",
+    ),
+)
+metrics.register_stats(
+    "llm_transport", transport_stats, counters=("requests", "connects", "reuses", "stale_retries", "slot_wait_s")
+)
+metrics.register_stats(
+    "result_cache",
+    lambda: get_result_cache().stats(),
+    counters=("hits", "misses", "stale", "stores", "evictions", "oversize", "invalidations"),
+)
+metrics.register_stats(
+    "llm_cache", llm_cache.stats, counters=("hits", "misses", "stores", "bypassed", "evictions", "rejected", "errors")
+)
+metrics.register_stats(
+    "question_cache",
+    question_cache.stats,
+    counters=("lookups", "exact_hits", "semantic_hits", "misses", "guard_rejects", "stores", "evictions", "errors"),
+)
+metrics.register_stats("router", route_classifier.stats, counters=("local_hits", "llm_fallbacks", "predictions"))
+metrics.register_stats(
+    "validator", validator_stats, counters=("checks", "skipped", "invoked", "fixed", "unresolved", "autofixed")
+)
+metrics.register_stats("intent_compiler", intent_compiler.stats, counters=("compiled", "fallbacks", "reasons"))
+metrics.register_stats(
+    "kpi",
+    KPI_SERVICE.stats,
+    counters=("served_fresh", "served_stale", "cold_misses", "refreshes", "refresh_errors", "deduplicated"),
+)
+metrics.register_stats(
+    "embedding_backfill",
+    EMBEDDING_BACKFILL.stats,
+    counters=("runs", "embedded", "failed", "errors", "triggers", "suppressed_wakes"),
+)
+metrics.register_stats(
+    "jobs", JOBS.stats, counters=("submitted", "succeeded", "failed", "cancelled", "rejected", "expired")
+)
+metrics.register_stats(
+    "query_budget",
+    query_budget.stats,
+    counters=("queries", "timeouts", "cancelled", "truncated_rows", "truncated_bytes"),
+)
+metrics.register_stats(
+    "result_store",
+    lambda: get_result_store().stats(),
+    counters=("saved", "pages", "misses", "expired", "evicted", "deleted", "errors"),
+)
+metrics.register_stats(
+    "schema_cache",
+    SCHEMA_CACHE.stats,
+    counters=("disk_loads", "probes", "probe_errors", "refreshes", "changes", "unchanged", "skipped_locked", "errors"),
+)
+metrics.register_stats("business_rules", business_rules.stats, counters=("loads", "reloads", "unchanged", "rejected"))
+if REPLICA is not None:
+    metrics.register_stats(
+        "replica",
+        REPLICA.stats,
+        counters=("routed", "fallbacks", "ineligible", "errors", "syncs", "sync_errors", "rows_synced"),
+    )
+
+
+def client_key() -> str:
+    header_value = (request.headers.get(CLIENT_ID_HEADER) or "").strip()
+    if header_value:
+        return header_value
+    forwarded = (request.headers.get("X-Forwarded-For") or "").split(",")[0].strip()
+    return forwarded or request.remote_addr or "anonymous"
+
+
+@app.before_request
+def start_request_trace():
+    g.trace = metrics.start_trace()
+
+
+@app.before_request
+def admit_request():
+    endpoint_class = ADMISSION_ENDPOINTS.get(request.endpoint or "")
+    if not endpoint_class:
+        return None
+    try:
+        with metrics.span("admission"):
+            waited = ADMISSION.acquire(endpoint_class, client_key())
+    except Overloaded as exc:
+        response = jsonify(
+            {
+                "error": str(exc),
+                "endpoint_class": exc.endpoint_class,
+                "retry_after_s": exc.retry_after_s,
+            }
+        )
+        response.status_code = 429
+        response.headers["Retry-After"] = str(exc.retry_after_s)
+        return response
+    metrics.WAIT_SECONDS.observe(waited, resource=f"admission_{endpoint_class}")
+    g.admission = (endpoint_class, time.monotonic(), waited)
+    return None
+
+
+@app.teardown_request
+def release_admission(exc=None):
+    admission = g.pop("admission", None)
+    if admission is not None:
+        endpoint_class, started, _ = admission
+        ADMISSION.release(endpoint_class, time.monotonic() - started)
+
+
+@app.teardown_request
+def finish_request_trace(exc=None):
+    g.pop("trace", None)
+    metrics.end_trace()
+
+
+STREAM_FORMATS = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def requested_stream_format(payload: dict) -> str | None:
+    value = str(payload.get("stream") or request.args.get("stream") or "").strip().lower()
+    return value if value in STREAM_FORMATS else None
+
+
+def requested_result_format(payload: dict) -> str:
+    fmt = result_format(payload.get("format") or request.args.get("format"))
+    if fmt == "arrow":
+        require_arrow()
+    return fmt
+
+
+def arrow_response(result: dict) -> Response:
+    columns = result.pop("columns")
+    types = result.pop("types", None)
+    data = result.pop("data")
+    response = Response(arrow_ipc(columns, data, types, metadata=result), mimetype=ARROW_MIME)
+    response.headers["X-Row-Count"] = str(len(data[0]) if data else 0)
+    response.headers["X-Truncated"] = "1" if result.get("truncated") else "0"
+    if result.get("cache"):
+        response.headers["X-Cache"] = str(result["cache"])
+    return response
+
+
+def stream_result(
+    stream_format: str, sql_text: str, header: dict, max_rows=None, budget=None, ctx=None, on_complete=None
+):
+    batch_size = max(1, env_int("STREAM_BATCH_SIZE", 500))
+    row_cap = budget.max_rows if budget is not None else max(1, env_int("STREAM_MAX_ROWS", 100000))
+    try:
+        max_rows = min(int(max_rows), row_cap) if max_rows else row_cap
+    except (TypeError, ValueError):
+        max_rows = row_cap
+
+    def emit(event: str, body: dict) -> str:
+        body = {"type": event, **body}
+        if stream_format == "sse":
+            return sse_event(event, body)
+        return ndjson_line(body)
+
+    def generate():
+        started = time.monotonic()
+        try:
+            for kind, value in stream_query(sql_text, batch_size=batch_size, max_rows=max_rows, budget=budget):
+                if kind == "columns":
+                    yield emit("meta", dict(header, columns=value))
+                elif kind == "rows":
+                    yield emit("rows", {"rows": value})
+                else:
+                    summary = dict(value, max_rows=max_rows)
+                    if budget is not None:
+                        summary["budget"] = budget.report()
+                    summary["elapsed_ms"] = round((time.monotonic() - started) * 1000.0, 1)
+                    yield emit("summary", summary)
+            commit_responses(ctx)
+            if on_complete is not None:
+                on_complete()
+        except Exception as exc:
+            discard_responses(ctx)
+            log_error(traceback.format_exc())
+            yield emit("error", {"error": str(exc)})
+
+    response = Response(stream_with_context(generate()), mimetype=STREAM_FORMATS[stream_format])
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 @app.after_request
@@ -49,6 +323,39 @@ def disable_cache(response):
     return response
 
 
+def timings_requested() -> bool:
+    if str(request.args.get("timings") or "").strip().lower() in {"1", "true", "yes"}:
+        return True
+    payload = request.get_json(silent=True) if request.is_json else None
+    return isinstance(payload, dict) and bool(payload.get("include_timings"))
+
+
+def server_timing_header(summary: dict) -> str:
+    entries = [f"{stage};dur={info['ms']:.1f}" for stage, info in summary["stages"].items()]
+    entries.append(f"total;dur={summary['total_ms']:.1f}")
+    return ", ".join(entries)
+
+
+@app.after_request
+def attach_timings(response):
+    trace = g.get("trace")
+    if trace is None:
+        return response
+    summary = trace.summary()
+    metrics.HTTP_SECONDS.observe(
+        summary["total_ms"] / 1000.0,
+        endpoint=request.endpoint or "unknown",
+        status=str(response.status_code),
+    )
+    response.headers["Server-Timing"] = server_timing_header(summary)
+    if response.is_json and not response.is_streamed and timings_requested():
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body["timings"] = summary
+            response.set_data(app.json.dumps(body))
+    return response
+
+
 @app.get("/health")
 @app.get("/api/health")
 def health():
@@ -108,6 +415,71 @@ def api_examples_add():
         return jsonify({"error": str(exc), "detail": trace}), 500
 
 
+def read_ndjson_records(stream) -> list:
+    records = []
+    for raw in stream:
+        line = raw.decode("utf-8", errors="replace").strip() if isinstance(raw, bytes) else str(raw).strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError as exc:
+            records.append({"_error": f"Invalid JSON: {exc}"})
+    return records
+
+
+@app.post("/api/examples/bulk")
+def api_examples_import():
+    try:
+        if request.is_json:
+            body = request.get_json(silent=True)
+            records = body.get("examples") if isinstance(body, dict) else body
+            if not isinstance(records, list):
+                return jsonify({"error": "Expected a JSON array, {\"examples\": [...]}, or NDJSON"}), 400
+        else:
+            records = read_ndjson_records(request.stream)
+        report = import_examples(
+            records,
+            on_conflict=str(request.args.get("on_conflict") or "skip").strip().lower(),
+            embed=str(request.args.get("embed") or "1").strip() != "0",
+        )
+        return jsonify(report)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception as exc:
+        trace = traceback.format_exc()
+        log_error(trace)
+        return jsonify({"error": str(exc), "detail": trace}), 500
+
+
+@app.get("/api/examples/bulk")
+def api_examples_export():
+    include_embeddings = str(request.args.get("include_embeddings") or "").strip().lower() in {"1", "true", "yes"}
+
+    def generate():
+        try:
+            for item in export_examples(include_embeddings=include_embeddings):
+                yield ndjson_line(item)
+        except Exception as exc:
+            log_error(traceback.format_exc())
+            yield ndjson_line({"type": "error", "error": str(exc)})
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = 'attachment; filename="sql_examples.ndjson"'
+    return response
+
+
+@app.get("/api/examples/embeddings")
+def api_examples_embeddings():
+    return jsonify({"backfill": EMBEDDING_BACKFILL.stats()})
+
+
+@app.post("/api/examples/embeddings/backfill")
+def api_examples_embeddings_backfill():
+    EMBEDDING_BACKFILL.trigger()
+    return jsonify({"ok": True, "backfill": EMBEDDING_BACKFILL.stats()}), 202
+
+
 @app.delete("/api/examples/<int:example_id>")
 def api_examples_delete(example_id: int):
     try:
@@ -131,140 +503,160 @@ def api_tables():
         return jsonify({"error": "Failed to list tables", "detail": trace}), 500
 
 
+@app.get("/api/schema/cache")
+def api_schema_cache():
+    return jsonify({"schema_cache": SCHEMA_CACHE.stats()})
+
+
+@app.post("/api/schema/cache/refresh")
+def api_schema_cache_refresh():
+    force = str(request.args.get("force") or "").strip().lower() in {"1", "true", "yes"}
+    outcome = SCHEMA_CACHE.refresh(force=force, wait=True)
+    status = 500 if outcome == "error" else 200
+    return jsonify({"result": outcome, "schema_cache": SCHEMA_CACHE.stats()}), status
+
+
+@app.get("/api/admission")
+def api_admission():
+    return jsonify({"admission": ADMISSION.stats()})
+
+
+@app.get("/api/metrics")
+def api_metrics():
+    return Response(metrics.render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/query_budget")
+def api_query_budget():
+    return jsonify({"query_budget": query_budget.stats()})
+
+
+@app.get("/api/replica")
+def api_replica():
+    if REPLICA is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "replica": REPLICA.stats()})
+
+
+@app.post("/api/replica/sync")
+def api_replica_sync():
+    if REPLICA is None:
+        return jsonify({"error": "Replica is disabled (set REPLICA_ENABLED=1)."}), 404
+    REPLICA.trigger(full=str(request.args.get("full") or "").strip().lower() in {"1", "true", "yes"})
+    return jsonify({"ok": True, "replica": REPLICA.stats()}), 202
+
+
+@app.get("/api/db/pool")
+def api_db_pool():
+    return jsonify({"pool": pool_stats()})
+
+
+@app.get("/api/cache/results")
+def api_result_cache_stats():
+    return jsonify({"cache": get_result_cache().stats()})
+
+
+@app.delete("/api/cache/results")
+def api_result_cache_invalidate():
+    try:
+        payload = request.get_json(force=True, silent=True) or {}
+        scope = {
+            key: payload[key]
+            for key in ("region", "reporting_currency", "stage_bucket")
+            if payload.get(key)
+        }
+        removed = get_result_cache().invalidate(payload.get("sql") or None, **scope)
+        return jsonify({"ok": True, "invalidated": removed})
+    except Exception as exc:
+        trace = traceback.format_exc()
+        log_error(trace)
+        return jsonify({"error": str(exc), "detail": trace}), 500
+
+
+@app.get("/api/cache/llm")
+def api_llm_cache_stats():
+    return jsonify({"cache": llm_cache.stats()})
+
+
+@app.get("/api/cache/questions")
+def api_question_cache_stats():
+    return jsonify({"question_cache": question_cache.stats()})
+
+
+@app.delete("/api/cache/questions")
+def api_question_cache_invalidate():
+    try:
+        payload = request.get_json(force=True, silent=True) or {}
+        removed = question_cache.invalidate(
+            region=payload.get("region"),
+            reporting_currency=payload.get("reporting_currency"),
+            stage_bucket=payload.get("stage_bucket"),
+        )
+        return jsonify({"ok": True, "invalidated": removed})
+    except Exception as exc:
+        trace = traceback.format_exc()
+        log_error(trace)
+        return jsonify({"error": str(exc), "detail": trace}), 500
+
+
+@app.get("/api/llm/transport")
+def api_llm_transport():
+    return jsonify({"transport": transport_stats()})
+
+
+@app.delete("/api/cache/llm")
+def api_llm_cache_clear():
+    try:
+        return jsonify({"ok": True, "invalidated": llm_cache.clear()})
+    except Exception as exc:
+        trace = traceback.format_exc()
+        log_error(trace)
+        return jsonify({"error": str(exc), "detail": trace}), 500
+
+
+@app.get("/api/router/stats")
+def api_router_stats():
+    return jsonify({"router": route_classifier.stats()})
+
+
+@app.post("/api/router/retrain")
+def api_router_retrain():
+    try:
+        return jsonify({"report": route_classifier.retrain()})
+    except Exception as exc:
+        trace = traceback.format_exc()
+        log_error(trace)
+        return jsonify({"error": str(exc), "detail": trace}), 500
+
+
+@app.get("/api/validator/stats")
+def api_validator_stats():
+    return jsonify(validator_stats())
+
+
+@app.get("/api/intent_compiler/stats")
+def api_intent_compiler_stats():
+    return jsonify(intent_compiler.stats())
+
+
+@app.get("/api/business_rules")
+def api_business_rules():
+    return jsonify({"rules": business_rules.get_business_rules().to_dict(), "stats": business_rules.stats()})
+
+
+@app.get("/api/kpi_strip/stats")
+def api_kpi_strip_stats():
+    return jsonify({"kpi": KPI_SERVICE.stats()})
+
+
 @app.get("/api/kpi_strip")
 def api_kpi_strip():
     try:
         region = normalize_region(request.args.get("region"))
-        country_code = country_code_for_region(region)
         reporting_currency = normalize_reporting_currency(request.args.get("reporting_currency"))
         stage_bucket = normalize_stage_bucket(request.args.get("stage_bucket"))
 
-        stage_sql = stage_bucket_predicate(stage_bucket, alias="ds")
-        pipeline_sql = stage_bucket_predicate("pipeline", alias="ds")
-        entity_name = legal_entity_name().replace("'", "''")
-
-        sql_text = f"""
-WITH current_quarter AS (
-  SELECT
-    MIN(dd.calendar_date) AS q_start,
-    MAX(dd.calendar_date) AS q_end,
-    MAX(dd.calendar_year) AS q_year,
-    MAX(dd.calendar_quarter) AS q_quarter
-  FROM dw.DimDate dd
-  WHERE dd.calendar_year = YEAR(GETDATE())
-    AND dd.calendar_quarter = DATEPART(QUARTER, GETDATE())
-),
-actuals AS (
-  SELECT
-    SUM(ber.revenue_fx) / 1000.0 AS revenue_k,
-    SUM(ber.margin_fx) / 1000.0 AS margin_k
-  FROM grp.FactSale fs
-  JOIN grp.BridgeExchangeRate ber ON fs.sale_key = ber.sale_key
-  JOIN dw.DimExchangeRate der ON ber.exchange_rate_key = der.exchange_rate_key
-  JOIN grp.DimLegalEntity dle ON fs.legal_entity_id = dle.legal_entity_id
-  JOIN dw.DimDate dd ON fs.close_date_key = dd.date_key
-  JOIN grp.DimDealStage ds ON fs.deal_stage_key = ds.deal_stage_key
-  CROSS JOIN current_quarter cq
-  WHERE der.reporting_currency_code = ?
-    AND dle.legal_entity_name = ?
-    AND dle.country_code = ?
-    AND dd.calendar_date >= cq.q_start
-    AND dd.calendar_date <= cq.q_end
-    AND ({stage_sql})
-),
-budget AS (
-  SELECT
-    SUM(bber.revenue_fx) / 1000.0 AS budget_revenue_k
-  FROM dw.FactBudget fb
-  JOIN grp.BridgeBudgetExchangeRate bber ON fb.budget_key = bber.budget_key
-  JOIN dw.DimExchangeRate der ON bber.exchange_rate_key = der.exchange_rate_key
-  JOIN grp.DimLegalEntity dle ON fb.legal_entity_id = dle.legal_entity_id
-  JOIN dw.DimDate dd ON fb.month_end_date_key = dd.date_key
-  CROSS JOIN current_quarter cq
-  WHERE der.reporting_currency_code = ?
-    AND dle.legal_entity_name = ?
-    AND dle.country_code = ?
-    AND dd.calendar_year = cq.q_year
-    AND dd.calendar_quarter = cq.q_quarter
-),
-pipeline AS (
-  SELECT
-    SUM(ber.revenue_fx) / 1000.0 AS pipeline_k
-  FROM grp.FactSale fs
-  JOIN grp.BridgeExchangeRate ber ON fs.sale_key = ber.sale_key
-  JOIN dw.DimExchangeRate der ON ber.exchange_rate_key = der.exchange_rate_key
-  JOIN grp.DimLegalEntity dle ON fs.legal_entity_id = dle.legal_entity_id
-  JOIN dw.DimDate dd ON fs.close_date_key = dd.date_key
-  JOIN grp.DimDealStage ds ON fs.deal_stage_key = ds.deal_stage_key
-  CROSS JOIN current_quarter cq
-  WHERE der.reporting_currency_code = ?
-    AND dle.legal_entity_name = ?
-    AND dle.country_code = ?
-    AND dd.calendar_date >= cq.q_start
-    AND dd.calendar_date <= cq.q_end
-    AND ({pipeline_sql})
-)
-SELECT
-  a.revenue_k,
-  a.margin_k,
-  b.budget_revenue_k,
-  (b.budget_revenue_k - a.revenue_k) AS gap_k,
-  CASE WHEN b.budget_revenue_k = 0 THEN NULL ELSE p.pipeline_k / b.budget_revenue_k END AS coverage_ratio
-FROM actuals a
-CROSS JOIN budget b
-CROSS JOIN pipeline p;
-"""
-
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            sql_text,
-            (
-                reporting_currency,
-                entity_name,
-                country_code,
-                reporting_currency,
-                entity_name,
-                country_code,
-                reporting_currency,
-                entity_name,
-                country_code,
-            ),
-        )
-        row = cursor.fetchone()
-        conn.close()
-
-        def as_float(value):
-            if value is None:
-                return None
-            try:
-                return float(value)
-            except Exception:
-                return None
-
-        revenue_k = as_float(row[0]) if row else None
-        margin_k = as_float(row[1]) if row else None
-        budget_k = as_float(row[2]) if row else None
-        gap_k = as_float(row[3]) if row else None
-        coverage_ratio = as_float(row[4]) if row else None
-        now = datetime.utcnow()
-        quarter_label = f"Q{((now.month - 1) // 3) + 1} {now.year}"
-
-        return jsonify(
-            {
-                "quarter": quarter_label,
-                "region": region,
-                "reporting_currency": reporting_currency,
-                "stage_bucket": stage_bucket,
-                "kpis": {
-                    "revenue_k": revenue_k,
-                    "margin_k": margin_k,
-                    "budget_revenue_k": budget_k,
-                    "gap_k": gap_k,
-                    "coverage_ratio": coverage_ratio,
-                },
-            }
-        )
+        return jsonify(KPI_SERVICE.get(region, reporting_currency, stage_bucket))
     except Exception as exc:
         trace = traceback.format_exc()
         log_error(trace)
@@ -280,9 +672,12 @@ def api_intent():
         if not question:
             return jsonify({"error": "Missing query"}), 400
         stage_bucket = normalize_stage_bucket(payload.get("stage_bucket") or ui.get("stage_bucket"))
-        router = route_question(question)
+        ctx = RequestContext()
+        ctx.use_llm_cache = not payload.get("bypass_cache")
+        router = route_question(question, ctx=ctx)
         route = router.get("route", "normal_intent")
-        intent = plan_intent(question, route=route, stage_bucket=stage_bucket)
+        intent = plan_intent(question, route=route, stage_bucket=stage_bucket, ctx=ctx)
+        commit_responses(ctx)
         return jsonify(
             {
                 "route": route,
@@ -301,23 +696,29 @@ def api_intent():
 @app.post("/api/sql_from_intent")
 def api_sql_from_intent():
     try:
-        with REQUEST_SEM:
-            payload = request.get_json(force=True, silent=True) or {}
-            ui = payload.get("ui") if isinstance(payload.get("ui"), dict) else {}
-            intent = payload.get("intent")
-            if not isinstance(intent, dict):
-                return jsonify({"error": "Missing intent object"}), 400
-
-            region = normalize_region(payload.get("region") or ui.get("region"))
-            country_code = country_code_for_region(region)
-            reporting_currency = normalize_reporting_currency(
-                payload.get("reporting_currency") or ui.get("reporting_currency")
-            )
-            stage_bucket = normalize_stage_bucket(payload.get("stage_bucket") or ui.get("stage_bucket"))
-            route = str(payload.get("route") or intent.get("_route") or "normal_intent").lower()
-            preview_sql_only = bool(payload.get("preview_sql_only"))
-            intent = apply_stage_bucket_to_intent(intent, stage_bucket)
+        payload = request.get_json(force=True, silent=True) or {}
+        ui = payload.get("ui") if isinstance(payload.get("ui"), dict) else {}
+        intent = payload.get("intent")
+        if not isinstance(intent, dict):
+            return jsonify({"error": "Missing intent object"}), 400
+
+        region = normalize_region(payload.get("region") or ui.get("region"))
+        country_code = country_code_for_region(region)
+        reporting_currency = normalize_reporting_currency(
+            payload.get("reporting_currency") or ui.get("reporting_currency")
+        )
+        stage_bucket = normalize_stage_bucket(payload.get("stage_bucket") or ui.get("stage_bucket"))
+        route = str(payload.get("route") or intent.get("_route") or "normal_intent").lower()
+        preview_sql_only = bool(payload.get("preview_sql_only"))
+        try:
+            fmt = requested_result_format(payload)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        ctx = RequestContext()
+        ctx.use_llm_cache = not payload.get("bypass_cache")
+        intent = apply_stage_bucket_to_intent(intent, stage_bucket, ctx=ctx)
 
+        try:
             sql_text, llm_raw, prompt_used, route_used, sql_meta = generate_sql_for_route(
                 route,
                 payload.get("question") or "",
@@ -325,114 +726,190 @@ def api_sql_from_intent():
                 country_code,
                 reporting_currency,
                 stage_bucket,
+                ctx=ctx,
             )
+        except Exception:
+            discard_responses(ctx)
+            raise
 
-            if preview_sql_only:
-                return jsonify(
-                    {
-                        "sql": sql_text,
-                        "llm_raw": llm_raw,
-                        "prompt": prompt_used,
-                        "columns": [],
-                        "rows": [],
-                        "answer": "SQL preview only. Query not executed.",
-                        "narrative": None,
-                        "route_used": route_used,
-                        "region": region,
-                        "country_code": country_code,
-                        "stage_bucket": stage_bucket,
-                        "reporting_currency": reporting_currency,
-                        "preview_sql_only": True,
-                        "generator_sql": (sql_meta or {}).get("generator_sql"),
-                        "validated_sql": (sql_meta or {}).get("validated_sql"),
-                        "similar_examples": (sql_meta or {}).get("similar_examples", []),
-                    }
-                )
-
-            try:
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute(sql_text)
-                rows = cursor.fetchall()
-                columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                conn.close()
-            except Exception as exec_exc:
-                trace = traceback.format_exc()
-                log_error(trace)
-                return (
-                    jsonify(
-                        {
-                            "error": str(exec_exc),
-                            "detail": trace,
-                            "sql": sql_text,
-                            "llm_raw": llm_raw,
-                            "prompt": prompt_used,
-                            "route_used": route_used,
-                            "generator_sql": (sql_meta or {}).get("generator_sql"),
-                            "validated_sql": (sql_meta or {}).get("validated_sql"),
-                            "similar_examples": (sql_meta or {}).get("similar_examples", []),
-                        }
-                    ),
-                    500,
-                )
-
-            rows_json = json_rows(rows)
-            include_narrative = bool(payload.get("include_narrative"))
-            narrative = None
-            if include_narrative:
-                narrative = call_gemini_nl(
-                    payload.get("question") or "Answer the intent.",
-                    columns,
-                    rows_json,
-                    reporting_currency,
-                )
-
+        if preview_sql_only:
+            commit_responses(ctx)
             return jsonify(
                 {
                     "sql": sql_text,
                     "llm_raw": llm_raw,
                     "prompt": prompt_used,
-                    "columns": columns,
-                    "rows": rows_json,
-                    "answer": format_rows(rows, columns),
-                    "narrative": narrative,
+                    "columns": [],
+                    "rows": [],
+                    "answer": "SQL preview only. Query not executed.",
+                    "narrative": None,
                     "route_used": route_used,
                     "region": region,
                     "country_code": country_code,
                     "stage_bucket": stage_bucket,
                     "reporting_currency": reporting_currency,
+                    "preview_sql_only": True,
                     "generator_sql": (sql_meta or {}).get("generator_sql"),
                     "validated_sql": (sql_meta or {}).get("validated_sql"),
                     "similar_examples": (sql_meta or {}).get("similar_examples", []),
+                    "validator": (sql_meta or {}).get("validator"),
+                    "compiler": (sql_meta or {}).get("compiler"),
+                    "prompt_size": (sql_meta or {}).get("prompt_size"),
+                    "request_memo": ctx.stats(),
                 }
             )
+
+        stream_format = requested_stream_format(payload)
+        if stream_format:
+            return stream_result(
+                stream_format,
+                sql_text,
+                {
+                    "sql": sql_text,
+                    "route_used": route_used,
+                    "region": region,
+                    "country_code": country_code,
+                    "stage_bucket": stage_bucket,
+                    "reporting_currency": reporting_currency,
+                    "generator_sql": (sql_meta or {}).get("generator_sql"),
+                    "validated_sql": (sql_meta or {}).get("validated_sql"),
+                    "similar_examples": (sql_meta or {}).get("similar_examples", []),
+                    "validator": (sql_meta or {}).get("validator"),
+                    "compiler": (sql_meta or {}).get("compiler"),
+                    "prompt_size": (sql_meta or {}).get("prompt_size"),
+                    "request_memo": ctx.stats(),
+                },
+                max_rows=payload.get("max_rows"),
+                budget=budget_for(route_used),
+                ctx=ctx,
+            )
+
+        budget = budget_for(route_used).limit_rows(payload.get("max_rows"))
+        try:
+            columns, rows, cache_status = cached_query(
+                lambda sql: replica.run_query(sql, budget),
+                sql_text,
+                region,
+                reporting_currency,
+                stage_bucket,
+                bypass=bool(payload.get("bypass_cache")),
+                budget=budget,
+            )
+        except Exception as exec_exc:
+            discard_responses(ctx)
+            trace = traceback.format_exc()
+            log_error(trace)
+            return (
+                jsonify(
+                    {
+                        "error": str(exec_exc),
+                        "detail": trace,
+                        "budget": budget.report(),
+                        "sql": sql_text,
+                        "llm_raw": llm_raw,
+                        "prompt": prompt_used,
+                        "route_used": route_used,
+                        "generator_sql": (sql_meta or {}).get("generator_sql"),
+                        "validated_sql": (sql_meta or {}).get("validated_sql"),
+                        "similar_examples": (sql_meta or {}).get("similar_examples", []),
+                        "validator": (sql_meta or {}).get("validator"),
+                        "compiler": (sql_meta or {}).get("compiler"),
+                        "prompt_size": (sql_meta or {}).get("prompt_size"),
+                    }
+                ),
+                504 if isinstance(exec_exc, QueryBudgetExceeded) else 500,
+            )
+
+        snapshot = save_snapshot(
+            columns,
+            rows,
+            budget.column_types,
+            {
+                "sql": sql_text,
+                "route_used": route_used,
+                "region": region,
+                "reporting_currency": reporting_currency,
+                "stage_bucket": stage_bucket,
+                "truncated": budget.truncated,
+            },
+        )
+        commit_responses(ctx)
+        include_narrative = bool(payload.get("include_narrative"))
+        narrative = None
+        if include_narrative:
+            narrative = call_gemini_nl(
+                payload.get("question") or "Answer the intent.",
+                columns,
+                rows,
+                reporting_currency,
+            )
+
+        result = {
+            "sql": sql_text,
+            "llm_raw": llm_raw,
+            "prompt": prompt_used,
+            **shape_result(fmt, columns, rows, budget.column_types),
+            "answer": format_rows(rows, columns),
+            "narrative": narrative,
+            "cache": cache_status,
+            "snapshot": snapshot,
+            "source": budget.source,
+            "truncated": budget.truncated,
+            "budget": budget.report(),
+            "route_used": route_used,
+            "region": region,
+            "country_code": country_code,
+            "stage_bucket": stage_bucket,
+            "reporting_currency": reporting_currency,
+            "generator_sql": (sql_meta or {}).get("generator_sql"),
+            "validated_sql": (sql_meta or {}).get("validated_sql"),
+            "similar_examples": (sql_meta or {}).get("similar_examples", []),
+            "validator": (sql_meta or {}).get("validator"),
+            "compiler": (sql_meta or {}).get("compiler"),
+            "prompt_size": (sql_meta or {}).get("prompt_size"),
+            "request_memo": ctx.stats(),
+        }
+        if fmt == "arrow":
+            return arrow_response(result)
+        return jsonify(result)
+    except FormatUnavailable as exc:
+        return jsonify({"error": str(exc)}), 406
     except Exception as exc:
         trace = traceback.format_exc()
         log_error(trace)
         return jsonify({"error": str(exc), "detail": trace}), 500
 
 
-@app.post("/api/sql")
-def api_sql():
-    try:
-        with REQUEST_SEM:
-            payload = request.get_json(force=True, silent=True) or {}
-            ui = payload.get("ui") if isinstance(payload.get("ui"), dict) else {}
-            question = (payload.get("query") or "").strip()
-            if not question:
-                return jsonify({"error": "Missing query"}), 400
-
-            router = route_question(question)
-            route = router.get("route", "normal_intent")
-            stage_bucket = normalize_stage_bucket(payload.get("stage_bucket") or ui.get("stage_bucket"))
-            intent = plan_intent(question, route=route, stage_bucket=stage_bucket)
-
-            region = normalize_region(payload.get("region") or ui.get("region"))
-            country_code = country_code_for_region(region)
-            reporting_currency = normalize_reporting_currency(
-                payload.get("reporting_currency") or ui.get("reporting_currency")
-            )
+def plan_sql_answer(payload: dict, ctx: RequestContext, stage=None) -> dict:
+    stage = stage or (lambda name: None)
+    ui = payload.get("ui") if isinstance(payload.get("ui"), dict) else {}
+    question = (payload.get("query") or "").strip()
+    bypass_cache = bool(payload.get("bypass_cache"))
+    ctx.use_llm_cache = not bypass_cache
+    stage_bucket = normalize_stage_bucket(payload.get("stage_bucket") or ui.get("stage_bucket"))
+    region = normalize_region(payload.get("region") or ui.get("region"))
+    country_code = country_code_for_region(region)
+    reporting_currency = normalize_reporting_currency(payload.get("reporting_currency") or ui.get("reporting_currency"))
 
+    cached = None
+    if not bypass_cache:
+        stage("question_cache")
+        cached = question_cache.lookup(question, region, reporting_currency, stage_bucket, ctx=ctx)
+    if cached:
+        intent = cached["intent"]
+        sql_text = cached["sql_text"]
+        route_used = cached["route"]
+        llm_raw = ""
+        prompt_used = "[question_cache] Reused validated SQL from a previously answered question."
+        sql_meta = {"generator_sql": sql_text, "validated_sql": sql_text, "similar_examples": []}
+    else:
+        try:
+            stage("route")
+            router = route_question(question, ctx=ctx)
+            route = router.get("route", "normal_intent")
+            stage("intent")
+            intent = plan_intent(question, route=route, stage_bucket=stage_bucket, ctx=ctx)
+            stage("generate_sql")
             sql_text, llm_raw, prompt_used, route_used, sql_meta = generate_sql_for_route(
                 route,
                 question,
@@ -440,37 +917,259 @@ def api_sql():
                 country_code,
                 reporting_currency,
                 stage_bucket,
+                ctx=ctx,
             )
+        except Exception:
+            discard_responses(ctx)
+            raise
+    return {
+        "question": question,
+        "region": region,
+        "reporting_currency": reporting_currency,
+        "stage_bucket": stage_bucket,
+        "bypass_cache": bypass_cache,
+        "max_rows": payload.get("max_rows"),
+        "cached": cached,
+        "intent": intent,
+        "sql_text": sql_text,
+        "route_used": route_used,
+        "llm_raw": llm_raw,
+        "prompt_used": prompt_used,
+        "sql_meta": sql_meta or {},
+    }
 
-            conn = get_connection()
-            cursor = conn.cursor()
-            cursor.execute(sql_text)
-            rows = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description] if cursor.description else []
-            conn.close()
-            rows_json = json_rows(rows)
 
-            return jsonify(
-                {
-                    "sql": sql_text,
-                    "llm_raw": llm_raw,
-                    "columns": columns,
-                    "rows": rows_json,
-                    "answer": format_rows(rows, columns),
-                    "prompt": prompt_used,
-                    "route_used": route_used,
-                    "intent": intent,
-                    "generator_sql": (sql_meta or {}).get("generator_sql"),
-                    "validated_sql": (sql_meta or {}).get("validated_sql"),
-                    "similar_examples": (sql_meta or {}).get("similar_examples", []),
-                }
+def sql_answer_fields(plan: dict, ctx: RequestContext) -> dict:
+    cached = plan["cached"]
+    sql_meta = plan["sql_meta"]
+    return {
+        "route_used": plan["route_used"],
+        "intent": plan["intent"],
+        "question_cache": {k: cached[k] for k in ("id", "question", "match", "score")} if cached else {"match": None},
+        "generator_sql": sql_meta.get("generator_sql"),
+        "validated_sql": sql_meta.get("validated_sql"),
+        "similar_examples": sql_meta.get("similar_examples", []),
+        "validator": sql_meta.get("validator"),
+        "compiler": sql_meta.get("compiler"),
+        "prompt_size": sql_meta.get("prompt_size"),
+        "request_memo": ctx.stats(),
+    }
+
+
+def remember_plan(plan: dict, ctx: RequestContext) -> None:
+    if plan["cached"]:
+        return
+    question_cache.store(
+        plan["question"],
+        plan["region"],
+        plan["reporting_currency"],
+        plan["stage_bucket"],
+        plan["route_used"],
+        plan["intent"],
+        plan["sql_text"],
+        ctx=ctx,
+    )
+
+
+def execute_sql_answer(plan: dict, ctx: RequestContext, stage=None, cancel_event=None, fmt: str = "rows") -> dict:
+    stage = stage or (lambda name: None)
+    stage("execute")
+    budget = budget_for(plan["route_used"]).limit_rows(plan["max_rows"])
+    try:
+        columns, rows, cache_status = cached_query(
+            lambda sql: replica.run_query(sql, budget, cancel_event=cancel_event),
+            plan["sql_text"],
+            plan["region"],
+            plan["reporting_currency"],
+            plan["stage_bucket"],
+            bypass=plan["bypass_cache"],
+            budget=budget,
+        )
+    except Exception as exc:
+        if not (isinstance(exc, QueryBudgetExceeded) and exc.kind == "cancelled"):
+            discard_responses(ctx)
+        raise
+    commit_responses(ctx)
+    remember_plan(plan, ctx)
+    snapshot = save_snapshot(
+        columns,
+        rows,
+        budget.column_types,
+        {
+            "sql": plan["sql_text"],
+            "route_used": plan["route_used"],
+            "region": plan["region"],
+            "reporting_currency": plan["reporting_currency"],
+            "stage_bucket": plan["stage_bucket"],
+            "truncated": budget.truncated,
+        },
+    )
+    stage("serialize")
+    return {
+        "sql": plan["sql_text"],
+        "llm_raw": plan["llm_raw"],
+        **shape_result(fmt, columns, rows, budget.column_types),
+        "answer": format_rows(rows, columns),
+        "cache": cache_status,
+        "snapshot": snapshot,
+        "source": budget.source,
+        "truncated": budget.truncated,
+        "budget": budget.report(),
+        "prompt": plan["prompt_used"],
+        **sql_answer_fields(plan, ctx),
+    }
+
+
+@app.post("/api/sql")
+def api_sql():
+    try:
+        payload = request.get_json(force=True, silent=True) or {}
+        if not (payload.get("query") or "").strip():
+            return jsonify({"error": "Missing query"}), 400
+
+        try:
+            fmt = requested_result_format(payload)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+        ctx = RequestContext()
+        plan = plan_sql_answer(payload, ctx)
+
+        stream_format = requested_stream_format(payload)
+        if stream_format:
+            return stream_result(
+                stream_format,
+                plan["sql_text"],
+                {"sql": plan["sql_text"], **sql_answer_fields(plan, ctx)},
+                max_rows=payload.get("max_rows"),
+                budget=budget_for(plan["route_used"]),
+                ctx=ctx,
+                on_complete=lambda: remember_plan(plan, ctx),
             )
+
+        result = execute_sql_answer(plan, ctx, fmt=fmt)
+        if fmt == "arrow":
+            return arrow_response(result)
+        return jsonify(result)
+    except QueryBudgetExceeded as exc:
+        return jsonify({"error": str(exc), "budget": exc.budget.report()}), 504
+    except FormatUnavailable as exc:
+        return jsonify({"error": str(exc)}), 406
     except Exception as exc:
         trace = traceback.format_exc()
         log_error(trace)
         return jsonify({"error": str(exc), "detail": trace}), 500
 
 
+def run_sql_job(job) -> dict:
+    ctx = RequestContext()
+    plan = plan_sql_answer(job.payload, ctx, stage=job.stage)
+    try:
+        return execute_sql_answer(
+            plan, ctx, stage=job.stage, cancel_event=job.cancel_event, fmt=result_format(job.payload.get("format"))
+        )
+    except QueryBudgetExceeded as exc:
+        if exc.kind == "cancelled":
+            raise JobCancelled("Job cancelled while the query was running.") from exc
+        raise
+
+
+@app.post("/api/jobs")
+def api_jobs_submit():
+    payload = request.get_json(force=True, silent=True) or {}
+    if not (payload.get("query") or "").strip():
+        return jsonify({"error": "Missing query"}), 400
+    try:
+        fmt = requested_result_format(payload)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except FormatUnavailable as exc:
+        return jsonify({"error": str(exc)}), 406
+    if fmt == "arrow":
+        return jsonify({"error": "Job results are JSON; use format=columnar or format=rows."}), 400
+    payload["format"] = fmt
+    try:
+        job = JOBS.submit("sql", payload, run_sql_job)
+    except JobQueueFull as exc:
+        response = jsonify({"error": str(exc), "retry_after_s": exc.retry_after_s})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(exc.retry_after_s)
+        return response
+    response = jsonify({"id": job.id, "status": job.status, "url": f"/api/jobs/{job.id}"})
+    response.status_code = 202
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return response
+
+
+@app.get("/api/jobs")
+def api_jobs_list():
+    return jsonify({"jobs": [job.snapshot(include_result=False) for job in JOBS.list()], "stats": JOBS.stats()})
+
+
+@app.get("/api/jobs/<job_id>")
+def api_jobs_get(job_id: str):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.snapshot())
+
+
+@app.delete("/api/jobs/<job_id>")
+def api_jobs_cancel(job_id: str):
+    job = JOBS.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"ok": True, **job.snapshot(include_result=False)})
+
+
+@app.get("/api/results")
+def api_results_stats():
+    return jsonify({"result_store": get_result_store().stats()})
+
+
+@app.get("/api/results/<snapshot_id>")
+def api_results_page(snapshot_id: str):
+    try:
+        fmt = requested_result_format({})
+        columns = [c.strip() for c in (request.args.get("columns") or "").split(",") if c.strip()]
+        page = get_result_store().page(
+            snapshot_id,
+            limit=request.args.get("limit", 100, type=int),
+            cursor=request.args.get("cursor"),
+            sort=request.args.get("sort"),
+            order=request.args.get("order"),
+            columns=columns or None,
+        )
+    except SnapshotNotFound as exc:
+        return jsonify({"error": str(exc)}), 404
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    except FormatUnavailable as exc:
+        return jsonify({"error": str(exc)}), 406
+    result = {
+        "id": page.pop("id"),
+        **shape_result(fmt, page.pop("columns"), page.pop("rows"), page.pop("types")),
+        **page,
+    }
+    if fmt == "arrow":
+        try:
+            return arrow_response(result)
+        except FormatUnavailable as exc:
+            return jsonify({"error": str(exc)}), 406
+    return jsonify(result)
+
+
+@app.delete("/api/results/<snapshot_id>")
+def api_results_delete(snapshot_id: str):
+    try:
+        removed = get_result_store().delete(snapshot_id)
+    except SnapshotNotFound as exc:
+        return jsonify({"error": str(exc)}), 404
+    if not removed:
+        return jsonify({"error": "Snapshot not found or expired."}), 404
+    return jsonify({"ok": True, "id": snapshot_id})
+
+
 @app.get("/")
 def index():
     return send_from_directory(BASE_DIR, "index.html")
@@ -1,13 +1,65 @@
+import json
+import os
+import re
+import threading
+
+from . import intent_compiler
 from .business_rules import get_business_rules, legal_entity_name
-from .db import get_schema_details_text, get_schema_text
 from .example_store import find_similar_examples
-from .gemini_client import call_gemini
+from .gemini_client import call_gemini, reject_response
+from .intent_compiler import UnsupportedIntent, compile_intent
+from .metrics import span, traced
 from .prompt_builder import (
+    DATE_JOIN_RULES,
     build_narrative_prompt,
     build_sql_from_analytics_prompt,
     build_sql_from_intent_prompt,
     build_sql_validator_prompt,
+    date_rules_for,
 )
+from .request_context import RequestContext, memoize
+from .schema_catalog import build_schema_context, estimate_tokens
+from .warehouse_schema import get_schema_text
+
+VALIDATOR_MODES = ('auto', 'always', 'never')
+_READ_ONLY_VIOLATIONS = {
+    'insert', 'update', 'delete', 'merge', 'drop', 'alter', 'create', 'truncate',
+    'exec', 'execute', 'grant', 'revoke', 'deny', 'into', 'openrowset', 'openquery',
+}
+_DIALECT_VIOLATIONS = {
+    'limit': 'T-SQL does not support LIMIT. Use TOP or OFFSET/FETCH.',
+    'ilike': 'T-SQL does not support ILIKE. Use LIKE.',
+    'date_trunc': 'T-SQL does not support DATE_TRUNC. Use DATEFROMPARTS/DATETRUNC on dw.DimDate columns.',
+    'now': 'T-SQL does not support NOW(). Use GETDATE().',
+    'nulls': 'T-SQL does not support NULLS FIRST/LAST in ORDER BY.',
+}
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.S)
+_WORD_RE = re.compile(r'[a-z_][a-z0-9_]*')
+
+_VALIDATOR_STATS = {'checks': 0, 'skipped': 0, 'invoked': 0, 'fixed': 0, 'unresolved': 0, 'autofixed': 0}
+_VALIDATOR_LOCK = threading.Lock()
+
+
+def compiler_enabled() -> bool:
+    return os.environ.get('INTENT_COMPILER_ENABLED', '1').strip().lower() not in {'0', 'false', 'no', 'off'}
+
+
+def validator_mode() -> str:
+    mode = os.environ.get('SQL_VALIDATOR_MODE', 'auto').strip().lower()
+    return mode if mode in VALIDATOR_MODES else 'auto'
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _VALIDATOR_LOCK:
+        _VALIDATOR_STATS[name] += amount
+
+
+def validator_stats() -> dict:
+    with _VALIDATOR_LOCK:
+        data = dict(_VALIDATOR_STATS)
+    data['skip_rate'] = round(data['skipped'] / data['checks'], 4) if data['checks'] else 0.0
+    data['mode'] = validator_mode()
+    return data
 
 
 def validate_sql(sql: str) -> str:
@@ -55,9 +107,11 @@ def enforce_sql_requirements(
     country_code: str = 'GBR',
     reporting_currency: str = 'GBP',
     stage_bucket: str = 'pipeline',
+    ctx: RequestContext | None = None,
 ) -> list[str]:
     if (sql_text or '').strip() == '-- CANNOT_ANSWER':
         return []
+    rules = memoize(ctx, 'business_rules', None, get_business_rules)
     sql_lower = sql_text.lower()
     sql_norm = (
         sql_lower.replace('[', '')
@@ -76,7 +130,7 @@ def enforce_sql_requirements(
         'grp.dimlegalentity',
         'dle',
         'dle.legal_entity_name',
-        legal_entity_name().lower(),
+        legal_entity_name(rules).lower(),
         'dle.country_code',
         country_code.lower(),
     ]
@@ -91,7 +145,7 @@ def enforce_sql_requirements(
     if ' limit ' in f' {sql_norm} ':
         violations.append('T-SQL does not support LIMIT. Use TOP or OFFSET/FETCH.')
 
-    stage_rule = get_business_rules().get('stage_buckets', {}).get(stage_bucket, {})
+    stage_rule = rules.get('stage_buckets', {}).get(stage_bucket, {})
     stage_mode = str(stage_rule.get('mode', 'in')).lower()
     stage_values = [str(v).lower() for v in stage_rule.get('values', [])]
     if stage_mode == 'none':
@@ -128,6 +182,83 @@ def enforce_analytics_requirements(question: str, sql_text: str) -> list[str]:
     return violations
 
 
+def _strip_literals(sql_text: str) -> str:
+    return _LITERAL_RE.sub(' ', sql_text or '')
+
+
+def autofix_sql_dialect(sql_text: str) -> str:
+    fixed = re.sub(r'`([^`]+)`', r'[\1]', sql_text or '')
+    fixed = re.sub(r'\bilike\b', 'LIKE', fixed, flags=re.I)
+    fixed = re.sub(r'\bnow\s*\(\s*\)', 'GETDATE()', fixed, flags=re.I)
+    fixed = fixed.strip().rstrip(';').rstrip()
+    match = re.search(r'\s+limit\s+(\d+)\s*$', fixed, flags=re.I)
+    if match and re.match(r'select\s', fixed, flags=re.I) and not re.match(r'select\s+(distinct\s+)?top\b', fixed, flags=re.I):
+        head = fixed[: match.start()]
+        distinct = re.match(r'select\s+distinct\s', head, flags=re.I)
+        prefix_len = distinct.end() if distinct else len('select ')
+        fixed = head[:prefix_len] + f'TOP {match.group(1)} ' + head[prefix_len:].lstrip()
+    if fixed != (sql_text or '').strip().rstrip(';').rstrip():
+        _count('autofixed')
+    return fixed
+
+
+@traced('local_sql_check')
+def check_sql_locally(
+    sql_text: str,
+    country_code: str = 'GBR',
+    reporting_currency: str = 'GBP',
+    stage_bucket: str = 'pipeline',
+    question: str = '',
+    analytics: bool = False,
+    ctx: RequestContext | None = None,
+) -> list[str]:
+    if (sql_text or '').strip() == '-- CANNOT_ANSWER':
+        return []
+    code = _strip_literals(sql_text).lower()
+    words = set(_WORD_RE.findall(code))
+    problems: list[str] = []
+
+    if ';' in code.strip().rstrip(';'):
+        problems.append('SQL must be a single statement.')
+    write_words = sorted(words & _READ_ONLY_VIOLATIONS)
+    if write_words:
+        problems.append('SQL must be read-only; found: ' + ', '.join(write_words) + '.')
+    if not re.match(r'\s*(select|with)\b', code):
+        problems.append('SQL must start with SELECT or WITH.')
+
+    for word in sorted(words & set(_DIALECT_VIOLATIONS)):
+        if word == 'now' and not re.search(r'\bnow\s*\(', code):
+            continue
+        if word == 'nulls' and not re.search(r'\bnulls\s+(first|last)\b', code):
+            continue
+        problems.append(_DIALECT_VIOLATIONS[word])
+    if '`' in code:
+        problems.append('T-SQL quotes identifiers with [brackets], not backticks.')
+    if '::' in code:
+        problems.append('T-SQL does not support :: casts. Use CAST(... AS ...).')
+    depth = 0
+    for char in code:
+        depth += (char == '(') - (char == ')')
+        if depth < 0:
+            break
+    if depth != 0:
+        problems.append('Unbalanced parentheses.')
+
+    for violation in enforce_sql_requirements(
+        sql_text,
+        country_code=country_code,
+        reporting_currency=reporting_currency,
+        stage_bucket=stage_bucket,
+        ctx=ctx,
+    ):
+        if violation not in problems:
+            problems.append(violation)
+    if analytics:
+        problems.extend(enforce_analytics_requirements(question, sql_text))
+    return problems
+
+
+@traced('llm_validator')
 def validate_and_fix_sql_with_llm(
     question: str,
     intent: dict,
@@ -136,6 +267,7 @@ def validate_and_fix_sql_with_llm(
     reporting_currency: str,
     stage_bucket: str,
     few_shot_examples: list[dict] | None = None,
+    ctx: RequestContext | None = None,
 ) -> tuple[str, str]:
     prompt = build_sql_validator_prompt(
         question=question,
@@ -146,7 +278,7 @@ def validate_and_fix_sql_with_llm(
         stage_bucket=stage_bucket,
         few_shot_examples=few_shot_examples,
     )
-    raw = call_gemini(prompt)
+    raw = call_gemini(prompt, ctx=ctx)
     if not raw:
         return sql_text, ''
     candidate = extract_sql_snippet(raw) or raw
@@ -154,18 +286,146 @@ def validate_and_fix_sql_with_llm(
         fixed = validate_sql(candidate)
         return fixed, raw
     except Exception:
+        reject_response(ctx, raw)
         return sql_text, raw
 
 
+def review_generated_sql(
+    question: str,
+    intent: dict,
+    sql_text: str,
+    country_code: str,
+    reporting_currency: str,
+    stage_bucket: str,
+    few_shot_examples: list[dict] | None = None,
+    analytics: bool = False,
+    ctx: RequestContext | None = None,
+) -> tuple[str, str, list[str], dict]:
+    mode = validator_mode()
+    check = lambda sql: check_sql_locally(
+        sql, country_code, reporting_currency, stage_bucket, question=question, analytics=analytics, ctx=ctx
+    )
+    problems = check(sql_text)
+    report = {'mode': mode, 'local_problems': problems, 'invoked': False}
+    _count('checks')
+    if mode == 'never' or (mode == 'auto' and not problems):
+        _count('skipped')
+        return sql_text, '', problems, report
+
+    _count('invoked')
+    report['invoked'] = True
+    fixed_sql, validator_raw = validate_and_fix_sql_with_llm(
+        question=question,
+        intent=intent,
+        sql_text=sql_text,
+        country_code=country_code,
+        reporting_currency=reporting_currency,
+        stage_bucket=stage_bucket,
+        few_shot_examples=few_shot_examples,
+        ctx=ctx,
+    )
+    fixed_sql = autofix_sql_dialect(fixed_sql)
+    remaining = check(fixed_sql)
+    if problems and not remaining:
+        _count('fixed')
+    elif remaining:
+        _count('unresolved')
+        reject_response(ctx, validator_raw)
+    return fixed_sql, validator_raw, remaining, report
+
+
+def _validator_summary(reports: list[dict]) -> dict:
+    stats = validator_stats()
+    return {
+        'mode': stats['mode'],
+        'invoked': sum(1 for r in reports if r['invoked']),
+        'skipped': sum(1 for r in reports if not r['invoked']),
+        'local_problems': reports[-1]['local_problems'] if reports else [],
+        'skip_rate': stats['skip_rate'],
+        'skipped_total': stats['skipped'],
+        'checks_total': stats['checks'],
+    }
+
+
+def _schema_context(intent: dict, question: str, analytics: bool, ctx: RequestContext | None) -> tuple[str, dict]:
+    def build() -> tuple[str, dict]:
+        with span('schema_context'):
+            context = build_schema_context(intent, question, analytics)
+        if context is not None:
+            return context
+        text = memoize(ctx, 'schema_text', None, get_schema_text)
+        return text, {'pruned': False, 'tables': [], 'schema_chars_full': len(text)}
+
+    key = (analytics, question, json.dumps(intent, sort_keys=True, default=str))
+    return memoize(ctx, 'schema_context', key, build)
+
+
+def _prompt_size(prompt: str, schema_text: str, report: dict) -> dict:
+    unpruned = len(prompt) - len(schema_text) - len(date_rules_for(schema_text))
+    unpruned += report['schema_chars_full'] + len(DATE_JOIN_RULES)
+    return {
+        'chars': len(prompt),
+        'tokens_est': estimate_tokens(prompt),
+        'chars_unpruned': unpruned,
+        'tokens_unpruned_est': estimate_tokens(unpruned),
+        'schema_chars': len(schema_text),
+        'schema_chars_full': report['schema_chars_full'],
+        'tables': report['tables'],
+        'pruned': report['pruned'],
+    }
+
+
+@traced('intent_compiler')
+def try_compile_intent(
+    intent: dict,
+    country_code: str,
+    reporting_currency: str,
+    stage_bucket: str,
+    ctx: RequestContext | None = None,
+) -> tuple[str | None, str]:
+    if not compiler_enabled():
+        return None, 'disabled'
+    rules = memoize(ctx, 'business_rules', None, get_business_rules)
+    try:
+        sql_text = validate_sql(compile_intent(intent, country_code, reporting_currency, stage_bucket, rules=rules))
+    except UnsupportedIntent as exc:
+        intent_compiler.record(False, str(exc))
+        return None, str(exc)
+    except RuntimeError as exc:
+        intent_compiler.record(False, f'Rejected by validate_sql: {exc}')
+        return None, f'Rejected by validate_sql: {exc}'
+    problems = check_sql_locally(sql_text, country_code, reporting_currency, stage_bucket, ctx=ctx)
+    if problems:
+        intent_compiler.record(False, 'Failed local checks: ' + '; '.join(problems))
+        return None, 'Failed local checks: ' + '; '.join(problems)
+    intent_compiler.record(True)
+    return sql_text, ''
+
+
 def generate_sql_from_intent(
     intent: dict,
     country_code: str,
     reporting_currency: str,
     stage_bucket: str,
     question: str = '',
+    ctx: RequestContext | None = None,
 ) -> tuple[str, str, str, dict]:
-    schema_text = get_schema_details_text() or get_schema_text()
-    examples = find_similar_examples(question, top_k=3) if question else []
+    compiled_sql, compile_reason = try_compile_intent(intent, country_code, reporting_currency, stage_bucket, ctx=ctx)
+    if compiled_sql:
+        return (
+            compiled_sql,
+            '',
+            '[intent_compiler] SQL compiled from intent without an LLM call.',
+            {
+                'generator_sql': compiled_sql,
+                'validated_sql': compiled_sql,
+                'similar_examples': [],
+                'compiler': {'used': True},
+            },
+        )
+
+    schema_text, schema_report = _schema_context(intent, question, False, ctx)
+    examples = find_similar_examples(question, top_k=3, ctx=ctx) if question else []
     prompt_used = build_sql_from_intent_prompt(
         intent,
         schema_text,
@@ -174,37 +434,36 @@ def generate_sql_from_intent(
         stage_bucket,
         few_shot_examples=examples,
     )
+    prompt_size = _prompt_size(prompt_used, schema_text, schema_report)
 
     sql_text = None
     llm_raw = None
     generator_sql = ''
     validated_sql = ''
     last_violations: list[str] = []
+    reports: list[dict] = []
     for _ in range(2):
-        llm_raw = call_gemini(prompt_used)
+        llm_raw = call_gemini(prompt_used, ctx=ctx)
         if not llm_raw:
             raise RuntimeError('LLM returned no SQL.')
+        generator_raw = llm_raw
         sql_candidate = extract_sql_snippet(llm_raw) or llm_raw
-        generator_sql = validate_sql(sql_candidate)
-        sql_text = generator_sql
-        sql_text, validator_raw = validate_and_fix_sql_with_llm(
-            question=question,
-            intent=intent,
-            sql_text=sql_text,
-            country_code=country_code,
-            reporting_currency=reporting_currency,
-            stage_bucket=stage_bucket,
+        generator_sql = validate_sql(autofix_sql_dialect(sql_candidate))
+        sql_text, validator_raw, violations, report = review_generated_sql(
+            question,
+            intent,
+            generator_sql,
+            country_code,
+            reporting_currency,
+            stage_bucket,
             few_shot_examples=examples,
+            analytics=False,
+            ctx=ctx,
         )
+        reports.append(report)
         if validator_raw:
             llm_raw = (llm_raw or '') + '\n\n[sql_validator]\n' + validator_raw
         validated_sql = sql_text
-        violations = enforce_sql_requirements(
-            sql_text,
-            country_code=country_code,
-            reporting_currency=reporting_currency,
-            stage_bucket=stage_bucket,
-        )
         if not violations:
             return (
                 sql_text,
@@ -214,9 +473,13 @@ def generate_sql_from_intent(
                     'generator_sql': generator_sql,
                     'validated_sql': validated_sql or sql_text,
                     'similar_examples': examples,
+                    'validator': _validator_summary(reports),
+                    'prompt_size': prompt_size,
+                    'compiler': {'used': False, 'reason': compile_reason},
                 },
             )
         last_violations = violations
+        reject_response(ctx, generator_raw)
         prompt_used = (
             prompt_used
             + '\nYour previous SQL was INVALID.\n'
@@ -230,6 +493,7 @@ def generate_sql_from_intent(
     raise RuntimeError('SQL did not meet hard requirements:\n' + '\n'.join(last_violations))
 
 
+@traced('generate_sql')
 def generate_sql_for_route(
     route: str,
     question: str,
@@ -237,15 +501,16 @@ def generate_sql_for_route(
     country_code: str,
     reporting_currency: str,
     stage_bucket: str,
+    ctx: RequestContext | None = None,
 ) -> tuple[str, str, str, str, dict]:
     if route != 'analytics_agent':
         sql_text, llm_raw, prompt, meta = generate_sql_from_intent(
-            intent, country_code, reporting_currency, stage_bucket, question
+            intent, country_code, reporting_currency, stage_bucket, question, ctx=ctx
         )
         return sql_text, llm_raw, prompt, 'normal_intent', meta
 
-    schema_text = get_schema_details_text() or get_schema_text()
-    examples = find_similar_examples(question, top_k=3) if question else []
+    schema_text, schema_report = _schema_context(intent, question, True, ctx)
+    examples = find_similar_examples(question, top_k=3, ctx=ctx) if question else []
     prompt_used = build_sql_from_analytics_prompt(
         question,
         intent,
@@ -255,37 +520,35 @@ def generate_sql_for_route(
         stage_bucket,
         few_shot_examples=examples,
     )
+    prompt_size = _prompt_size(prompt_used, schema_text, schema_report)
 
     sql_text = None
     llm_raw = None
     generator_sql = ''
     validated_sql = ''
+    reports: list[dict] = []
     for _ in range(2):
-        llm_raw = call_gemini(prompt_used)
+        llm_raw = call_gemini(prompt_used, ctx=ctx)
         if not llm_raw:
             raise RuntimeError('LLM returned no SQL.')
+        generator_raw = llm_raw
         sql_candidate = extract_sql_snippet(llm_raw) or llm_raw
-        generator_sql = validate_sql(sql_candidate)
-        sql_text = generator_sql
-        sql_text, validator_raw = validate_and_fix_sql_with_llm(
-            question=question,
-            intent=intent,
-            sql_text=sql_text,
-            country_code=country_code,
-            reporting_currency=reporting_currency,
-            stage_bucket=stage_bucket,
+        generator_sql = validate_sql(autofix_sql_dialect(sql_candidate))
+        sql_text, validator_raw, violations, report = review_generated_sql(
+            question,
+            intent,
+            generator_sql,
+            country_code,
+            reporting_currency,
+            stage_bucket,
             few_shot_examples=examples,
+            analytics=True,
+            ctx=ctx,
         )
+        reports.append(report)
         if validator_raw:
             llm_raw = (llm_raw or '') + '\n\n[sql_validator]\n' + validator_raw
         validated_sql = sql_text
-        violations = enforce_sql_requirements(
-            sql_text,
-            country_code=country_code,
-            reporting_currency=reporting_currency,
-            stage_bucket=stage_bucket,
-        )
-        violations.extend(enforce_analytics_requirements(question, sql_text))
         if not violations:
             return (
                 sql_text,
@@ -296,8 +559,11 @@ def generate_sql_for_route(
                     'generator_sql': generator_sql,
                     'validated_sql': validated_sql or sql_text,
                     'similar_examples': examples,
+                    'validator': _validator_summary(reports),
+                    'prompt_size': prompt_size,
                 },
             )
+        reject_response(ctx, generator_raw)
         prompt_used = (
             prompt_used
             + '\nPrevious SQL violated requirements. Return ONLY corrected SQL.\n- '
@@ -308,7 +574,7 @@ def generate_sql_for_route(
         )
 
     fallback_sql, fallback_raw, fallback_prompt, fallback_meta = generate_sql_from_intent(
-        intent, country_code, reporting_currency, stage_bucket, question
+        intent, country_code, reporting_currency, stage_bucket, question, ctx=ctx
     )
     return (
         fallback_sql,
@@ -319,6 +585,7 @@ def generate_sql_for_route(
     )
 
 
+@traced('narrative')
 def call_gemini_nl(question: str, columns: list[str], rows: list[list], reporting_currency: str = 'GBP') -> str | None:
     payload = {
         'contents': [{'parts': [{'text': build_narrative_prompt(question, columns, rows, reporting_currency)}]}],
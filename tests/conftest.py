@@ -0,0 +1,12 @@
+import importlib.util
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# The repository root is the `core` package; import it under that name whatever the checkout is called.
+if 'core' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('core', ROOT / '__init__.py', submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['core'] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+from core import gemini_client
+from core.http_pool import HTTPStatusError, KeepAlivePool
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with server.lock:
+            server.requests.append((self.path, self.client_address[1]))
+            server.active += 1
+            server.peak = max(server.peak, server.active)
+            status, headers, body, close = server.plan.pop(0) if server.plan else (200, {}, b'{"ok": true}', False)
+        time.sleep(server.delay_s)
+        with server.lock:
+            server.active -= 1
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if close:
+            self.close_connection = True
+
+    def finish(self):
+        super().finish()
+        if self.close_connection:
+            self.server.closed.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.plan = []
+    httpd.active = 0
+    httpd.peak = 0
+    httpd.delay_s = 0.0
+    httpd.closed = threading.Event()
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    httpd.base_url = f'http://127.0.0.1:{httpd.server_address[1]}'
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def transport(server, monkeypatch):
+    monkeypatch.setenv('GEMINI_BASE_URL', server.base_url)
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setitem(gemini_client._TRANSPORT, 'pool', None)
+    monkeypatch.setitem(gemini_client._TRANSPORT, 'base_url', None)
+    sleeps = []
+    monkeypatch.setattr(gemini_client, 'time', SimpleNamespace(sleep=sleeps.append))
+    yield sleeps
+    gemini_client.get_transport().close()
+
+
+def test_reuses_keep_alive_connection(server):
+    pool = KeepAlivePool(server.base_url, max_connections=2)
+    for _ in range(3):
+        status, _, data = pool.request('POST', '/echo', body=b'{}')
+        assert status == 200
+        assert json.loads(data) == {'ok': True}
+    ports = {port for _, port in server.requests}
+    assert len(ports) == 1
+    stats = pool.stats()
+    assert stats['connects'] == 1
+    assert stats['reuses'] == 2
+    assert stats['idle'] == 1
+    pool.close()
+
+
+def test_limits_concurrent_requests(server):
+    server.delay_s = 0.05
+    pool = KeepAlivePool(server.base_url, max_connections=2)
+    workers = [threading.Thread(target=pool.request, args=('POST', '/slow'), kwargs={'body': b'{}'}) for _ in range(6)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(server.requests) == 6
+    assert server.peak == 2
+    stats = pool.stats()
+    assert stats['connects'] == 2
+    assert stats['in_flight'] == 0
+    assert stats['slot_wait_s'] > 0
+    pool.close()
+
+
+def test_slot_wait_times_out(server):
+    server.delay_s = 0.3
+    pool = KeepAlivePool(server.base_url, max_connections=1)
+    worker = threading.Thread(target=pool.request, args=('POST', '/slow'), kwargs={'body': b'{}'})
+    worker.start()
+    while not server.requests:
+        time.sleep(0.01)
+    with pytest.raises(TimeoutError):
+        pool.request('POST', '/slow', body=b'{}', timeout_s=0.05)
+    worker.join()
+    pool.close()
+
+
+def test_reconnects_after_server_closes_socket(server):
+    server.plan.append((200, {}, b'{"ok": true}', True))
+    pool = KeepAlivePool(server.base_url, max_connections=1)
+    pool.request('POST', '/first', body=b'{}')
+    assert server.closed.wait(1)
+    status, _, _ = pool.request('POST', '/second', body=b'{}')
+    assert status == 200
+    assert [path for path, _ in server.requests] == ['/first', '/second']
+    assert server.requests[0][1] != server.requests[1][1]
+    stats = pool.stats()
+    assert stats['stale_retries'] == 1
+    assert stats['connects'] == 2
+    pool.close()
+
+
+def test_post_json_raises_status_error(server, transport):
+    server.plan.append((400, {}, b'{"error": "bad"}', False))
+    with pytest.raises(HTTPStatusError) as info:
+        gemini_client._post_json('/v1beta/models/test:generateContent', {'q': 1}, 5)
+    assert info.value.status == 400
+    path, _ = server.requests[0]
+    assert path == '/v1beta/models/test:generateContent?key=test-key'
+
+
+def test_retries_429_and_503_honouring_retry_after(server, transport):
+    server.plan.extend(
+        [
+            (429, {'Retry-After': '2'}, b'{"error": "slow down"}', False),
+            (503, {'Retry-After': '0.5'}, b'{"error": "busy"}', False),
+        ]
+    )
+    data = gemini_client._post_with_retry('/v1beta/test', {'q': 1}, timeout_s=5, max_retries=2, kind='test')
+    assert data == {'ok': True}
+    assert transport == [2.0, 0.5]
+    assert len(server.requests) == 3
+    assert len({port for _, port in server.requests}) == 1
+
+
+def test_gives_up_after_max_retries(server, transport):
+    server.plan.extend([(503, {'Retry-After': '1'}, b'{"error": "busy"}', False)] * 3)
+    with pytest.raises(RuntimeError, match='HTTP 503'):
+        gemini_client._post_with_retry('/v1beta/test', {}, timeout_s=5, max_retries=2, kind='test')
+    assert transport == [1.0, 1.0]
+    assert len(server.requests) == 3
+
+
+def test_does_not_retry_client_errors(server, transport):
+    server.plan.append((400, {'Retry-After': '1'}, b'{"error": "bad request"}', False))
+    with pytest.raises(RuntimeError, match='HTTP 400'):
+        gemini_client._post_with_retry('/v1beta/test', {}, timeout_s=5, max_retries=2, kind='test')
+    assert transport == []
+    assert len(server.requests) == 1
@@ -0,0 +1,257 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from core import pool as pool_module
+from core.pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql):
+        if not self.conn.alive:
+            raise RuntimeError('connection is broken')
+        self.conn.executed.append(sql)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConn:
+    def __init__(self, number):
+        self.number = number
+        self.alive = True
+        self.closed = False
+        self.rollbacks = 0
+        self.fail_rollback = False
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise RuntimeError('rollback failed')
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDriver:
+    def __init__(self):
+        self.conns = []
+        self.fail = False
+
+    def connect(self):
+        if self.fail:
+            raise RuntimeError('login failed')
+        conn = FakeConn(len(self.conns))
+        self.conns.append(conn)
+        return conn
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def driver():
+    return FakeDriver()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pool_module, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def make_pool(driver, **kwargs):
+    kwargs.setdefault('ping_after_s', None)
+    return ConnectionPool(driver.connect, **kwargs)
+
+
+def test_reuses_idle_connection_and_rolls_back_on_checkin(driver):
+    pool = make_pool(driver)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(driver.conns) == 1
+    assert first.rollbacks == 2
+    stats = pool.stats()
+    assert stats['creates'] == 1
+    assert stats['checkouts'] == 2
+    assert stats['idle'] == 1
+    assert stats['in_use'] == 0
+
+
+def test_failed_rollback_closes_connection(driver):
+    pool = make_pool(driver)
+    with pool.connection() as conn:
+        conn.fail_rollback = True
+    assert conn.closed
+    assert pool.stats()['rollback_failures'] == 1
+    assert pool.size == 0
+    with pool.connection() as fresh:
+        assert fresh is not conn
+
+
+def test_acquire_times_out_when_pool_is_exhausted(driver):
+    pool = make_pool(driver, max_size=1)
+    with pool.connection():
+        started = time.monotonic()
+        with pytest.raises(PoolTimeout):
+            with pool.connection(timeout_s=0.05):
+                pass
+        assert time.monotonic() - started >= 0.05
+    stats = pool.stats()
+    assert stats['timeouts'] == 1
+    assert stats['waits'] == 1
+    assert stats['wait_time_s'] > 0
+
+
+def test_waiter_gets_connection_released_by_another_thread(driver):
+    pool = make_pool(driver, max_size=1)
+    checked_out = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            checked_out.set()
+            release.wait(1)
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    checked_out.wait(1)
+    threading.Timer(0.05, release.set).start()
+    with pool.connection(timeout_s=1) as conn:
+        assert conn is driver.conns[0]
+    worker.join()
+    assert pool.stats()['waits'] == 1
+    assert len(driver.conns) == 1
+
+
+def test_ping_failure_discards_connection(driver, clock):
+    pool = make_pool(driver, ping_after_s=30)
+    with pool.connection() as stale:
+        pass
+    stale.alive = False
+    clock.now += 31
+    with pool.connection() as conn:
+        assert conn is not stale
+    assert stale.closed
+    assert pool.stats()['health_failures'] == 1
+    assert len(driver.conns) == 2
+
+
+def test_recent_connection_is_not_pinged(driver, clock):
+    pool = make_pool(driver, ping_after_s=30)
+    with pool.connection() as conn:
+        pass
+    clock.now += 5
+    with pool.connection():
+        pass
+    assert conn.executed == []
+
+
+def test_error_inside_block_discards_broken_connection(driver):
+    pool = make_pool(driver)
+    with pytest.raises(ValueError):
+        with pool.connection() as conn:
+            conn.alive = False
+            raise ValueError('query failed')
+    assert conn.closed
+    assert pool.stats()['discards'] == 1
+    assert pool.size == 0
+
+
+def test_idle_connection_expires_on_checkout(driver, clock):
+    pool = make_pool(driver, max_idle_s=60, max_lifetime_s=0)
+    with pool.connection() as old:
+        pass
+    clock.now += 61
+    with pool.connection() as conn:
+        assert conn is not old
+    assert old.closed
+    assert pool.stats()['idle_evictions'] == 1
+
+
+def test_lifetime_recycles_on_checkin(driver, clock):
+    pool = make_pool(driver, max_idle_s=0, max_lifetime_s=100)
+    with pool.connection() as conn:
+        clock.now += 101
+    assert conn.closed
+    assert pool.stats()['lifetime_recycles'] == 1
+    assert pool.size == 0
+
+
+def test_prune_keeps_min_size_idle_but_recycles_old_connections(driver, clock):
+    pool = make_pool(driver, min_size=1, max_idle_s=60, max_lifetime_s=600)
+    with pool.connection():
+        with pool.connection():
+            pass
+    assert pool.stats()['idle'] == 2
+    clock.now += 61
+    assert pool.prune() == 1
+    assert pool.stats()['idle'] == 1
+    clock.now += 600
+    assert pool.prune() == 1
+    assert pool.size == 0
+    stats = pool.stats()
+    assert stats['idle_evictions'] == 1
+    assert stats['lifetime_recycles'] == 1
+
+
+def test_maintain_warms_to_min_size(driver):
+    pool = make_pool(driver, min_size=2, max_size=4)
+    pool.maintain()
+    stats = pool.stats()
+    assert stats['idle'] == 2
+    assert stats['creates'] == 2
+    assert stats['maintenance_runs'] == 1
+
+
+def test_maintain_counts_warm_failures(driver):
+    driver.fail = True
+    pool = make_pool(driver, min_size=1)
+    pool.maintain()
+    stats = pool.stats()
+    assert stats['warm_failures'] == 1
+    assert stats['create_failures'] == 1
+    assert stats['size'] == 0
+
+
+def test_background_maintenance_warms_pool(driver):
+    pool = make_pool(driver, min_size=2, maintenance_interval_s=0.01)
+    pool.start()
+    try:
+        deadline = time.monotonic() + 2
+        while pool.stats()['idle'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.stats()['idle'] == 2
+        assert pool.stats()['maintenance_running']
+    finally:
+        pool.close()
+    assert all(conn.closed for conn in driver.conns)
+
+
+def test_closed_pool_rejects_checkout(driver):
+    pool = make_pool(driver)
+    pool.close()
+    with pytest.raises(RuntimeError):
+        with pool.connection():
+            pass
@@ -0,0 +1,315 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+
+from .config import SCHEMA_CACHE_PATH, env_float, log_error
+from .db import TABLE_ALLOWLIST, pooled_connection
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SCHEMA_CACHE_VERSION = 1
+
+_TABLES_SQL = '''
+SELECT TABLE_SCHEMA, TABLE_NAME
+FROM INFORMATION_SCHEMA.TABLES
+WHERE TABLE_TYPE = 'BASE TABLE'
+ORDER BY TABLE_SCHEMA, TABLE_NAME
+'''
+_COLUMNS_SQL = '''
+SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE
+FROM INFORMATION_SCHEMA.COLUMNS
+ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION
+'''
+_PROBE_SQL = '''
+SELECT COUNT(*), MAX(modify_date)
+FROM sys.objects
+WHERE type IN ('U', 'V')
+'''
+
+
+def _checksum(tables: list[str], columns: dict[str, list[list[str]]]) -> str:
+    material = json.dumps({'tables': tables, 'columns': columns}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class WarehouseSchema:
+    def __init__(self, tables: list[str], columns: dict[str, list[list[str]]], probe: str | None, fetched_at: float):
+        self.tables = tables
+        self.columns = columns
+        self.probe = probe
+        self.fetched_at = fetched_at
+        self.checksum = _checksum(tables, columns)
+        self.allowed_tables = [name for name in tables if not TABLE_ALLOWLIST or name in TABLE_ALLOWLIST]
+        self.schema_text = self._render()
+
+    def _render(self) -> str:
+        lines = ['Database schema:']
+        for table, cols in self.columns.items():
+            if TABLE_ALLOWLIST and table not in TABLE_ALLOWLIST:
+                continue
+            lines.append(f'Table {table}: ' + ', '.join(f'{column} ({dtype})' for column, dtype in cols))
+        return '\n'.join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                'version': SCHEMA_CACHE_VERSION,
+                'checksum': self.checksum,
+                'probe': self.probe,
+                'fetched_at': self.fetched_at,
+                'tables': self.tables,
+                'columns': self.columns,
+            },
+            separators=(',', ':'),
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> 'WarehouseSchema':
+        data = json.loads(text)
+        if data.get('version') != SCHEMA_CACHE_VERSION:
+            raise ValueError(f"Unsupported schema cache version {data.get('version')!r}.")
+        schema = cls(data['tables'], data['columns'], data.get('probe'), data['fetched_at'])
+        if schema.checksum != data.get('checksum'):
+            raise ValueError('Schema cache checksum mismatch.')
+        return schema
+
+
+def fetch_schema(probe: str | None = None) -> WarehouseSchema:
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_TABLES_SQL)
+            tables = [f'{row[0]}.{row[1]}' for row in cursor.fetchall()]
+            cursor.execute(_COLUMNS_SQL)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    columns: dict[str, list[list[str]]] = {}
+    for schema, table, column, dtype in rows:
+        columns.setdefault(f'{schema}.{table}', []).append([column, dtype])
+    return WarehouseSchema(tables, columns, probe, time.time())
+
+
+def probe_schema() -> str:
+    with pooled_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_PROBE_SQL)
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+    return json.dumps([str(value) for value in row or ()])
+
+
+class SchemaCache:
+    def __init__(self, path: str, probe_interval_s: float = 300.0):
+        self.path = path
+        self.probe_interval_s = probe_interval_s
+        self._schema: WarehouseSchema | None = None
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._probe_ok = True
+        self._stats = {
+            'disk_loads': 0,
+            'probes': 0,
+            'probe_errors': 0,
+            'refreshes': 0,
+            'changes': 0,
+            'unchanged': 0,
+            'skipped_locked': 0,
+            'errors': 0,
+        }
+        self._last = {'checked_at': None, 'changed_at': None, 'error': None}
+
+    def _bump(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def _load_disk(self) -> WarehouseSchema | None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return self._schema
+        if self._schema is not None and mtime == self._mtime:
+            return self._schema
+        with self._lock:
+            if self._schema is None or mtime != self._mtime:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as handle:
+                        schema = WarehouseSchema.from_json(handle.read())
+                except (OSError, ValueError, KeyError, TypeError):
+                    log_error(traceback.format_exc())
+                    self._mtime = mtime
+                    return self._schema
+                self._schema = schema
+                self._mtime = mtime
+                self._stats['disk_loads'] += 1
+        return self._schema
+
+    def _write_disk(self, schema: WarehouseSchema) -> None:
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as handle:
+            handle.write(schema.to_json())
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._schema = schema
+            self._mtime = os.path.getmtime(self.path)
+
+    def get(self) -> WarehouseSchema:
+        schema = self._load_disk()
+        if schema is not None:
+            return schema
+        self.refresh(wait=True)
+        schema = self._load_disk() or self._schema
+        if schema is None:
+            raise RuntimeError(self._last['error'] or 'Schema catalog is not available.')
+        return schema
+
+    def warm(self) -> bool:
+        return self._load_disk() is not None
+
+    def _acquire_file_lock(self, wait: bool):
+        if fcntl is None:
+            return None, True
+        handle = open(f'{self.path}.lock', 'a+', encoding='utf-8')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None, False
+        return handle, True
+
+    def _recently_checked(self, handle) -> bool:
+        if handle is None:
+            return False
+        handle.seek(0)
+        try:
+            checked_at = float(handle.read().strip() or 0)
+        except ValueError:
+            return False
+        return time.time() - checked_at < self.probe_interval_s
+
+    def _mark_checked(self, handle, now: float) -> None:
+        with self._lock:
+            self._last['checked_at'] = now
+        if handle is not None:
+            handle.seek(0)
+            handle.truncate()
+            handle.write(str(now))
+            handle.flush()
+
+    def refresh(self, force: bool = False, wait: bool = False) -> str:
+        with self._refresh_lock:
+            handle, acquired = self._acquire_file_lock(wait)
+            if not acquired:
+                self._bump('skipped_locked')
+                return 'locked'
+            try:
+                current = self._load_disk()
+                if current is not None and not force and self._recently_checked(handle):
+                    return 'fresh'
+                probe = None
+                try:
+                    probe = probe_schema()
+                    self._bump('probes')
+                except Exception:
+                    log_error(traceback.format_exc())
+                    self._bump('probe_errors')
+                self._probe_ok = probe is not None
+                now = time.time()
+                if current is not None and not force and probe is not None and probe == current.probe:
+                    self._bump('unchanged')
+                    self._mark_checked(handle, now)
+                    return 'unchanged'
+                schema = fetch_schema(probe)
+                self._bump('refreshes')
+                if current is not None and schema.checksum == current.checksum and probe == current.probe:
+                    self._bump('unchanged')
+                    self._mark_checked(handle, now)
+                    return 'unchanged'
+                self._write_disk(schema)
+                self._mark_checked(handle, now)
+                changed = current is None or schema.checksum != current.checksum
+                if changed:
+                    self._bump('changes')
+                    with self._lock:
+                        self._last['changed_at'] = now
+                return 'changed' if changed else 'unchanged'
+            except Exception as exc:
+                log_error(traceback.format_exc())
+                self._bump('errors')
+                with self._lock:
+                    self._last['error'] = str(exc)
+                return 'error'
+            finally:
+                if handle is not None:
+                    handle.close()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.probe_interval_s)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='schema-cache', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> dict:
+        schema = self._schema
+        with self._lock:
+            data = dict(self._stats)
+            data.update({f'last_{key}': value for key, value in self._last.items()})
+        data['path'] = self.path
+        data['probe_interval_s'] = self.probe_interval_s
+        data['probe_ok'] = self._probe_ok
+        data['refresher_running'] = bool(self._thread and self._thread.is_alive())
+        data['loaded'] = schema is not None
+        if schema is not None:
+            data['checksum'] = schema.checksum
+            data['fetched_at'] = schema.fetched_at
+            data['tables'] = len(schema.tables)
+            data['allowed_tables'] = len(schema.allowed_tables)
+            data['schema_chars'] = len(schema.schema_text)
+        return data
+
+
+_SCHEMA_CACHE = {'cache': None}
+_SCHEMA_CACHE_LOCK = threading.Lock()
+
+
+def get_schema_cache() -> SchemaCache:
+    cache = _SCHEMA_CACHE['cache']
+    if cache is not None:
+        return cache
+    with _SCHEMA_CACHE_LOCK:
+        if _SCHEMA_CACHE['cache'] is None:
+            _SCHEMA_CACHE['cache'] = SchemaCache(
+                os.environ.get('SCHEMA_CACHE_PATH') or SCHEMA_CACHE_PATH,
+                probe_interval_s=env_float('SCHEMA_PROBE_INTERVAL_S', 300.0),
+            )
+        return _SCHEMA_CACHE['cache']
+
+
+def get_schema_text() -> str:
+    return get_schema_cache().get().schema_text
+
+
+def list_tables() -> list[str]:
+    return list(get_schema_cache().get().allowed_tables)